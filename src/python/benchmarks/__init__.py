@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Ingest and admin API benchmarks
+
+Run from src/python::
+
+    python -m benchmarks coap --devices 50 --rate 20 --duration 30 --output coap.json
+    python -m benchmarks coap --storage postgres --batch-size 100 --output coap-batch.json
+    python -m benchmarks admin --users 20 --duration 30 --output admin.json
+    python -m benchmarks compare baselines/coap.json coap.json --tolerance 0.1
+
+coap and admin start FogLAMP in a child process, with the storage layer
+mocked (the default) or connected to the database in foglamp-env.yaml,
+and save their results as JSON. compare exits with status 1 when a
+result is worse than a baseline by more than the tolerance.
+"""
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
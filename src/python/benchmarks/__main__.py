@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Command line interface. See benchmarks/__init__.py."""
+
+import argparse
+import asyncio
+import sys
+
+from benchmarks import admin_load, coap_load, results
+from benchmarks.payloads import SHAPES
+from benchmarks.server import STORAGE_MODES, Server
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+
+def _print_metrics(metrics):
+    for name in sorted(metrics):
+        print('{:30} {}'.format(name, metrics[name]))
+
+
+def _run(benchmark, parameters, server, load):
+    with server:
+        metrics = asyncio.get_event_loop().run_until_complete(load)
+
+    document = results.result(benchmark, parameters, metrics)
+    _print_metrics(metrics)
+
+    if parameters['output']:
+        results.save(document, parameters['output'])
+
+    return 0
+
+
+def coap(args):
+    server = Server(args.storage, coap_port=args.coap_port, admin_port=args.admin_port)
+    load = coap_load.run(port=args.coap_port, devices=args.devices, rate=args.rate,
+                         duration=args.duration, shape=args.shape,
+                         batch_size=args.batch_size, seed=args.seed)
+    return _run('coap', vars(args), server, load)
+
+
+def admin(args):
+    server = Server(args.storage, coap_port=args.coap_port, admin_port=args.admin_port)
+    load = admin_load.run(port=args.admin_port, users=args.users, duration=args.duration,
+                          refresh_every=args.refresh_every)
+    return _run('admin', vars(args), server, load)
+
+
+def compare(args):
+    rows = results.compare(results.load(args.baseline), results.load(args.result), args.tolerance)
+    regressions = 0
+
+    print('{:30} {:>14} {:>14} {:>9}'.format('metric', 'baseline', 'result', 'change'))
+    for name, before, after, change, regressed in rows:
+        print('{:30} {:>14.6g} {:>14.6g} {:>+8.1%}{}'.format(
+            name, before, after, change, '  REGRESSION' if regressed else ''))
+        regressions += regressed
+
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='FogLAMP benchmarks')
+    subparsers = parser.add_subparsers(dest='command')
+
+    def add_server_arguments(subparser):
+        subparser.add_argument('--storage', choices=STORAGE_MODES, default='mock')
+        subparser.add_argument('--coap-port', type=int, default=56830)
+        subparser.add_argument('--admin-port', type=int, default=58080)
+        subparser.add_argument('--duration', type=float, default=10, help='seconds')
+        subparser.add_argument('--output', help='file the result is saved to as JSON')
+
+    coap_parser = subparsers.add_parser('coap', help='CoAP ingest load')
+    add_server_arguments(coap_parser)
+    coap_parser.add_argument('--devices', type=int, default=10)
+    coap_parser.add_argument('--rate', type=float, default=10, help='requests per second per device')
+    coap_parser.add_argument('--shape', choices=SHAPES, default='mixed')
+    coap_parser.add_argument('--batch-size', type=int, default=0,
+                             help='readings per request to sensor-values-batch (0: use sensor-values)')
+    coap_parser.add_argument('--seed', type=int, default=0)
+    coap_parser.set_defaults(function=coap)
+
+    admin_parser = subparsers.add_parser('admin', help='admin API login, refresh and whoami load')
+    add_server_arguments(admin_parser)
+    admin_parser.add_argument('--users', type=int, default=10)
+    admin_parser.add_argument('--refresh-every', type=int, default=10,
+                              help='whoami calls between token refreshes')
+    admin_parser.set_defaults(function=admin)
+
+    compare_parser = subparsers.add_parser('compare', help='compare a result with a baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('result')
+    compare_parser.add_argument('--tolerance', type=float, default=0.1,
+                                help='fraction by which a metric may get worse')
+    compare_parser.set_defaults(function=compare)
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 2
+
+    function = args.function
+    del args.function
+    return function(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
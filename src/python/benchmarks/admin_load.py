@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Admin API load generator
+
+Each simulated user logs in once and then, until the benchmark ends,
+calls whoami with its access token and refreshes the token every
+``refresh_every`` calls, one request at a time (a closed loop).
+"""
+
+import asyncio
+import time
+
+import aiohttp
+
+from benchmarks.results import Latencies
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+USERNAME = 'user'
+PASSWORD = 'password'
+"""The user that benchmarks.server creates"""
+
+
+async def _timed(session, method, url, latencies, **kwargs):
+    started = time.monotonic()
+    async with session.request(method, url, **kwargs) as response:
+        body = await response.json()
+        latencies.add(time.monotonic() - started, str(response.status))
+        return response.status, body
+
+
+async def _user(session, base_url, deadline, refresh_every, latencies):
+    status, body = await _timed(session, 'POST', base_url + '/api/auth/login', latencies['login'],
+                                json={'username': USERNAME, 'password': PASSWORD})
+    if status != 200:
+        return
+
+    access_token = body['access_token']
+    refresh_token = body['refresh_token']
+    calls = 0
+
+    while time.monotonic() < deadline:
+        await _timed(session, 'GET', base_url + '/api/example/whoami', latencies['whoami'],
+                     headers={'authorization': access_token})
+        calls += 1
+
+        if calls % refresh_every == 0:
+            status, body = await _timed(session, 'POST', base_url + '/api/auth/refresh-token',
+                                        latencies['refresh'],
+                                        headers={'authorization': refresh_token})
+            if status == 200:
+                access_token = body['access_token']
+
+
+async def run(host='127.0.0.1', port=8080, users=10, duration=10, refresh_every=10):
+    """Runs ``users`` simulated users for ``duration`` seconds
+
+    Returns:
+        dict: Metrics for benchmarks.results
+    """
+    latencies = {name: Latencies() for name in ('login', 'whoami', 'refresh')}
+    base_url = 'http://{}:{}'.format(host, port)
+    started = time.monotonic()
+
+    connector = aiohttp.TCPConnector(limit=users)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.gather(*[_user(session, base_url, started + duration, refresh_every, latencies)
+                               for _ in range(users)])
+
+    elapsed = time.monotonic() - started
+    metrics = {'seconds': elapsed}
+
+    for name, endpoint in latencies.items():
+        metrics.update(endpoint.summary(name + '_'))
+        metrics[name + '_throughput'] = endpoint.codes.get('200', 0) / elapsed
+        metrics[name + '_errors'] = sum(count for code, count in endpoint.codes.items() if code != '200')
+
+    return metrics
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""CoAP load generator
+
+Every simulated device has its own client context, and so its own
+source port, and sends ``rate`` requests per second on a fixed schedule
+whether or not earlier requests have been answered (an open loop), so a
+slow server shows up as latency and timeouts rather than as a lower
+send rate.
+"""
+
+import asyncio
+import time
+
+import aiocoap
+from cbor2 import dumps
+
+from benchmarks.payloads import PayloadGenerator
+from benchmarks.results import Latencies
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+_TIMEOUT = 10
+"""Seconds after which a request counts as timed out"""
+
+
+async def _send(context, uri, payload, latencies):
+    started = time.monotonic()
+    request = aiocoap.Message(code=aiocoap.numbers.codes.Code.POST, payload=payload, uri=uri)
+
+    try:
+        response = await asyncio.wait_for(context.request(request).response, _TIMEOUT)
+        code = response.code.dotted
+    except asyncio.TimeoutError:
+        code = 'timeout'
+    except Exception:
+        code = 'error'
+
+    latencies.add(time.monotonic() - started, code)
+
+
+async def _device(index, devices, host, port, rate, duration, shape, batch_size, seed, latencies):
+    context = await aiocoap.Context.create_client_context()
+    generator = PayloadGenerator(shape, seed=seed * 100003 + index)
+    loop = asyncio.get_event_loop()
+
+    if batch_size:
+        uri = 'coap://{}:{}/other/sensor-values-batch'.format(host, port)
+    else:
+        uri = 'coap://{}:{}/other/sensor-values'.format(host, port)
+
+    interval = 1.0 / rate
+    # Spread devices over the first interval so they do not send in step
+    next_send = loop.time() + interval * index / devices
+    end = loop.time() + duration
+    pending = []
+
+    while next_send < end:
+        await asyncio.sleep(max(0.0, next_send - loop.time()))
+
+        if batch_size:
+            payload = dumps(generator.batch(batch_size))
+        else:
+            payload = dumps(generator.reading())
+
+        pending.append(asyncio.ensure_future(_send(context, uri, payload, latencies)))
+        next_send += interval
+
+    if pending:
+        await asyncio.wait(pending)
+
+    await context.shutdown()
+
+
+async def run(host='localhost', port=5683, devices=10, rate=10, duration=10,
+              shape='mixed', batch_size=0, seed=0):
+    """Sends readings from ``devices`` simulated devices
+
+    Args:
+        rate (float): Requests per second per device
+        duration (float): Seconds to send for
+        shape (str): See benchmarks.payloads
+        batch_size (int): Readings per request. With 0, readings are sent
+            one per request to coap://other/sensor-values.
+
+    Returns:
+        dict: Metrics for benchmarks.results
+    """
+    latencies = Latencies()
+    started = time.monotonic()
+
+    await asyncio.gather(*[_device(index, devices, host, port, rate, duration, shape, batch_size, seed,
+                                   latencies)
+                           for index in range(devices)])
+
+    elapsed = time.monotonic() - started
+    ok = latencies.codes.get(aiocoap.numbers.codes.Code.VALID.dotted, 0)
+    readings_per_request = batch_size or 1
+
+    metrics = latencies.summary()
+    metrics.update({
+        'throughput': ok * readings_per_request / elapsed,
+        'request_throughput': ok / elapsed,
+        'errors': sum(count for code, count in latencies.codes.items()
+                      if code != aiocoap.numbers.codes.Code.VALID.dotted),
+        'seconds': elapsed
+    })
+    metrics.update({'code_' + code: count for code, count in latencies.codes.items()})
+    return metrics
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Reading payloads modelled on examples/node-red/three-assets.json
+
+- mouse and clock: a timestamp and an asset, no sensor values
+- sensortag: a TI SensorTag reading, one sensor per message
+- mixed: the three assets in equal proportions
+"""
+
+import datetime
+import random
+import uuid
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+SHAPES = ('mouse', 'clock', 'sensortag', 'mixed')
+
+
+def _sensortag(rng):
+    sensor = rng.choice(('temperature', 'humidity', 'pressure', 'luxometer',
+                         'accelerometer', 'gyroscope', 'magnetometer'))
+
+    if sensor == 'temperature':
+        values = {'object': round(rng.uniform(10, 40), 2), 'ambient': round(rng.uniform(10, 40), 2)}
+    elif sensor == 'humidity':
+        values = {'temperature': round(rng.uniform(10, 40), 2), 'humidity': round(rng.uniform(0, 100), 2)}
+    elif sensor == 'pressure':
+        values = {'pressure': round(rng.uniform(950, 1050), 2)}
+    elif sensor == 'luxometer':
+        values = {'lux': round(rng.uniform(0, 1000), 2)}
+    else:
+        values = {axis: round(rng.uniform(-2, 2), 4) for axis in ('x', 'y', 'z')}
+
+    return {sensor: values}
+
+
+class PayloadGenerator(object):
+    """Produces readings of one shape. The values are reproducible for
+    a given seed.
+    """
+
+    def __init__(self, shape='mixed', seed=0):
+        if shape not in SHAPES:
+            raise ValueError('shape must be one of {}'.format(', '.join(SHAPES)))
+
+        self.shape = shape
+        self._rng = random.Random(seed)
+
+    def reading(self):
+        """Returns a reading dict as sent to coap://other/sensor-values"""
+        shape = self.shape
+        if shape == 'mixed':
+            shape = self._rng.choice(('mouse', 'clock', 'sensortag'))
+
+        payload = {
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'key': str(uuid.UUID(int=self._rng.getrandbits(128), version=4))
+        }
+
+        if shape == 'sensortag':
+            payload['asset'] = 'TI SensorTag'
+            payload['sensor_values'] = _sensortag(self._rng)
+        else:
+            payload['asset'] = shape
+
+        return payload
+
+    def batch(self, size):
+        """Returns ``size`` readings as sent to coap://other/sensor-values-batch"""
+        return [self.reading() for _ in range(size)]
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Benchmark results and baselines
+
+A result is a JSON document::
+
+    {
+        "benchmark": "coap",
+        "parameters": {"devices": 50, "rate": 20, ...},
+        "environment": {"python": "3.5.3", "cpus": 4, ...},
+        "metrics": {
+            "throughput": 998.2,
+            "latency_p50": 0.0011,
+            ...
+        }
+    }
+
+Metrics whose names end in 'throughput' are better when higher; those
+containing 'latency' or 'errors' are better when lower. Other metrics,
+such as request counts, are reported but never count as regressions.
+"""
+
+import collections
+import datetime
+import json
+import os
+import platform
+import subprocess
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+
+class Latencies(object):
+    """Collects latencies (seconds) and response codes"""
+
+    def __init__(self):
+        self.samples = []
+        self.codes = collections.Counter()
+
+    def add(self, seconds, code):
+        self.samples.append(seconds)
+        self.codes[code] += 1
+
+    def summary(self, prefix=''):
+        """Returns count, p50, p90, p99 and max latency as a dict"""
+        samples = sorted(self.samples)
+        result = {prefix + 'count': len(samples)}
+
+        for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99)):
+            result[prefix + 'latency_' + name] = \
+                samples[int(fraction * (len(samples) - 1))] if samples else 0.0
+        result[prefix + 'latency_max'] = samples[-1] if samples else 0.0
+
+        return result
+
+
+def environment():
+    """Describes the machine and revision a benchmark ran on"""
+    try:
+        revision = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+
+    return {'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'revision': revision,
+            'date': datetime.datetime.utcnow().replace(microsecond=0).isoformat() + 'Z'}
+
+
+def result(benchmark, parameters, metrics):
+    return {'benchmark': benchmark,
+            'parameters': parameters,
+            'environment': environment(),
+            'metrics': metrics}
+
+
+def save(document, path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(baseline, current, tolerance=0.1):
+    """Compares the metrics of two results of the same benchmark
+
+    Args:
+        baseline (dict): A saved result
+        current (dict): A result to check against the baseline
+        tolerance (float): Fraction by which a metric may get worse
+
+    Returns:
+        list: (metric, baseline value, current value, change, regressed)
+        tuples, where change is the relative change
+    """
+    if baseline['benchmark'] != current['benchmark']:
+        raise ValueError('Cannot compare a {} result with a {} baseline'.format(
+            current['benchmark'], baseline['benchmark']))
+
+    rows = []
+
+    for name in sorted(set(baseline['metrics']) & set(current['metrics'])):
+        before = baseline['metrics'][name]
+        after = current['metrics'][name]
+
+        if before:
+            change = (after - before) / abs(before)
+        else:
+            change = 0.0 if not after else float('inf')
+
+        if name.endswith('throughput'):
+            regressed = change < -tolerance
+        elif 'latency' in name or 'errors' in name:
+            regressed = change > tolerance
+        else:
+            regressed = False
+
+        rows.append((name, before, after, change, regressed))
+
+    return rows
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Runs the CoAP ingest handlers and the admin API in a child process
+so that the load generator does not compete with them for the GIL
+
+Storage modes:
+
+- mock: aiopg is replaced by the MockEngine stubs of the unit tests, so
+  the benchmark measures FogLAMP's own code
+- postgres: the database configured in foglamp-env.yaml is used, and
+  the admin benchmark's user is added to foglamp.users if it is missing
+"""
+
+import asyncio
+import multiprocessing
+import time
+from unittest.mock import patch
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+STORAGE_MODES = ('mock', 'postgres')
+
+_START_SECONDS = 30
+"""Seconds the server has to start"""
+
+_context = multiprocessing.get_context('spawn')
+
+
+def _serve(storage, coap_port, admin_port, ready):
+    from benchmarks.admin_load import PASSWORD, USERNAME
+    from foglamp import env
+    from foglamp.admin_api.app_builder import build as build_app
+    from foglamp.admin_api import passwords
+    from foglamp.admin_api.model import User
+    from foglamp.device_api import admission
+    from foglamp.device_api import dedup
+    from foglamp.device_api.coap import controller as coap_controller
+    from foglamp.storage import pool
+    from foglamp.storage import readings
+
+    if storage == 'mock':
+        from tests.device_api.coap.test_sensor_values import MockEngine, async_mock
+        patch('aiopg.sa.create_engine', new=async_mock(return_value=MockEngine())).start()
+        # Default configuration and no readings to warm up from
+        patch('foglamp.storage.configuration.get',
+              new=async_mock(side_effect=lambda key, defaults=None: dict(defaults or {}))).start()
+        patch('foglamp.storage.readings.recent_read_keys', new=async_mock(return_value=[])).start()
+        env.config = {}
+        env.db_connection_string = 'mock'
+    else:
+        env.load_config()
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(pool.create())
+    loop.run_until_complete(readings.buffer.start())
+    loop.run_until_complete(admission.control.start())
+    loop.run_until_complete(dedup.read_keys.start())
+
+    # Every simulated device sends from the same address
+    admission.control.device_rate = 0
+
+    app = build_app()
+
+    if storage == 'mock':
+        User.objects._put(User(1, USERNAME, passwords.encode(PASSWORD)))
+    else:
+        loop.run_until_complete(app.startup())
+        if not User.objects.filter(name=USERNAME):
+            loop.run_until_complete(User.objects.create(USERNAME, PASSWORD))
+
+    coap_controller.start(port=coap_port)
+    loop.run_until_complete(loop.create_server(app.make_handler(), '127.0.0.1', admin_port))
+
+    loop.call_soon(ready.set)
+    loop.run_forever()
+
+
+class Server(object):
+    """A FogLAMP ingest and admin API server in a child process"""
+
+    def __init__(self, storage='mock', coap_port=5683, admin_port=8080):
+        if storage not in STORAGE_MODES:
+            raise ValueError('storage must be one of {}'.format(', '.join(STORAGE_MODES)))
+
+        self.storage = storage
+        self.coap_port = coap_port
+        self.admin_port = admin_port
+        self._process = None
+
+    def __enter__(self):
+        ready = _context.Event()
+        self._process = _context.Process(
+            target=_serve, args=(self.storage, self.coap_port, self.admin_port, ready),
+            name='foglamp-benchmark-server', daemon=True)
+        self._process.start()
+
+        if not ready.wait(_START_SECONDS):
+            self._process.terminate()
+            raise RuntimeError('The benchmark server did not start')
+
+        # The CoAP server context is created by a task
+        time.sleep(0.1)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._process.terminate()
+        self._process.join()
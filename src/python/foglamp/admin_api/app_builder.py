@@ -1,7 +1,26 @@
 from aiohttp import web
 from foglamp.admin_api.model import User
 from foglamp.admin_api.login import register_handlers as login_register_handlers
+from foglamp.admin_api.metrics import register_handlers as metrics_register_handlers
+from foglamp.admin_api.profiling import register_handlers as profiling_register_handlers
+from foglamp.admin_api.readings import register_handlers as readings_register_handlers
 from foglamp.admin_api.auth import auth_middleware
+from foglamp.storage import latest
+from foglamp.storage import pool
+import foglamp.env as env
+
+
+async def _start(app):
+    if env.db_connection_string is None:
+        # Started by a WSGI server rather than foglamp.controller
+        env.load_config()
+    await pool.create()
+    await User.objects.start()
+    await latest.cache.start()
+
+
+async def _stop(app):
+    await User.objects.stop()
 
 
 def build():
@@ -9,14 +28,16 @@ def build():
     :return: An application
     """
 
-    # Create a bogus user until users are moved to the database
-    User.objects.create(name='user', password='password')
-
     app = web.Application(middlewares=[auth_middleware])
+    app.on_startup.append(_start)
+    app.on_cleanup.append(_stop)
     router = app.router
 
     # Register URI handlers
     login_register_handlers(router)
+    metrics_register_handlers(router)
+    profiling_register_handlers(router)
+    readings_register_handlers(router)
 
     # Static content - It's a hack
     #router__.add_static('/', '/home/foglamp/foglamp/example/web/login')
@@ -3,15 +3,107 @@ Authentication-related utilities
 """
 
 from datetime import datetime
+import collections
+import hashlib
+import time
 from aiohttp import web
 import jwt
-from foglamp.admin_api.model import User
+from foglamp import metrics
+from foglamp.admin_api.model import ACCESS_DISABLED, User
 
 # This will be moved to something that interacts with the configuration service
 JWT_SECRET = 'secret'
 JWT_ALGORITHM = 'HS256'
 JWT_EXP_DAYS = 7
 JWT_REFRESH_MINUTES = 15
+TOKEN_CACHE_SIZE = 1024
+
+_tokens = metrics.registry.counter(
+    'foglamp_auth_tokens', 'Authorization headers by result', ('result',))
+_TOKENS_VALID = _tokens.labels('valid')
+_TOKENS_INVALID = _tokens.labels('invalid')
+_TOKENS_EXPIRED = _tokens.labels('expired')
+
+_token_seconds = metrics.registry.histogram(
+    'foglamp_auth_token_seconds', 'Time to verify an authorization header')
+
+_token_cache_lookups = metrics.registry.counter(
+    'foglamp_auth_token_cache', 'Verified token cache lookups by result', ('result',))
+_TOKEN_CACHE_HITS = _token_cache_lookups.labels('hit')
+_TOKEN_CACHE_MISSES = _token_cache_lookups.labels('miss')
+
+
+class TokenCache(object):
+    """A bounded LRU cache of verified tokens
+
+    Maps the SHA-256 digest of a token to its decoded payload and user
+    so that a client polling with the same token is not verified and
+    looked up on every request. An entry is dropped when its token
+    expires, or before that by :meth:`invalidate_user`. Every change to
+    a user drops the user's tokens, so their next request is verified
+    again by :func:`auth_middleware`, which refuses deleted and disabled
+    users. Tokens are not revoked otherwise: there is no logout.
+    """
+
+    def __init__(self, size=TOKEN_CACHE_SIZE):
+        self.size = size
+        self._entries = collections.OrderedDict()
+        """digest -> (payload, user, exp)"""
+
+    def get(self, token):
+        """Returns (payload, user) for a verified, unexpired token or None"""
+        digest = _digest(token)
+        entry = self._entries.get(digest)
+
+        if entry is None:
+            return None
+
+        if entry[2] <= time.time():
+            del self._entries[digest]
+            return None
+
+        self._entries.move_to_end(digest)
+        return entry[0], entry[1]
+
+    def put(self, token, payload, user):
+        """Caches a token that has been verified"""
+        exp = payload.get('exp')
+        if exp is None:
+            # Without an expiry time there is nothing to evict it at
+            return
+
+        digest = _digest(token)
+        self._entries[digest] = (payload, user, exp)
+        self._entries.move_to_end(digest)
+
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id):
+        """Drops every token of a user, for example when the user is
+        disabled or deleted. The middleware then checks the user again.
+        """
+        for digest in [digest for digest, (payload, _, _) in self._entries.items()
+                       if payload.get('user_id') == user_id]:
+            del self._entries[digest]
+
+    def clear(self):
+        self._entries.clear()
+
+
+def _digest(token):
+    return hashlib.sha256(token.encode('utf-8')).digest()
+
+
+token_cache = TokenCache()
+"""Tokens verified by auth_middleware"""
+
+
+def _user_changed(user_id):
+    token_cache.invalidate_user(user_id)
+
+
+User.objects.subscribe(_user_changed)
 
 
 def authentication_required(func):
@@ -49,18 +141,39 @@ async def auth_middleware(app, handler):
         request.user = None
         jwt_token = request.headers.get('authorization', None)
         if jwt_token:
+            cached = token_cache.get(jwt_token)
+            if cached is not None:
+                _TOKEN_CACHE_HITS.inc()
+                _TOKENS_VALID.inc()
+                request.jwt_payload, request.user = cached
+                return await handler(request)
+
+            _TOKEN_CACHE_MISSES.inc()
+            started = time.monotonic()
             try:
                 request.jwt_payload = jwt.decode(
                     jwt_token
                     , JWT_SECRET
                     , algorithms=[JWT_ALGORITHM])
             except jwt.DecodeError:
+                _TOKENS_INVALID.inc()
                 return web.json_response({'message': 'Token is invalid'},
                                          status=400)
             except jwt.ExpiredSignatureError:
+                _TOKENS_EXPIRED.inc()
                 return web.json_response({'message': 'Token expired'},
                                          status=401)
-            request.user = User.objects.get(id=request.jwt_payload['user_id'])
+            finally:
+                _token_seconds.observe(time.monotonic() - started)
+            _TOKENS_VALID.inc()
+            try:
+                user = User.objects.get(id=request.jwt_payload['user_id'])
+            except User.DoesNotExist:
+                return web.json_response({'message': 'User does not exist'}, status=401)
+            if user.access_method == ACCESS_DISABLED:
+                return web.json_response({'message': 'User is disabled'}, status=401)
+            request.user = user
+            token_cache.put(jwt_token, request.jwt_payload, request.user)
         return await handler(request)
     return middleware
 
@@ -7,5 +7,7 @@ def start():
     # TODO Read port from config (but might use nginx in production especially for https)
 
     loop = asyncio.get_event_loop()
-    f = loop.create_server(build_app().make_handler(), '0.0.0.0', 8080)
+    app = build_app()
+    loop.run_until_complete(app.startup())
+    f = loop.create_server(app.make_handler(), '0.0.0.0', 8080)
     loop.create_task(f)
@@ -0,0 +1,82 @@
+"""
+Adds an admin API user from the command line
+
+foglamp.users starts empty, so the first user is created with::
+
+    foglamp create-user admin
+
+The password is asked for twice, or read from the first line of
+standard input when it is not a terminal, and stored hashed (see
+foglamp.admin_api.passwords).
+"""
+
+import asyncio
+import getpass
+import sys
+
+import psycopg2
+
+from foglamp.admin_api import passwords
+from foglamp.admin_api.model import DEFAULT_ROLE_ID, User
+from foglamp.storage import pool
+import foglamp.env as env
+
+
+class PasswordError(Exception):
+    """Raised when no usable password was entered"""
+    pass
+
+
+def read_password(stdin=None):
+    """Returns the new user's password
+
+    Raises:
+        PasswordError: The password is empty or was not confirmed
+    """
+    stdin = stdin or sys.stdin
+
+    if stdin.isatty():
+        password = getpass.getpass('Password: ')
+        if getpass.getpass('Password (again): ') != password:
+            raise PasswordError('The passwords do not match')
+    else:
+        password = stdin.readline().rstrip('\r\n')
+
+    if not password:
+        raise PasswordError('The password must not be empty')
+    return password
+
+
+async def create_user(name, password, role_id=DEFAULT_ROLE_ID, description=''):
+    """Adds a user with password access to foglamp.users"""
+    await pool.create()
+    try:
+        return await User.objects.create(name, password, role_id=role_id, description=description)
+    finally:
+        await pool.close()
+        passwords.hasher.shutdown()
+
+
+def main(name, role_id=DEFAULT_ROLE_ID, description=''):
+    """Runs the create-user command
+
+    Returns:
+        int: The exit status
+    """
+    try:
+        password = read_password()
+    except PasswordError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    env.load_config()
+
+    try:
+        user = asyncio.get_event_loop().run_until_complete(
+            create_user(name, password, role_id, description))
+    except psycopg2.IntegrityError:
+        print('User {} already exists, or role {} does not'.format(name, role_id), file=sys.stderr)
+        return 1
+
+    print('Created {}'.format(user))
+    return 0
@@ -3,12 +3,17 @@ Authentication-related URI handlers
 """
 
 from datetime import datetime, timedelta
-from foglamp.admin_api.model import User
+import logging
+from foglamp.admin_api.model import ACCESS_DISABLED, User
+from foglamp.admin_api import passwords
+from foglamp.admin_api.passwords import HasherBusy
 from foglamp.admin_api.auth import authentication_required
 import jwt
 from aiohttp import web
 from foglamp.admin_api.auth import JWT_ALGORITHM, JWT_REFRESH_MINUTES, JWT_EXP_DAYS, JWT_SECRET
 
+_logger = logging.getLogger(__name__)
+
 async def login(request):
     """Given a user name and a password as query string, tokens
     in JWT format are returned.
@@ -29,13 +34,26 @@ async def login(request):
 
     try:
         post_data = await request.json()
-        user = User.objects.get(name=post_data['username'])
-        user.match_password(post_data['password'])
+        try:
+            user = User.objects.get(name=post_data['username'])
+        except User.DoesNotExist:
+            await passwords.hasher.check_unknown(post_data['password'])
+            raise
+        await user.match_password(post_data['password'])
     except (User.DoesNotExist, User.PasswordDoesNotMatch):
         return web.json_response({'message': 'Authentication failed'}, status=400)
+    except HasherBusy:
+        return web.json_response({'message': 'Too many logins. Try again later.'}, status=503)
     except Exception:
         return web.json_response({'message': 'Invalid request'}, status=400)
 
+    peername = request.transport.get_extra_info('peername') if request.transport else None
+    if isinstance(peername, tuple):
+        try:
+            await User.objects.record_login(user.id, peername[0])
+        except Exception:
+            _logger.exception('Unable to record the login of %s', user)
+
     access_payload = {'user_id': user.id,
                       'exp': (datetime.utcnow()
                             + timedelta(minutes=JWT_REFRESH_MINUTES)),
@@ -60,6 +78,10 @@ async def refresh_token(request):
     if not request.user:
         return web.json_response({'message': 'Authentication required'}, status=400)
 
+    # A refresh token must not outlive its user being disabled
+    if request.user.access_method == ACCESS_DISABLED:
+        return web.json_response({'message': 'User is disabled'}, status=401)
+
     try:
         if request.jwt_payload['access']:
             return web.json_response({'message': 'Refresh token not provided'},
@@ -68,7 +90,6 @@ async def refresh_token(request):
         return web.json_response({'message': 'Invalid token'},
                                  status=400)
 
-    # TODO: Verify user exists
     payload = {'user_id': request.jwt_payload['user_id'],
                'exp': (datetime.utcnow()
                        + timedelta(minutes=JWT_REFRESH_MINUTES)),
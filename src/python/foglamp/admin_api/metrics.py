@@ -0,0 +1,33 @@
+"""
+Metrics URI handlers
+"""
+
+from aiohttp import web
+
+from foglamp import metrics
+from foglamp.device_api.coap import workers as coap_workers
+
+_PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+async def get_metrics(request):
+    """Returns the metrics of FogLAMP and of its CoAP ingest workers
+
+    The response is in the Prometheus text format unless the query
+    string has format=json or the Accept header asks for
+    application/json. Metrics of CoAP ingest workers have a 'worker'
+    label and are as recent as the worker's last stats report.
+    """
+    families = metrics.merge(metrics.registry.snapshot(), coap_workers.supervisor.metrics())
+
+    if request.query.get('format') == 'json' or \
+            'application/json' in request.headers.get('accept', ''):
+        return web.json_response(metrics.to_json(families))
+
+    return web.Response(body=metrics.to_prometheus(families).encode('utf-8'),
+                        headers={'Content-Type': _PROMETHEUS_CONTENT_TYPE})
+
+
+def register_handlers(router):
+    """Registers URI handlers"""
+    router.add_route('GET', '/api/metrics', get_metrics)
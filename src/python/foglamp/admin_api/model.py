@@ -1,26 +1,149 @@
 """
-This class will be moved out of the rest subpackage to the model sub-package
-with a different interface.
+Admin API users, stored in the foglamp.users table
+
+Every user, with the permissions of its role and its own permissions,
+is held in memory and indexed by id and by name so that the
+authentication middleware can look a user up on every request without
+a database round trip. Changes are written to the database first and
+then to the indexes (write-through).
+
+Triggers on foglamp.users, foglamp.user_resource_permissions and
+foglamp.role_resource_permission (see foglamp_ddl.sql) send a
+notification on the 'foglamp_users' channel for every change, whichever
+process makes it. Each admin API process listens on that channel and
+reloads the users that changed, so the indexes of several admin API
+workers agree with the database and with each other.
 """
+
+import asyncio
+import logging
+
+import aiopg
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import INET, JSONB
+
+from foglamp.admin_api import passwords
+from foglamp.storage import pool
+import foglamp.env as env
+
+_logger = logging.getLogger(__name__)
+
+CHANNEL = 'foglamp_users'
+"""The channel that foglamp_ddl.sql's triggers notify. The payload is the
+id of the user that changed, or empty when every user may have changed."""
+
+ACCESS_DISABLED = 0
+ACCESS_PASSWORD = 1
+ACCESS_PUBLIC_KEY = 2
+"""Values of foglamp.users.access_method"""
+
+DEFAULT_ROLE_ID = 1
+"""The 'Power User' role of foglamp_init_data.sql"""
+
+_RETRY_SECONDS = 5
+"""How long to wait before listening again after the connection was lost"""
+
+_metadata = sa.MetaData()
+
+_users_tbl = sa.Table(
+    'users',
+    _metadata,
+    sa.Column('id', sa.types.INT, primary_key=True),
+    sa.Column('uid', sa.types.VARCHAR(80)),
+    sa.Column('role_id', sa.types.INT),
+    sa.Column('description', sa.types.VARCHAR(255)),
+    sa.Column('pwd', sa.types.VARCHAR(255)),
+    sa.Column('public_key', sa.types.VARCHAR(255)),
+    sa.Column('access_method', sa.types.SMALLINT),
+    schema='foglamp')
+
+_user_logins_tbl = sa.Table(
+    'user_logins',
+    _metadata,
+    sa.Column('id', sa.types.INT, primary_key=True),
+    sa.Column('user_id', sa.types.INT),
+    sa.Column('ip', INET),
+    sa.Column('ts', sa.types.TIMESTAMP(timezone=True)),
+    schema='foglamp')
+
+_resources_tbl = sa.Table(
+    'resources',
+    _metadata,
+    sa.Column('id', sa.types.INT, primary_key=True),
+    sa.Column('code', sa.types.CHAR(10)),
+    schema='foglamp')
+
+_role_resource_permission_tbl = sa.Table(
+    'role_resource_permission',
+    _metadata,
+    sa.Column('role_id', sa.types.INT),
+    sa.Column('resource_id', sa.types.INT),
+    sa.Column('access', JSONB),
+    schema='foglamp')
+
+_user_resource_permissions_tbl = sa.Table(
+    'user_resource_permissions',
+    _metadata,
+    sa.Column('user_id', sa.types.INT),
+    sa.Column('resource_id', sa.types.INT),
+    sa.Column('access', JSONB),
+    schema='foglamp')
+
+_user_asset_permissions_tbl = sa.Table(
+    'user_asset_permissions',
+    _metadata,
+    sa.Column('user_id', sa.types.INT),
+    sa.Column('asset_id', sa.types.INT),
+    schema='foglamp')
+
+
 class User:
+    """A row of foglamp.users
+
+    Attributes:
+        permissions (dict): Resource code -> access, from the user's role
+            overridden by the user's own permissions
+    """
 
-    def __init__(self, id, name, password, is_admin):
+    def __init__(self, id, name, password, role_id=DEFAULT_ROLE_ID, description='',
+                 access_method=ACCESS_PASSWORD, permissions=None):
+        """``password`` is the stored hash (see :mod:`foglamp.admin_api.passwords`)"""
         self.id = id
         self.name = name
         self.password = password
-        self.is_admin = is_admin
+        self.role_id = role_id
+        self.description = description
+        self.access_method = access_method
+        self.permissions = permissions or {}
 
     def __repr__(self):
-        template = 'User id={s.id}: <{s.name}, is_admin={s.is_admin}>'
+        template = 'User id={s.id}: <{s.name}, role_id={s.role_id}>'
         return template.format(s=self)
 
     def __str__(self):
         return self.__repr__()
 
-    def match_password(self, password):
-        if password != self.password:
+    async def match_password(self, password):
+        """Checks a password on the password hashing thread pool
+
+        Raises:
+            User.PasswordDoesNotMatch
+            foglamp.admin_api.passwords.HasherBusy: Too many passwords are
+                waiting to be checked
+        """
+        if self.access_method != ACCESS_PASSWORD:
+            await passwords.hasher.check_unknown(password)
+            raise User.PasswordDoesNotMatch
+
+        if not await passwords.hasher.check(password, self.password):
             raise User.PasswordDoesNotMatch
 
+        if passwords.needs_rehash(self.password):
+            try:
+                await User.objects.update(self.id, password=password)
+            except Exception:
+                _logger.exception('Unable to rehash the password of %s', self)
+
     class DoesNotExist(BaseException):
         pass
 
@@ -31,21 +154,86 @@ class User:
         pass
 
     class objects:
-        _storage = []
-        _max_id = 0
+        _by_id = {}
+        _by_name = {}
+        _role_permissions = {}
+        """role_id -> {resource code: access}"""
+
+        _listeners = []
+        _listen_task = None
+
+        @classmethod
+        async def start(cls):
+            """Loads every user and starts following changes made by
+            other processes. Requires :func:`foglamp.storage.pool.create`.
+
+            Users are loaded again once the listening connection is up,
+            so that changes made in between are not missed.
+            """
+            await cls.load()
+
+            if cls._listen_task is None:
+                cls._listen_task = asyncio.ensure_future(cls._listen())
+
+        @classmethod
+        async def stop(cls):
+            if cls._listen_task is not None:
+                cls._listen_task.cancel()
+                cls._listen_task = None
+
+        @classmethod
+        def subscribe(cls, callback):
+            """Calls ``callback(user_id)`` whenever a user is changed or deleted"""
+            cls._listeners.append(callback)
+
+        @classmethod
+        async def load(cls):
+            """Replaces the indexes with every user in the database"""
+            async with pool.acquire() as conn:
+                cls._role_permissions = await _select_permissions(
+                    conn, _role_resource_permission_tbl, 'role_id')
+                user_permissions = await _select_permissions(
+                    conn, _user_resource_permissions_tbl, 'user_id')
+                result = await conn.execute(_users_tbl.select())
+                rows = await result.fetchall()
+
+            users = [cls._from_row(row, user_permissions.get(row['id'])) for row in rows]
+            changed = set(cls._by_id)
+
+            cls._by_id = {user.id: user for user in users}
+            cls._by_name = {user.name: user for user in users}
+
+            for user_id in changed:
+                cls._changed(user_id)
+
+            _logger.info('Loaded %s users', len(users))
 
         @classmethod
-        def create(cls, name, password, is_admin=False):
-            cls._max_id += 1
-            cls._storage.append(User(cls._max_id, name, password, is_admin))
+        async def reload(cls, id):
+            """Reads one user from the database into the indexes, or drops
+            it from them when it no longer exists
+            """
+            async with pool.acquire() as conn:
+                await cls._reload(conn, id)
 
         @classmethod
         def all(cls):
-            return cls._storage
+            return list(cls._by_id.values())
 
         @classmethod
         def filter(cls, **kwargs):
-            users = cls._storage
+            id = kwargs.pop('id', None)
+            name = kwargs.pop('name', None)
+
+            if id:
+                users = [cls._by_id[id]] if id in cls._by_id else []
+                if name:
+                    users = [u for u in users if u.name == name]
+            elif name:
+                users = [cls._by_name[name]] if name in cls._by_name else []
+            else:
+                users = cls.all()
+
             for k, v in kwargs.items():
                 if v:
                     users = [u for u in users if getattr(u, k, None) == v]
@@ -53,9 +241,165 @@ class User:
 
         @classmethod
         def get(cls, id=None, name=None):
-            users = cls.filter(id=id, name=name)
-            if len(users) > 1:
+            """Looks a user up in memory by id, name or both"""
+            if id is not None:
+                user = cls._by_id.get(id)
+                if user is not None and name is not None and user.name != name:
+                    user = None
+            elif name is not None:
+                user = cls._by_name.get(name)
+            else:
                 raise User.TooManyObjects
-            if len(users) == 0:
+
+            if user is None:
+                raise User.DoesNotExist
+            return user
+
+        @classmethod
+        async def create(cls, name, password, role_id=DEFAULT_ROLE_ID, description='',
+                         access_method=ACCESS_PASSWORD):
+            pwd = await passwords.hasher.encode(password)
+
+            async with pool.acquire() as conn:
+                result = await conn.execute(
+                    _users_tbl.insert().values(
+                        uid=name, pwd=pwd, role_id=role_id, description=description,
+                        access_method=access_method).returning(_users_tbl.c.id))
+                id = await result.scalar()
+                return await cls._reload(conn, id)
+
+        @classmethod
+        async def update(cls, id, **values):
+            """Updates columns of foglamp.users. ``name`` is accepted for
+            the uid column, and ``password`` is hashed into the pwd column.
+            """
+            if 'name' in values:
+                values['uid'] = values.pop('name')
+            if 'password' in values:
+                values['pwd'] = await passwords.hasher.encode(values.pop('password'))
+
+            async with pool.acquire() as conn:
+                await conn.execute(_users_tbl.update().where(_users_tbl.c.id == id).values(**values))
+                user = await cls._reload(conn, id)
+
+            if user is None:
                 raise User.DoesNotExist
-            return users[0]
+            return user
+
+        @classmethod
+        async def delete(cls, id):
+            async with pool.acquire() as conn:
+                async with conn.begin():
+                    await conn.execute(_user_logins_tbl.delete().where(
+                        _user_logins_tbl.c.user_id == id))
+                    await conn.execute(_user_resource_permissions_tbl.delete().where(
+                        _user_resource_permissions_tbl.c.user_id == id))
+                    await conn.execute(_user_asset_permissions_tbl.delete().where(
+                        _user_asset_permissions_tbl.c.user_id == id))
+                    await conn.execute(_users_tbl.delete().where(_users_tbl.c.id == id))
+
+            cls._drop(id)
+
+        @classmethod
+        async def record_login(cls, id, ip):
+            """Adds a row to foglamp.user_logins"""
+            async with pool.acquire() as conn:
+                await conn.execute(_user_logins_tbl.insert().values(
+                    user_id=id, ip=ip, ts=sa.func.now()))
+
+        @classmethod
+        async def _reload(cls, conn, id):
+            result = await conn.execute(_users_tbl.select().where(_users_tbl.c.id == id))
+            row = await result.first()
+
+            if row is None:
+                cls._drop(id)
+                return None
+
+            permissions = await _select_permissions(
+                conn, _user_resource_permissions_tbl, 'user_id',
+                _user_resource_permissions_tbl.c.user_id == id)
+            user = cls._from_row(row, permissions.get(id))
+            cls._put(user)
+            return user
+
+        @classmethod
+        def _from_row(cls, row, user_permissions):
+            permissions = dict(cls._role_permissions.get(row['role_id']) or {})
+            permissions.update(user_permissions or {})
+
+            return User(row['id'], row['uid'], row['pwd'], role_id=row['role_id'],
+                        description=row['description'], access_method=row['access_method'],
+                        permissions=permissions)
+
+        @classmethod
+        def _put(cls, user):
+            cls._drop(user.id)
+            cls._by_id[user.id] = user
+            cls._by_name[user.name] = user
+
+        @classmethod
+        def _drop(cls, id):
+            user = cls._by_id.pop(id, None)
+            if user is None:
+                return
+
+            if cls._by_name.get(user.name) is user:
+                del cls._by_name[user.name]
+            cls._changed(id)
+
+        @classmethod
+        def _changed(cls, id):
+            for callback in cls._listeners:
+                try:
+                    callback(id)
+                except Exception:
+                    _logger.exception('User change listener failed')
+
+        @classmethod
+        async def _notified(cls, payload):
+            if payload:
+                await cls.reload(int(payload))
+            else:
+                await cls.load()
+
+        @classmethod
+        async def _listen(cls):
+            """Follows the 'foglamp_users' channel on a connection of its
+            own, which is not returned to the pool
+            """
+            while True:
+                try:
+                    async with aiopg.connect(env.db_connection_string) as conn:
+                        async with conn.cursor() as cursor:
+                            await cursor.execute('LISTEN {}'.format(CHANNEL))
+
+                        # Changes made before LISTEN, including those since
+                        # start() loaded the users, were not notified
+                        await cls.load()
+
+                        while True:
+                            notify = await conn.notifies.get()
+                            await cls._notified(notify.payload)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    _logger.exception('Not following user changes. Retrying in %s seconds',
+                                      _RETRY_SECONDS)
+                    await asyncio.sleep(_RETRY_SECONDS)
+
+
+async def _select_permissions(conn, table, key, where=None):
+    """Returns {table.key: {resource code: access}}"""
+    query = sa.select([table.c[key], _resources_tbl.c.code, table.c.access]).select_from(
+        table.join(_resources_tbl, table.c.resource_id == _resources_tbl.c.id))
+    if where is not None:
+        query = query.where(where)
+
+    result = await conn.execute(query)
+    permissions = {}
+
+    for row in await result.fetchall():
+        permissions.setdefault(row[0], {})[row[1].strip()] = row[2]
+
+    return permissions
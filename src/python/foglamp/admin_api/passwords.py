@@ -0,0 +1,185 @@
+"""
+Salted password hashing off the event loop
+
+Passwords are stored as ``pbkdf2_sha256$<iterations>$<salt>$<hash>``
+(PBKDF2-HMAC-SHA256 with a random 16 byte salt, base64 encoded).
+hashlib.scrypt would need Python 3.6 and OpenSSL 1.1.
+
+A hash takes tens of milliseconds by design, which is too long to run
+on the event loop that also serves CoAP ingest. Hashes are computed on
+a small thread pool instead; hashlib releases the GIL while it hashes,
+so the loop keeps running. At most ``workers`` hashes run at a time and
+at most ``max_pending`` logins wait for one, so a burst of logins after
+a restart queues up here (or is turned away with :class:`HasherBusy`)
+rather than delaying ingest.
+
+The 'passwords' section of foglamp-env.yaml sets the cost and limits::
+
+    passwords:
+      iterations: 100000
+      workers: 2
+      max_pending: 100
+"""
+
+import asyncio
+import base64
+import concurrent.futures
+import hashlib
+import hmac
+import logging
+import os
+
+from foglamp import metrics
+import foglamp.env as env
+
+_logger = logging.getLogger(__name__)
+
+ALGORITHM = 'pbkdf2_sha256'
+
+DEFAULT_SETTINGS = {
+    'iterations': 100000,
+    'workers': 2,
+    'max_pending': 100
+}
+"""Used for settings missing from the 'passwords' section of foglamp-env.yaml
+
+- iterations: PBKDF2 iterations for new hashes. Stored hashes with a
+  different count are rehashed the next time their user logs in.
+- workers: Threads that compute hashes
+- max_pending: Hashes that may wait for a thread before
+  :class:`HasherBusy` is raised
+"""
+
+_SALT_BYTES = 16
+
+_hash_seconds = metrics.registry.histogram(
+    'foglamp_password_hash_seconds', 'Time to hash a password, including the wait for a thread')
+
+_rejected = metrics.registry.counter(
+    'foglamp_password_hash_rejected', 'Hashes refused because too many were pending')
+
+
+class HasherBusy(Exception):
+    """Raised when ``max_pending`` hashes are already waiting"""
+    pass
+
+
+def settings():
+    """Returns the 'passwords' section of foglamp-env.yaml merged over
+    :data:`DEFAULT_SETTINGS`
+    """
+    return dict(DEFAULT_SETTINGS, **((env.config or {}).get('passwords') or {}))
+
+
+def encode(password, iterations=None, salt=None):
+    """Hashes a password on the calling thread
+
+    Returns:
+        str: The stored form of the password
+    """
+    if iterations is None:
+        iterations = int(settings()['iterations'])
+    if salt is None:
+        salt = os.urandom(_SALT_BYTES)
+
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+    return '{}${}${}${}'.format(ALGORITHM, iterations, base64.b64encode(salt).decode('ascii'),
+                                base64.b64encode(digest).decode('ascii'))
+
+
+def check(password, encoded):
+    """Compares a password with a stored hash on the calling thread"""
+    try:
+        algorithm, iterations, salt, _ = encoded.split('$')
+    except (AttributeError, ValueError):
+        return False
+
+    if algorithm != ALGORITHM:
+        return False
+
+    expected = encode(password, int(iterations), base64.b64decode(salt))
+    return hmac.compare_digest(expected.encode('ascii'), encoded.encode('ascii'))
+
+
+def needs_rehash(encoded):
+    """Returns True when a stored hash does not use the configured iterations"""
+    try:
+        return int(encoded.split('$')[1]) != int(settings()['iterations'])
+    except (AttributeError, IndexError, ValueError):
+        return True
+
+
+class PasswordHasher(object):
+    """Runs :func:`encode` and :func:`check` on a bounded thread pool"""
+
+    def __init__(self):
+        self._executor = None
+        self._semaphore = None
+        self._pending = 0
+        self._max_pending = 0
+        self._unknown = None
+        """A hash that no password is checked against successfully"""
+
+    def _start(self):
+        current = settings()
+        workers = int(current['workers'])
+
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self._semaphore = asyncio.Semaphore(workers)
+        self._max_pending = int(current['max_pending'])
+
+    async def _run(self, function, *args):
+        if self._executor is None:
+            self._start()
+
+        if self._pending >= self._max_pending:
+            _rejected.inc()
+            raise HasherBusy()
+
+        loop = asyncio.get_event_loop()
+        started = loop.time()
+        self._pending += 1
+
+        try:
+            # Waiting here rather than in the executor's unbounded queue
+            # keeps the number of waiting hashes countable
+            async with self._semaphore:
+                return await loop.run_in_executor(self._executor, function, *args)
+        finally:
+            self._pending -= 1
+            _hash_seconds.observe(loop.time() - started)
+
+    async def encode(self, password):
+        """Hashes a password on the thread pool"""
+        return await self._run(encode, password)
+
+    async def check(self, password, encoded):
+        """Compares a password with a stored hash on the thread pool"""
+        return await self._run(check, password, encoded)
+
+    async def check_unknown(self, password):
+        """Takes as long as :meth:`check` for a user that does not exist
+        or cannot log in with a password, so that the time a failed login
+        takes does not tell which user names exist
+
+        Returns:
+            bool: False
+        """
+        if self._unknown is None:
+            self._unknown = await self._run(encode, os.urandom(_SALT_BYTES).hex())
+        await self._run(check, password, self._unknown)
+        return False
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def stats(self):
+        return {'pending': self._pending}
+
+
+hasher = PasswordHasher()
+"""Hashes the passwords of admin API users"""
+
+metrics.registry.stats('foglamp_password_hash', hasher.stats)
@@ -0,0 +1,128 @@
+"""
+Profiling URI handlers
+
+See foglamp.profiling. All methods require authentication.
+"""
+
+from aiohttp import web
+
+from foglamp import profiling
+from foglamp.admin_api.auth import authentication_required
+
+
+async def _options(request):
+    """Returns the JSON object posted, or {} if nothing was posted"""
+    if not request.has_body:
+        return {}
+    options = await request.json()
+    if not isinstance(options, dict):
+        raise ValueError('A JSON object is required')
+    return options
+
+
+@authentication_required
+async def start_cpu(request):
+    """Starts the CPU profiler
+
+    The optional posted JSON document looks like:
+    {
+        "seconds": 30,
+        "interval": 0.005,
+        "threads": "main"
+    }
+
+    "threads" is "main" (the event loop) or "all". Intervals shorter
+    than foglamp.profiling.MIN_INTERVAL are refused with 400.
+    """
+    try:
+        options = await _options(request)
+        profiling.cpu.start(seconds=options.get('seconds', profiling.MAX_SECONDS),
+                            interval=options.get('interval', profiling.DEFAULT_INTERVAL),
+                            threads=options.get('threads', 'main'))
+    except profiling.ProfilerError as e:
+        return web.json_response({'message': str(e)}, status=409)
+    except ValueError as e:
+        return web.json_response({'message': str(e)}, status=400)
+    except TypeError:
+        return web.json_response({'message': 'Invalid request'}, status=400)
+
+    return web.json_response(profiling.cpu.stats())
+
+
+@authentication_required
+async def stop_cpu(request):
+    """Stops the CPU profiler and returns its profile"""
+    try:
+        profiling.cpu.stop()
+    except profiling.ProfilerError as e:
+        return web.json_response({'message': str(e)}, status=409)
+
+    return web.Response(text=profiling.cpu.report())
+
+
+@authentication_required
+async def get_cpu(request):
+    """Returns the profile in the collapsed stack format. The profiler
+    keeps running if it has not stopped.
+    """
+    return web.Response(text=profiling.cpu.report())
+
+
+@authentication_required
+async def start_memory(request):
+    """Starts tracing memory allocations
+
+    The optional posted JSON document looks like:
+    {
+        "frames": 1
+    }
+    """
+    try:
+        options = await _options(request)
+        profiling.memory.start(frames=options.get('frames', 1))
+    except profiling.ProfilerError as e:
+        return web.json_response({'message': str(e)}, status=409)
+    except (ValueError, TypeError):
+        return web.json_response({'message': 'Invalid request'}, status=400)
+
+    return web.json_response({'running': True})
+
+
+@authentication_required
+async def snapshot_memory(request):
+    """Takes a snapshot and returns the top allocators, or the growth
+    since the previous snapshot
+
+    The optional posted JSON document looks like:
+    {
+        "limit": 20
+    }
+    """
+    try:
+        options = await _options(request)
+        return web.json_response(profiling.memory.snapshot(limit=options.get('limit', 20)))
+    except profiling.ProfilerError as e:
+        return web.json_response({'message': str(e)}, status=409)
+    except (ValueError, TypeError):
+        return web.json_response({'message': 'Invalid request'}, status=400)
+
+
+@authentication_required
+async def stop_memory(request):
+    """Stops tracing memory allocations"""
+    try:
+        profiling.memory.stop()
+    except profiling.ProfilerError as e:
+        return web.json_response({'message': str(e)}, status=409)
+
+    return web.json_response({'running': False})
+
+
+def register_handlers(router):
+    """Registers URI handlers"""
+    router.add_route('POST', '/api/profiling/cpu/start', start_cpu)
+    router.add_route('POST', '/api/profiling/cpu/stop', stop_cpu)
+    router.add_route('GET', '/api/profiling/cpu', get_cpu)
+    router.add_route('POST', '/api/profiling/memory/start', start_memory)
+    router.add_route('POST', '/api/profiling/memory/snapshot', snapshot_memory)
+    router.add_route('POST', '/api/profiling/memory/stop', stop_memory)
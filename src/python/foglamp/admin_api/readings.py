@@ -0,0 +1,310 @@
+"""
+Readings URI handlers
+
+See foglamp.storage.readings_query and foglamp.storage.latest. All
+methods require authentication.
+"""
+
+import asyncio
+import base64
+import binascii
+import json
+import logging
+
+from aiohttp import web
+
+from foglamp.admin_api.auth import authentication_required
+from foglamp.device_api.validation import parse_timestamp
+from foglamp.storage import latest
+from foglamp.storage import readings_query
+from foglamp.storage.readings_query import ReadingsQuery
+
+DEFAULT_LIMIT = 1000
+MAX_LIMIT = 1000000
+"""Rows in one response. A response is streamed, so even the largest
+page is held in memory only ``fetch_size`` rows at a time."""
+
+MAX_STREAMS = 3
+"""Responses of get_readings streamed at once. Each holds a pooled
+connection until its client has read it, and the pool is shared with
+ingest, purge and the streamer, so this stays well below its max_size."""
+
+WRITE_TIMEOUT = 30
+"""Seconds a client may take to read a chunk before its response is
+aborted and the connection returned to the pool"""
+
+_logger = logging.getLogger(__name__)
+
+_streams = 0
+"""Responses of get_readings being streamed"""
+
+
+def _encode_key(key):
+    """Returns the 'next' token for a (user_ts, id) keyset"""
+    user_ts, id = key
+    value = '{}|{}'.format(user_ts.isoformat(), id)
+    return base64.urlsafe_b64encode(value.encode('utf-8')).decode('ascii')
+
+
+def _decode_key(token):
+    try:
+        user_ts, id = base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8').split('|')
+        return parse_timestamp(user_ts), int(id)
+    except (binascii.Error, UnicodeError, ValueError):
+        raise ValueError('next is not valid')
+
+
+def _parse_query(request):
+    """Returns ReadingsQuery arguments for the query string
+
+    Raises:
+        ValueError: With a message for the client
+    """
+    arguments = {}
+
+    for name, argument in (('from', 'start'), ('to', 'end')):
+        value = request.query.get(name)
+        if value is not None:
+            try:
+                arguments[argument] = parse_timestamp(value)
+            except ValueError:
+                raise ValueError('{} must be an ISO 8601 timestamp'.format(name))
+
+    try:
+        limit = int(request.query.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        limit = 0
+    if not 0 < limit <= MAX_LIMIT:
+        raise ValueError('limit must be between 1 and {}'.format(MAX_LIMIT))
+    arguments['limit'] = limit
+
+    token = request.query.get('next')
+    if token:
+        arguments['after'] = _decode_key(token)
+
+    return arguments
+
+
+def _row_json(row):
+    return json.dumps({
+        'id': row['id'],
+        'read_key': str(row['read_key']) if row['read_key'] is not None else None,
+        'reading': row['reading'],
+        'user_ts': row['user_ts'].isoformat(),
+        'ts': row['ts'].isoformat()
+    })
+
+
+@authentication_required
+async def get_readings(request):
+    """Returns an asset's readings in user_ts order
+
+    Query string (all optional):
+
+    - from, to: ISO 8601 user_ts range, 'to' being exclusive
+    - limit: Maximum number of readings (default 1000)
+    - next: The 'next' value of the previous response
+
+    The response is streamed as it is read and looks like:
+    {
+        "asset_code": "mouse",
+        "readings": [
+            {"id": 1, "read_key": "...", "reading": {...},
+             "user_ts": "2017-01-02T01:02:03.232320+00:00", "ts": "..."},
+            ...
+        ],
+        "next": "MjAxNy0wMS0wMlQwMTowMjow..."
+    }
+    next is null once there are no more readings.
+
+    While MAX_STREAMS responses are being streamed others are refused
+    with 503, and a client that stops reading is disconnected after
+    WRITE_TIMEOUT seconds.
+    """
+    asset_code = request.match_info['asset_code']
+
+    try:
+        arguments = _parse_query(request)
+    except ValueError as e:
+        return web.json_response({'message': str(e)}, status=400)
+
+    global _streams
+    if _streams >= MAX_STREAMS:
+        return web.json_response({'message': 'Too many readings queries, try again later'},
+                                 status=503)
+
+    _streams += 1
+    try:
+        return await _stream_readings(request, asset_code, arguments)
+    finally:
+        _streams -= 1
+
+
+async def _stream_readings(request, asset_code, arguments):
+    response = web.StreamResponse(headers={'Content-Type': 'application/json'})
+    response.enable_chunked_encoding()
+
+    async with ReadingsQuery(asset_code, **arguments) as query:
+        await response.prepare(request)
+        response.write('{{"asset_code": {}, "readings": ['.format(json.dumps(asset_code)).encode('utf-8'))
+        separator = ''
+
+        async for rows in query:
+            chunk = separator + ', '.join(_row_json(row) for row in rows)
+            separator = ', '
+            response.write(chunk.encode('utf-8'))
+            # Reads no more rows until the client has taken these
+            try:
+                await asyncio.wait_for(response.drain(), WRITE_TIMEOUT)
+            except asyncio.TimeoutError:
+                _logger.warning('Aborting readings of %s: the client read nothing for %s seconds',
+                                asset_code, WRITE_TIMEOUT)
+                # Drops the unsent chunks rather than waiting for the
+                # client to read them. Leaving the 'async with' closes
+                # the cursor and releases the connection, and aiohttp
+                # takes CancelledError for a client that went away.
+                request.transport.abort()
+                raise asyncio.CancelledError()
+
+    next_token = None
+    if query.count == arguments['limit']:
+        next_token = _encode_key(query.last_key)
+
+    response.write('], "next": {}}}'.format(json.dumps(next_token)).encode('utf-8'))
+    await response.write_eof()
+    return response
+
+
+def _point(point):
+    return [point[0].isoformat(), point[1]]
+
+
+def _summary_json(summary):
+    return {
+        'count': summary['count'],
+        'min': summary['min'],
+        'max': summary['max'],
+        'avg': summary['avg'],
+        'first': summary['first'][1],
+        'last': summary['last'][1]
+    }
+
+
+@authentication_required
+async def get_summary(request):
+    """Returns numbers inside an asset's readings aggregated by time bucket
+
+    Query string:
+
+    - from, to: ISO 8601 user_ts range, 'to' being exclusive
+    - bucket: Seconds per bucket
+    - paths: Comma separated dotted paths of numbers inside 'reading',
+      for example 'temperature.value,humidity'
+    - mode (optional): 'aggregate' (the default) or 'lttb'
+
+    With mode=aggregate the response looks like:
+    {
+        "asset_code": "sensor",
+        "bucket": 60,
+        "buckets": [
+            {"ts": "2017-01-02T01:02:00+00:00", "rows": 60,
+             "values": {"temperature.value": {"count": 60, "min": 20.5, "max": 21.0,
+                                              "avg": 20.7, "first": 20.5, "last": 21.0}}},
+            ...
+        ]
+    }
+    Buckets without readings are left out.
+
+    With mode=lttb there is one point per bucket and path, picked for
+    plotting as a line:
+    {
+        "asset_code": "sensor",
+        "bucket": 60,
+        "points": {"temperature.value": [["2017-01-02T01:02:13+00:00", 20.9], ...]}
+    }
+    """
+    asset_code = request.match_info['asset_code']
+
+    try:
+        try:
+            start = parse_timestamp(request.query['from'])
+            end = parse_timestamp(request.query['to'])
+        except (KeyError, ValueError):
+            raise ValueError('from and to must be ISO 8601 timestamps')
+
+        try:
+            bucket_seconds = float(request.query['bucket'])
+        except (KeyError, ValueError):
+            raise ValueError('bucket must be a number of seconds')
+
+        paths = [path for path in request.query.get('paths', '').split(',') if path]
+        mode = request.query.get('mode', 'aggregate')
+        if mode not in ('aggregate', 'lttb'):
+            raise ValueError('mode must be aggregate or lttb')
+
+        buckets = await readings_query.summarize(asset_code, start, end, bucket_seconds, paths)
+    except ValueError as e:
+        return web.json_response({'message': str(e)}, status=400)
+
+    result = {'asset_code': asset_code, 'bucket': bucket_seconds}
+
+    if mode == 'lttb':
+        result['points'] = {path: [_point(point) for point in readings_query.lttb(buckets, path)]
+                            for path in paths}
+    else:
+        result['buckets'] = [{
+            'ts': bucket['start'].isoformat(),
+            'rows': bucket['rows'],
+            'values': {path: _summary_json(summary) for path, summary in bucket['values'].items()}
+        } for bucket in buckets]
+
+    return web.json_response(result)
+
+
+def _latest_json(entry):
+    user_ts, reading = entry
+    return {'user_ts': user_ts.isoformat(), 'reading': reading}
+
+
+@authentication_required
+async def get_latest_readings(request):
+    """Returns the latest reading of several assets, from memory
+
+    With ?assets=mouse,pump1 only those assets are returned, otherwise
+    every asset is. The response looks like:
+    {
+        "readings": {
+            "mouse": {"user_ts": "2017-01-02T01:02:03.232320+00:00", "reading": {...}}
+        },
+        "missing": ["pump1"]
+    }
+    """
+    assets = request.query.get('assets')
+    asset_codes = [code for code in assets.split(',') if code] if assets is not None else None
+    entries = latest.cache.get_many(asset_codes)
+
+    return web.json_response({
+        'readings': {asset_code: _latest_json(entry) for asset_code, entry in entries.items()},
+        'missing': [code for code in asset_codes or () if code not in entries]
+    })
+
+
+@authentication_required
+async def get_latest_reading(request):
+    """Returns an asset's latest reading, from memory
+
+    The response looks like:
+    {"user_ts": "2017-01-02T01:02:03.232320+00:00", "reading": {...}}
+    """
+    entry = latest.cache.get(request.match_info['asset_code'])
+    if entry is None:
+        return web.json_response({'message': 'No readings'}, status=404)
+    return web.json_response(_latest_json(entry))
+
+
+def register_handlers(router):
+    """Registers URI handlers"""
+    router.add_route('GET', '/api/readings/{asset_code}', get_readings)
+    router.add_route('GET', '/api/readings/{asset_code}/summary', get_summary)
+    router.add_route('GET', '/api/latest-readings', get_latest_readings)
+    router.add_route('GET', '/api/latest-readings/{asset_code}', get_latest_reading)
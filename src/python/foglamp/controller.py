@@ -1,14 +1,60 @@
 import asyncio
 
-from foglamp.device_api.coap import controller as coap_controller
-from foglamp.admin_api import controller as admin_api_controller
+from foglamp.startup import profile
 import foglamp.env as env
 
+# Subsystems are imported as they start, so that a process only loads
+# what it runs: with ingest workers, for example, the main process never
+# imports aiocoap. See foglamp.startup for timing the phases.
+
 
 def start():
     """Starts FogLAMP services"""
-    env.load_config()
-    coap_controller.start()
-    admin_api_controller.start()
-    asyncio.get_event_loop().run_forever()
+    with profile.phase('configuration'):
+        env.load_config()
+
+    with profile.phase('event loop'):
+        from foglamp import event_loop
+        event_loop.install_policy()
+        loop = asyncio.get_event_loop()
+        event_loop.monitor.start()
+
+    with profile.phase('database'):
+        from foglamp.storage import configuration
+        from foglamp.storage import pool
+        loop.run_until_complete(pool.create())
+        loop.run_until_complete(configuration.cache.start())
+
+    with profile.phase('storage tasks'):
+        from foglamp.storage import partitions
+        from foglamp.storage import purge
+        from foglamp.streaming import streamer
+        partitions.maintenance.start()
+        purge.task.start()
+        streamer.service.start()
 
+    with profile.phase('ingest'):
+        from foglamp.device_api.coap import workers as coap_workers
+        coap_settings = coap_workers.settings()
+
+        if coap_settings['workers'] > 0:
+            coap_workers.supervisor.start(int(coap_settings['workers']),
+                                          float(coap_settings['stats_interval']))
+        else:
+            from foglamp.device_api import admission
+            from foglamp.device_api import compression
+            from foglamp.device_api import dedup
+            from foglamp.device_api.coap import controller as coap_controller
+            from foglamp.storage import readings
+            loop.run_until_complete(readings.buffer.start())
+            loop.run_until_complete(admission.control.start())
+            loop.run_until_complete(dedup.read_keys.start())
+            loop.run_until_complete(compression.filters.start())
+            coap_controller.start()
+
+    with profile.phase('admin api'):
+        from foglamp.admin_api import controller as admin_api_controller
+        admin_api_controller.start()
+
+    profile.finish()
+    asyncio.get_event_loop().run_forever()
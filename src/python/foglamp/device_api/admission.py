@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Admission control for the ingest handlers
+
+Readings are refused, rather than queued without bound, when
+
+- the readings buffer has more pending readings than its high watermark
+  (it accepts readings again once it has drained to its low watermark), or
+- the device sending them has exceeded its share: every source address
+  has a token bucket that refills at ``device_rate`` readings per second
+  up to ``device_burst`` readings, so one chatty device cannot starve
+  the rest. At most ``_MAX_DEVICES`` buckets are kept, and the least
+  recently updated is forgotten to make room for a new device, which
+  bounds memory even when source addresses are spoofed.
+
+Handlers answer a refused request with 5.03 Service Unavailable and a
+Max-Age option telling the device how many seconds to wait.
+
+The settings are read from the 'INGST' row of foglamp.configuration.
+"""
+
+import collections
+import heapq
+import logging
+import math
+import time
+
+from foglamp import metrics
+from foglamp.storage import configuration
+from foglamp.storage import readings as readings_storage
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+_logger = logging.getLogger(__name__)
+
+_CONFIGURATION_KEY = 'INGST'
+
+_DEFAULT_CONFIGURATION = {
+    'device_rate': 500,
+    'device_burst': 1000,
+    'busy_max_age': 5
+}
+"""Used for settings missing from the 'INGST' configuration row
+
+- device_rate: Readings per second a device may send (0 means unlimited)
+- device_burst: Readings a device may send at once after being idle
+- busy_max_age: Max-Age (seconds) sent when the readings buffer is full
+"""
+
+_MAX_DEVICES = 10000
+"""Devices tracked at most. A forgotten device starts with a full bucket."""
+
+_STATS_DEVICES = 100
+"""Devices, by rate, whose counters stats() returns"""
+
+_RATE_WINDOW = 60.0
+"""Seconds over which the per-device rate reported by stats() is averaged"""
+
+
+class _Device(object):
+    """Token bucket and counters for one source address"""
+    __slots__ = ['tokens', 'updated', 'admitted', 'rejected', 'rate']
+
+    def __init__(self, tokens, now):
+        self.tokens = tokens
+        self.updated = now
+        self.admitted = 0
+        self.rejected = 0
+        self.rate = 0.0
+        """Exponentially decaying average of admitted readings per second"""
+
+
+class AdmissionControl(object):
+    """Decides whether readings from a device are accepted"""
+
+    def __init__(self):
+        self.device_rate = _DEFAULT_CONFIGURATION['device_rate']
+        self.device_burst = _DEFAULT_CONFIGURATION['device_burst']
+        self.busy_max_age = _DEFAULT_CONFIGURATION['busy_max_age']
+
+        self._devices = collections.OrderedDict()
+        """source -> _Device, least recently updated first"""
+        self._counters = {
+            'admitted': 0,
+            'rejected_busy': 0,
+            'rejected_rate': 0
+        }
+
+    async def start(self):
+        """Reads the 'INGST' configuration and follows changes to it"""
+        try:
+            config = await configuration.get(_CONFIGURATION_KEY, _DEFAULT_CONFIGURATION)
+        except Exception:
+            _logger.exception('Unable to read the %s configuration. Using defaults.',
+                              _CONFIGURATION_KEY)
+            config = _DEFAULT_CONFIGURATION
+
+        self.configure(config)
+        configuration.cache.subscribe(_CONFIGURATION_KEY, self.configure, _DEFAULT_CONFIGURATION)
+
+    def configure(self, config):
+        """Applies 'INGST' settings"""
+        self.device_rate = float(config['device_rate'])
+        self.device_burst = float(config['device_burst'])
+        self.busy_max_age = int(config['busy_max_age'])
+
+    def admit(self, source, count=1):
+        """Checks whether ``count`` readings from ``source`` may be accepted
+
+        Args:
+            source: A hashable identifying the device, such as its IP address
+            count (int): Number of readings in the request
+
+        Returns:
+            None if the readings are accepted, otherwise the number of
+            seconds the device should wait before retrying
+        """
+        if readings_storage.buffer.is_full():
+            self._counters['rejected_busy'] += 1
+            return self.busy_max_age
+
+        if self.device_rate <= 0:
+            self._counters['admitted'] += count
+            return None
+
+        now = time.monotonic()
+        device = self._devices.get(source)
+
+        if device is None:
+            if len(self._devices) >= _MAX_DEVICES:
+                self._devices.popitem(last=False)
+            device = _Device(self.device_burst, now)
+            self._devices[source] = device
+        else:
+            self._devices.move_to_end(source)
+
+        elapsed = now - device.updated
+        device.updated = now
+        device.tokens = min(self.device_burst, device.tokens + elapsed * self.device_rate)
+        device.rate *= math.exp(-elapsed / _RATE_WINDOW)
+
+        # A batch larger than the bucket is accepted when the bucket is full
+        needed = min(count, self.device_burst)
+
+        if device.tokens < needed:
+            device.rejected += count
+            self._counters['rejected_rate'] += 1
+            return max(1, int(math.ceil((needed - device.tokens) / self.device_rate)))
+
+        device.tokens -= needed
+        device.admitted += count
+        device.rate += count / _RATE_WINDOW
+        self._counters['admitted'] += count
+        return None
+
+    def stats(self):
+        """Returns counters, the readings buffer's depth, the number of
+        devices tracked and the counters and rates of the ``_STATS_DEVICES``
+        busiest devices as a dict
+        """
+        result = dict(self._counters)
+        result['pending'] = readings_storage.buffer.stats()['pending']
+        result['tracked_devices'] = len(self._devices)
+        result['devices'] = {
+            str(source): {'admitted': device.admitted,
+                          'rejected': device.rejected,
+                          'rate': device.rate}
+            for source, device in heapq.nlargest(_STATS_DEVICES, self._devices.items(),
+                                                 key=lambda item: item[1].rate)}
+        return result
+
+
+control = AdmissionControl()
+"""The admission control shared by all ingest handlers"""
+
+metrics.registry.stats('foglamp_admission', lambda: control.stats(),
+                       counters=('admitted', 'rejected_busy', 'rejected_rate'))
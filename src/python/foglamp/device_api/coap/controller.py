@@ -1,11 +1,21 @@
 import asyncio
+import socket
+
 import aiocoap
+from aiocoap.numbers.constants import COAP_PORT
 
 from foglamp.device_api.coap.sensor_values import SensorValues
+from foglamp.device_api.coap.sensor_values_batch import SensorValuesBatch
+
 
+def start(reuse_port=False, port=COAP_PORT):
+    """Registers all CoAP URI handlers
 
-def start():
-    """Registers all CoAP URI handlers"""
+    Args:
+        reuse_port (bool): Bind the CoAP port with SO_REUSEPORT so that
+            several processes can receive readings on it
+        port (int): The UDP port to listen on
+    """
     root = aiocoap.resource.Site()
 
     # Register CoAP methods
@@ -13,5 +23,26 @@ def start():
                       aiocoap.resource.WKCResource(root.get_resources_as_linkheader))
 
     SensorValues().register_handlers(root)
+    SensorValuesBatch().register_handlers(root)
+
+    if reuse_port:
+        asyncio.ensure_future(_create_reuse_port_context(root, ('::', port)))
+    else:
+        asyncio.Task(aiocoap.Context.create_server_context(root, ('::', port)))
+
+
+async def _create_reuse_port_context(site, bind=('::', COAP_PORT)):
+    """Creates a server context whose socket is bound with SO_REUSEPORT
+
+    aiocoap binds with SO_REUSEADDR only, which on Linux delivers every
+    datagram to the socket bound last. The context is created unbound
+    and its socket is bound here instead.
+    """
+    context = await aiocoap.Context.create_server_context(site, bind=None)
+
+    sock = context.transport_endpoints[0].transport.get_extra_info('socket')
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(bind)
 
-    asyncio.Task(aiocoap.Context.create_server_context(root))
+    return context
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""FOGLAMP_PRELUDE_BEGIN
+{{FOGLAMP_LICENSE_DESCRIPTION}}
+
+See: http://foglamp.readthedocs.io/
+
+Copyright (c) 2017 OSIsoft, LLC
+License: Apache 2.0
+
+FOGLAMP_PRELUDE_END
+"""
+
+from cbor2 import dumps, loads
+import aiocoap
+import aiocoap.resource
+
+from foglamp.device_api import admission
+from foglamp.device_api import compression
+from foglamp.device_api import dedup
+from foglamp.device_api.coap.sensor_values import instrumented, parse_reading, readings_received, \
+    request_source, service_unavailable
+from foglamp.storage import latest
+from foglamp.storage import readings as readings_storage
+from foglamp.storage.spool import RecordTooLarge
+
+"""CoAP handler for coap://other/sensor-values-batch URI
+"""
+
+__version__ = '${VERSION}'
+
+_CBOR_CONTENT_FORMAT = 60
+"""CoAP Content-Format number of application/cbor"""
+
+_STATUS_OK = 'ok'
+
+
+class SensorValuesBatch(aiocoap.resource.Resource):
+    """CoAP handler for coap://other/sensor-values-batch URI
+
+    Accepts many readings in one message so that gateways do not
+    need one CoAP exchange per reading
+    """
+
+    def __init__(self):
+        super(SensorValuesBatch, self).__init__()
+
+    def register_handlers(self, resource_root):
+        """Registers other/sensor-values-batch URI"""
+        resource_root.add_resource(('other', 'sensor-values-batch'), self)
+        return
+
+    @instrumented('sensor-values-batch')
+    async def render_post(self, request):
+        """Sends a batch of asset readings to the storage layer
+
+        request.payload is a CBOR array of readings in the format
+        accepted by coap://other/sensor-values:
+        [
+            {
+                "timestamp": "2017-01-02T01:02:03.23232Z-05:00",
+                "asset": "pump1",
+                "sensor_values": {"velocity": "500"}
+            },
+            {
+                "timestamp": "2017-01-02T01:02:04.23232Z-05:00",
+                "asset": "pump1",
+                "sensor_values": {"velocity": "501"}
+            }
+        ]
+
+        The response payload is a CBOR array with one entry per reading,
+        in the same order: "ok" when the reading was accepted, otherwise
+        the reason it was rejected. Accepted readings are stored even
+        when others in the batch are rejected.
+
+        When FogLAMP is too busy, the whole batch is refused with
+        5.03 Service Unavailable.
+        """
+        try:
+            items = loads(request.payload)
+        except:
+            return aiocoap.Message(payload=''.encode("utf-8"), code=aiocoap.numbers.codes.Code.BAD_REQUEST)
+
+        if not isinstance(items, list):
+            return aiocoap.Message(payload=''.encode("utf-8"), code=aiocoap.numbers.codes.Code.BAD_REQUEST)
+
+        rows = []
+        keys = set()
+        statuses = []
+
+        for item in items:
+            try:
+                row = parse_reading(item)
+            except ValueError as e:
+                statuses.append(str(e))
+                continue
+
+            statuses.append(_STATUS_OK)
+            key = row['read_key']
+
+            # Retransmissions of readings that have been accepted
+            # are acknowledged but not stored again
+            if key is not None:
+                if key in keys or dedup.read_keys.contains(key):
+                    continue
+                keys.add(key)
+
+            rows.append(row)
+
+        if rows:
+            retry_after = admission.control.admit(request_source(request), len(rows))
+            if retry_after is not None:
+                return service_unavailable(retry_after)
+
+        try:
+            with compression.filters.applying(rows) as stored:
+                readings_storage.buffer.add_many(stored)
+        except RecordTooLarge:
+            return aiocoap.Message(payload=''.encode("utf-8"),
+                                   code=aiocoap.numbers.codes.Code.REQUEST_ENTITY_TOO_LARGE)
+
+        for key in keys:
+            dedup.read_keys.add(key)
+
+        latest.cache.update_many(rows)
+        readings_received.inc(len(rows))
+
+        response = aiocoap.Message(payload=dumps(statuses), code=aiocoap.numbers.codes.Code.VALID)
+        response.opt.content_format = _CBOR_CONTENT_FORMAT
+        return response
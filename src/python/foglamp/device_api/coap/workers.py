@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""CoAP ingest worker processes
+
+Decoding, validating and batching readings is CPU bound, so one process
+uses one core however many the gateway has. With ``workers`` set in
+the 'coap' section of foglamp-env.yaml::
+
+    coap:
+      workers: 4
+      stats_interval: 5
+
+the main process starts that many worker processes. Each one has its
+own event loop, connection pool and readings buffer and binds the CoAP
+port with SO_REUSEPORT. The kernel spreads datagrams across the workers
+by source address and port, so retransmissions from a device reach the
+worker that has its read keys.
+
+When spooling is enabled each worker spools to a 'worker-<n>'
+subdirectory of the spool directory.
+
+Workers send their stats, and the latest readings that changed (see
+:mod:`foglamp.storage.latest`), to the main process every
+``stats_interval`` seconds and log through it. A worker that exits is
+started again.
+"""
+
+import asyncio
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import signal
+
+from foglamp import env
+from foglamp import event_loop
+from foglamp import metrics
+from foglamp.device_api import admission
+from foglamp.device_api import compression
+from foglamp.device_api import dedup
+from foglamp.storage import configuration
+from foglamp.storage import latest
+from foglamp.storage import pool
+from foglamp.storage import readings
+from foglamp.storage import spool
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    'workers': 0,
+    'stats_interval': 5
+}
+"""Used for settings missing from the 'coap' section of foglamp-env.yaml
+
+- workers: Number of ingest worker processes. With 0, readings are
+  received by the main process.
+- stats_interval: Seconds between stats reports from a worker
+"""
+
+_RESTART_SECONDS = 1
+"""Seconds to wait before starting a worker that has exited"""
+
+_STOP_SECONDS = 10
+"""Seconds a worker is given to flush its buffer when it is stopped"""
+
+_TOTALLED_SECTIONS = ('readings', 'admission', 'dedup', 'compression')
+"""Stats sections whose counters are summed across workers. Loop lag
+percentiles are not.
+"""
+
+# Workers are started from a fresh interpreter: forking the main
+# process would share its event loop and database connections
+_context = multiprocessing.get_context('spawn')
+
+
+def settings():
+    """Returns the 'coap' section of foglamp-env.yaml merged over
+    :data:`DEFAULT_SETTINGS`
+    """
+    return dict(DEFAULT_SETTINGS, **((env.config or {}).get('coap') or {}))
+
+
+class _Worker(object):
+    """The main process's view of a worker process"""
+
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.restarts = 0
+        self.stats = {}
+        """The last stats sent by the worker"""
+
+
+class Supervisor(object):
+    """Starts the ingest workers, restarts them when they exit and
+    collects their stats
+    """
+
+    def __init__(self):
+        self._workers = []
+        self._stats_interval = DEFAULT_SETTINGS['stats_interval']
+        self._log_queue = None
+        self._log_listener = None
+        self._stopping = False
+
+    def start(self, count, stats_interval=DEFAULT_SETTINGS['stats_interval']):
+        """Starts ``count`` workers"""
+        self._stats_interval = stats_interval
+        self._stopping = False
+
+        # Records logged by workers are handled by this process's handlers
+        self._log_queue = _context.Queue()
+        self._log_listener = logging.handlers.QueueListener(
+            self._log_queue, *logging.getLogger().handlers, respect_handler_level=True)
+        self._log_listener.start()
+
+        self._workers = [_Worker(index) for index in range(count)]
+        for worker in self._workers:
+            self._spawn(worker)
+
+        _logger.info('Started %s CoAP ingest workers', count)
+
+    def stop(self):
+        """Stops the workers after they have flushed their buffers"""
+        self._stopping = True
+        loop = asyncio.get_event_loop()
+
+        for worker in self._workers:
+            if worker.conn is not None:
+                loop.remove_reader(worker.conn.fileno())
+                worker.conn.close()
+                worker.conn = None
+            worker.process.terminate()
+
+        for worker in self._workers:
+            worker.process.join(_STOP_SECONDS)
+
+        if self._log_listener is not None:
+            self._log_listener.stop()
+            self._log_listener = None
+
+    def stats(self):
+        """Returns the last stats of each worker and their totals as a dict"""
+        workers = []
+        totals = {}
+
+        for worker in self._workers:
+            worker_stats = {section: counters for section, counters in worker.stats.items()
+                            if section != 'metrics'}
+            workers.append(dict(worker_stats,
+                                index=worker.index,
+                                pid=worker.process.pid,
+                                alive=worker.process.is_alive(),
+                                restarts=worker.restarts))
+
+            for section, counters in worker.stats.items():
+                if section not in _TOTALLED_SECTIONS:
+                    continue
+                section_totals = totals.setdefault(section, {})
+                for name, value in counters.items():
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        section_totals[name] = section_totals.get(name, 0) + value
+
+        if 'compression' in totals:
+            totals['compression']['reduction'] = compression.reduction(totals['compression'])
+
+        return {'workers': workers, 'totals': totals}
+
+    def metrics(self):
+        """Returns the last metrics snapshot of each worker, labelled
+        with the worker's index
+        """
+        return metrics.merge(*[metrics.add_label(worker.stats['metrics'], 'worker', str(worker.index))
+                               for worker in self._workers if 'metrics' in worker.stats])
+
+    def _spawn(self, worker):
+        conn, child_conn = _context.Pipe()
+
+        worker.process = _context.Process(
+            target=_run_worker,
+            name='foglamp-coap-{}'.format(worker.index),
+            args=(worker.index, child_conn, self._log_queue,
+                  logging.getLogger().getEffectiveLevel(), self._stats_interval),
+            daemon=True)
+        worker.process.start()
+        child_conn.close()
+
+        worker.conn = conn
+        asyncio.get_event_loop().add_reader(conn.fileno(), self._receive, worker)
+
+    def _receive(self, worker):
+        try:
+            worker_stats = worker.conn.recv()
+            latest.cache.merge(worker_stats.pop('latest', {}))
+            worker.stats = worker_stats
+            return
+        except (EOFError, OSError):
+            pass
+
+        loop = asyncio.get_event_loop()
+        loop.remove_reader(worker.conn.fileno())
+        worker.conn.close()
+        worker.conn = None
+        worker.process.join()
+
+        if self._stopping:
+            return
+
+        _logger.error('CoAP ingest worker %s exited with code %s. Restarting it.',
+                      worker.index, worker.process.exitcode)
+        worker.restarts += 1
+        worker.stats = {}
+        loop.call_later(_RESTART_SECONDS, self._restart, worker)
+
+    def _restart(self, worker):
+        if not self._stopping:
+            self._spawn(worker)
+
+
+def _ingest_stats():
+    admission_stats = admission.control.stats()
+    # Per-device counters can be large and are not needed for totals
+    del admission_stats['devices']
+
+    return {'readings': readings.buffer.stats(),
+            'admission': admission_stats,
+            'dedup': dedup.read_keys.stats(),
+            'compression': compression.filters.stats(),
+            'loop': event_loop.monitor.stats(),
+            'metrics': metrics.registry.snapshot(),
+            'latest': latest.cache.changes()}
+
+
+def _run_worker(index, conn, log_queue, log_level, stats_interval):
+    """The main function of a worker process"""
+    # Only workers receive CoAP, so the main process does not import aiocoap
+    from foglamp.device_api.coap import controller as coap_controller
+
+    root_logger = logging.getLogger()
+    root_logger.handlers = [logging.handlers.QueueHandler(log_queue)]
+    root_logger.setLevel(log_level)
+
+    env.load_config()
+    event_loop.install_policy()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    event_loop.monitor.start()
+
+    spool_directory = os.path.join(
+        dict(spool.DEFAULT_SETTINGS, **(env.config.get('spool') or {}))['directory'],
+        'worker-{}'.format(index))
+
+    loop.run_until_complete(pool.create())
+    loop.run_until_complete(configuration.cache.start())
+    loop.run_until_complete(readings.buffer.start(spool_directory))
+    loop.run_until_complete(admission.control.start())
+    loop.run_until_complete(dedup.read_keys.start())
+    loop.run_until_complete(compression.filters.start())
+    coap_controller.start(reuse_port=True)
+
+    def send_stats():
+        try:
+            conn.send(_ingest_stats())
+        except OSError:
+            # The main process has exited
+            loop.stop()
+            return
+        loop.call_later(stats_interval, send_stats)
+
+    # The pipe only becomes readable when the main process has exited
+    loop.add_reader(conn.fileno(), loop.stop)
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
+    loop.add_signal_handler(signal.SIGINT, loop.stop)
+    loop.call_soon(send_stats)
+
+    _logger.info('CoAP ingest worker %s started', index)
+
+    try:
+        loop.run_forever()
+    finally:
+        event_loop.monitor.stop()
+        loop.run_until_complete(readings.buffer.stop())
+        loop.run_until_complete(configuration.cache.stop())
+        loop.run_until_complete(pool.close())
+        conn.close()
+
+
+supervisor = Supervisor()
+"""Supervises the ingest workers of the main process"""
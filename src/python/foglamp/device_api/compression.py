@@ -0,0 +1,426 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Compression of readings before they are stored
+
+Sensors often report the same value again and again. The ingest handlers
+pass accepted readings through :meth:`CompressionFilters.applying`, which
+returns the readings worth storing and forgets what they did to the
+filters if the readings cannot be buffered. A reading is dropped when none of
+its numbers has moved far enough from the last stored reading of its
+asset, according to the filter of each number:
+
+- ``deadband``: The value is stored when it differs from the last
+  stored value by more than ``deviation``, or by more than ``percent``
+  percent of the last stored value. A setting that is 0 or missing is
+  not checked; with neither, any change is stored.
+- ``swinging_door``: Swinging door trending. Values are held until a
+  straight line from the last stored value can no longer pass within
+  ``deviation`` of every value since. The last held reading is then
+  stored, so stored readings trace the signal within ``deviation``.
+- ``none``: Every reading is stored.
+
+With ``max_interval`` (seconds) a reading is stored at least that often,
+as a heartbeat. A reading is always stored when it is the first of its
+asset, when its timestamp is not after the last stored one, or when
+anything besides its numbers (strings, lists, which keys it has) has
+changed. Numbers sent as strings are not filtered.
+
+Filters are configured in the 'CMPRS' row of foglamp.configuration, by
+asset and optionally by point path (see
+:func:`foglamp.storage.reading_values.flatten` for paths)::
+
+    {
+        "default": {"type": "none"},
+        "assets": {
+            "pump1": {
+                "type": "deadband", "deviation": 0.5, "max_interval": 600,
+                "points": {"temperature.value": {"type": "swinging_door", "deviation": 0.2}}
+            }
+        }
+    }
+
+A point inherits the settings of its asset that it does not set. The
+state of each asset is a few floats per number and the last held
+reading; it is kept for the :data:`_MAX_ASSETS` most recently seen
+assets. With ingest workers each worker filters the readings it
+receives, and a device's readings reach the same worker.
+"""
+
+import collections
+import contextlib
+import logging
+
+from foglamp import metrics
+from foglamp.storage import configuration
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+_logger = logging.getLogger(__name__)
+
+_CONFIGURATION_KEY = 'CMPRS'
+
+_DEFAULT_CONFIGURATION = {
+    'default': {'type': 'none'},
+    'assets': {}
+}
+"""Used for settings missing from the 'CMPRS' configuration row
+
+- default: The filter of assets that are not in 'assets'
+- assets: asset code -> filter, with an optional 'points' object of
+  point path -> filter
+"""
+
+TYPES = ('none', 'deadband', 'swinging_door')
+"""Valid values of a filter's 'type'"""
+
+_MAX_ASSETS = 10000
+"""The least recently seen assets are forgotten when more than this
+many are tracked. Their next reading is stored."""
+
+_MAX_VALUES = 100
+"""Readings with more numbers than this are always stored"""
+
+_MAX_DEPTH = 8
+"""Objects nested deeper than this are compared as a whole"""
+
+
+class _Filter(object):
+    """The settings of a filter"""
+    __slots__ = ['type', 'deviation', 'percent', 'max_interval']
+
+    def __init__(self, settings):
+        self.type = settings.get('type', 'none')
+        if self.type not in TYPES:
+            raise ValueError('Unknown compression filter type: {}'.format(self.type))
+
+        self.deviation = float(settings.get('deviation', 0))
+        self.percent = float(settings.get('percent', 0))
+        self.max_interval = float(settings.get('max_interval', 0))
+
+    def outside_deadband(self, v, v0):
+        """Whether v differs from v0 by more than deviation or percent"""
+        change = abs(v - v0)
+        if self.deviation and change > self.deviation:
+            return True
+        if self.percent and change > abs(v0) * self.percent / 100:
+            return True
+        return not self.deviation and not self.percent and change > 0
+
+
+class _AssetFilters(object):
+    """The filters of an asset's points"""
+    __slots__ = ['default', 'points']
+
+    def __init__(self, settings):
+        settings = dict(settings)
+        points = settings.pop('points', None) or {}
+
+        self.default = _Filter(settings)
+        self.points = {path: _Filter(dict(settings, **point_settings))
+                       for path, point_settings in points.items()}
+
+    def get(self, path):
+        return self.points.get(path, self.default)
+
+    def filters_nothing(self):
+        return self.default.type == 'none' and all(f.type == 'none' for f in self.points.values())
+
+
+class _Point(object):
+    """The state of one number of an asset
+
+    t0, v0: The last stored timestamp and value
+    t, v: The last received timestamp and value
+    upper, lower: The smallest upper and largest lower slope from
+        (t0, v0) seen since, for swinging door trending
+    """
+    __slots__ = ['t0', 'v0', 't', 'v', 'upper', 'lower']
+
+    def __init__(self, t, v):
+        self.store(t, v)
+
+    def copy(self):
+        point = _Point.__new__(_Point)
+        for name in self.__slots__:
+            setattr(point, name, getattr(self, name))
+        return point
+
+    def store(self, t, v):
+        self.t0 = self.t = t
+        self.v0 = self.v = v
+        self.upper = float('inf')
+        self.lower = float('-inf')
+
+    def hold(self, t, v, deviation):
+        elapsed = t - self.t0
+        self.upper = min(self.upper, (v + deviation - self.v0) / elapsed)
+        self.lower = max(self.lower, (v - deviation - self.v0) / elapsed)
+        self.t = t
+        self.v = v
+
+    def closes_door(self, t, v, deviation):
+        """Whether no line from (t0, v0) passes within ``deviation`` of
+        every held value and of v"""
+        elapsed = t - self.t0
+        return (max(self.lower, (v - deviation - self.v0) / elapsed) >
+                min(self.upper, (v + deviation - self.v0) / elapsed))
+
+
+class _Asset(object):
+    """The state of an asset"""
+    __slots__ = ['points', 'fingerprint', 'held']
+
+    def __init__(self):
+        self.points = {}
+        """path -> _Point"""
+        self.fingerprint = None
+        """Hash of the last stored reading's paths and other values"""
+        self.held = None
+        """The last reading, when it was not stored"""
+
+    def copy(self):
+        asset = _Asset()
+        asset.points = {path: point.copy() for path, point in self.points.items()}
+        asset.fingerprint = self.fingerprint
+        asset.held = self.held
+        return asset
+
+
+def _split(reading):
+    """Returns the numbers in a reading, a hash of everything else and
+    of the paths of the numbers, and whether every number was returned
+    """
+    numbers = {}
+    others = []
+    if isinstance(reading, dict):
+        _walk(reading, '', 1, numbers, others)
+    else:
+        others.append(('', repr(reading)))
+
+    fingerprint = hash((tuple(sorted(numbers)), tuple(sorted(others))))
+    return numbers, fingerprint, len(numbers) <= _MAX_VALUES
+
+
+def _walk(node, prefix, depth, numbers, others):
+    for key, value in node.items():
+        path = prefix + str(key)
+
+        if isinstance(value, dict) and depth < _MAX_DEPTH:
+            _walk(value, path + '.', depth + 1, numbers, others)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            try:
+                numbers[path] = float(value)
+            except OverflowError:
+                others.append((path, repr(value)))
+        else:
+            others.append((path, repr(value)))
+
+
+def reduction(stats):
+    """Returns the share of received readings that were not stored"""
+    received = stats.get('received', 0)
+    return 1.0 - stats.get('stored', 0) / received if received else 0.0
+
+
+class CompressionFilters(object):
+    """Drops readings whose values have not changed enough"""
+
+    def __init__(self):
+        self._default = None
+        self._assets_filters = {}
+        """asset code -> _AssetFilters"""
+        self._assets = collections.OrderedDict()
+        """asset code -> _Asset, least recently seen first"""
+
+        self._counters = {
+            'received': 0,
+            'stored': 0,
+            'held_stored': 0
+        }
+
+        self._undo = None
+        """asset code -> its _Asset (or None) before :meth:`applying` began"""
+
+    async def start(self):
+        """Reads the 'CMPRS' configuration and follows changes to it"""
+        try:
+            config = await configuration.get(_CONFIGURATION_KEY, _DEFAULT_CONFIGURATION)
+            self.configure(config)
+        except Exception:
+            _logger.exception('Unable to read the %s configuration. Readings are not compressed.',
+                              _CONFIGURATION_KEY)
+
+        configuration.cache.subscribe(_CONFIGURATION_KEY, self.configure, _DEFAULT_CONFIGURATION)
+
+    def configure(self, config):
+        """Applies 'CMPRS' settings and forgets the state of every asset
+
+        Raises:
+            ValueError: A filter is invalid. The current filters are kept.
+        """
+        default = _AssetFilters(config['default'] or {})
+        assets_filters = {asset_code: _AssetFilters(settings)
+                          for asset_code, settings in (config['assets'] or {}).items()}
+
+        self._default = None if default.filters_nothing() else default
+        self._assets_filters = {asset_code: filters for asset_code, filters in assets_filters.items()
+                                if not filters.filters_nothing()}
+        # An asset set to 'none' is not filtered even with a default filter
+        self._assets_filters.update({asset_code: None for asset_code, filters in assets_filters.items()
+                                     if filters.filters_nothing()})
+        self._assets.clear()
+
+    def apply(self, rows):
+        """Returns the readings to store
+
+        Args:
+            rows (list): Readings, as returned by
+                :func:`foglamp.device_api.coap.sensor_values.parse_reading`,
+                in the order they were received
+
+        Returns:
+            list: Some of ``rows``, possibly preceded by a reading of the
+            same asset that was held back from an earlier call
+        """
+        self._counters['received'] += len(rows)
+
+        if self._default is None and not any(self._assets_filters.values()):
+            self._counters['stored'] += len(rows)
+            return rows
+
+        stored = []
+        for row in rows:
+            stored.extend(self._apply(row))
+
+        self._counters['stored'] += len(stored)
+        return stored
+
+    @contextlib.contextmanager
+    def applying(self, rows):
+        """Like :meth:`apply`, but the state of the assets and the counters
+        are put back as they were if the block raises, for readings that
+        were not buffered after all
+
+        Example:
+            ::
+
+                with compression.filters.applying(rows) as stored:
+                    readings_storage.buffer.add_many(stored)
+        """
+        self._undo = {}
+        counters = dict(self._counters)
+
+        try:
+            yield self.apply(rows)
+        except BaseException:
+            for asset_code, asset in self._undo.items():
+                if asset is None:
+                    self._assets.pop(asset_code, None)
+                else:
+                    self._assets[asset_code] = asset
+            self._counters = counters
+            raise
+        finally:
+            self._undo = None
+
+    def _apply(self, row):
+        asset_code = row['asset_code']
+        filters = self._assets_filters.get(asset_code, self._default)
+
+        if filters is None:
+            return [row]
+
+        numbers, fingerprint, complete = _split(row['reading'])
+        t = row['user_ts'].timestamp()
+
+        asset = self._assets.get(asset_code)
+        if self._undo is not None and asset_code not in self._undo:
+            self._undo[asset_code] = asset.copy() if asset is not None else None
+
+        if asset is None:
+            if len(self._assets) >= _MAX_ASSETS:
+                forgotten_code, forgotten = self._assets.popitem(last=False)
+                if self._undo is not None:
+                    self._undo.setdefault(forgotten_code, forgotten)
+            asset = self._assets[asset_code] = _Asset()
+        else:
+            self._assets.move_to_end(asset_code)
+
+        stored = []
+
+        if complete and fingerprint == asset.fingerprint:
+            store, store_held = self._evaluate(asset, filters, numbers, t)
+
+            if store_held and asset.held is not None:
+                # The door closed: the held reading is the end of a segment
+                stored.append(asset.held)
+                self._counters['held_stored'] += 1
+                for point in asset.points.values():
+                    point.store(point.t, point.v)
+                asset.held = None
+                store, _ = self._evaluate(asset, filters, numbers, t)
+        else:
+            store = True
+
+            if asset.held is not None and any(
+                    filters.get(path).type == 'swinging_door' for path in asset.points):
+                # A new segment starts, so the open one ends at the held reading
+                stored.append(asset.held)
+                self._counters['held_stored'] += 1
+
+        if store:
+            stored.append(row)
+            asset.points = {path: _Point(t, v) for path, v in numbers.items()}
+            asset.fingerprint = fingerprint
+            asset.held = None
+        else:
+            for path, v in numbers.items():
+                asset.points[path].hold(t, v, filters.get(path).deviation)
+            asset.held = row
+
+        return stored
+
+    @staticmethod
+    def _evaluate(asset, filters, numbers, t):
+        """Returns whether the reading must be stored and whether the held
+        reading must be stored first"""
+        store = False
+        store_held = False
+
+        for path, v in numbers.items():
+            f = filters.get(path)
+            point = asset.points[path]
+
+            if f.type == 'none' or t <= point.t or t <= point.t0:
+                return True, False
+
+            if f.type == 'swinging_door' and point.closes_door(t, v, f.deviation):
+                store_held = True
+
+            if f.max_interval and t - point.t0 >= f.max_interval:
+                store = True
+            elif f.type == 'deadband' and f.outside_deadband(v, point.v0):
+                store = True
+
+        return store, store_held
+
+    def stats(self):
+        """Returns counters, the reduction ratio and the number of
+        assets tracked as a dict"""
+        result = dict(self._counters)
+        result['reduction'] = reduction(self._counters)
+        result['assets'] = len(self._assets)
+        return result
+
+
+filters = CompressionFilters()
+"""The filters shared by all ingest handlers"""
+
+metrics.registry.stats('foglamp_compression', lambda: filters.stats(),
+                       counters=('received', 'stored', 'held_stored'))
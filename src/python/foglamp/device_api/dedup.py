@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Recently seen read keys
+
+Devices retransmit a reading when its acknowledgement is lost, with the
+same read key. The ingest handlers check this index first and
+acknowledge a known duplicate without buffering it or sending it to the
+database.
+
+The index remembers keys for ``dedup_window`` seconds, up to
+``dedup_size`` keys, and is warmed at startup from the newest rows of
+foglamp.readings. A key that has been forgotten is still caught by
+``ON CONFLICT (read_key) DO NOTHING`` when the reading is inserted.
+
+The settings are read from the 'INGST' row of foglamp.configuration.
+"""
+
+import collections
+import datetime
+import logging
+import time
+
+from foglamp import metrics
+from foglamp.storage import configuration
+from foglamp.storage import readings as readings_storage
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+_logger = logging.getLogger(__name__)
+
+_CONFIGURATION_KEY = 'INGST'
+
+_DEFAULT_CONFIGURATION = {
+    'dedup_window': 600,
+    'dedup_size': 100000
+}
+"""Used for settings missing from the 'INGST' configuration row
+
+- dedup_window: Seconds a read key is remembered
+- dedup_size: Maximum number of read keys remembered
+"""
+
+
+class ReadKeyIndex(object):
+    """A time-windowed, size-bounded set of read keys
+
+    Keys are kept in insertion order so expired keys are always
+    at the front and eviction is O(1).
+    """
+
+    def __init__(self, window=None, size=None):
+        self.window = window or _DEFAULT_CONFIGURATION['dedup_window']
+        self.size = size or _DEFAULT_CONFIGURATION['dedup_size']
+
+        self._keys = collections.OrderedDict()
+        """read key -> time.monotonic() at which it was added"""
+
+        self._counters = {
+            'hits': 0,
+            'misses': 0
+        }
+
+    async def start(self):
+        """Reads the 'INGST' configuration, follows changes to it and
+        loads recent read keys from foglamp.readings
+        """
+        try:
+            config = await configuration.get(_CONFIGURATION_KEY, _DEFAULT_CONFIGURATION)
+            self.configure(config)
+            configuration.cache.subscribe(_CONFIGURATION_KEY, self.configure, _DEFAULT_CONFIGURATION)
+
+            rows = await readings_storage.recent_read_keys(self.size)
+        except Exception:
+            _logger.exception('Unable to load recent read keys')
+            return
+
+        now = time.monotonic()
+        utc_now = datetime.datetime.now(datetime.timezone.utc)
+
+        # Oldest first, so they are evicted first
+        for key, ts in reversed(rows):
+            age = (utc_now - ts).total_seconds()
+            if age < self.window:
+                self._keys[key] = now - age
+
+        _logger.info('Loaded %s recent read keys', len(self._keys))
+
+    def configure(self, config):
+        """Applies 'INGST' settings. A smaller size or window takes
+        effect as keys are added.
+        """
+        self.window = float(config['dedup_window'])
+        self.size = int(config['dedup_size'])
+
+    def contains(self, key):
+        """Returns True if ``key`` was added within the last ``window`` seconds"""
+        added = self._keys.get(_normalize(key))
+
+        if added is not None and time.monotonic() - added < self.window:
+            self._counters['hits'] += 1
+            return True
+
+        self._counters['misses'] += 1
+        return False
+
+    def add(self, key):
+        """Remembers ``key``, forgetting expired keys and, if the index
+        is full, the oldest keys
+        """
+        now = time.monotonic()
+        keys = self._keys
+
+        # Re-added keys move to the end so keys stay ordered by time
+        key = _normalize(key)
+        keys.pop(key, None)
+        keys[key] = now
+
+        while keys:
+            oldest_key, added = next(iter(keys.items()))
+            if len(keys) <= self.size and now - added < self.window:
+                break
+            del keys[oldest_key]
+
+    def stats(self):
+        """Returns hit and miss counters and the number of keys as a dict"""
+        result = dict(self._counters)
+        result['size'] = len(self._keys)
+        return result
+
+
+def _normalize(key):
+    # Postgres accepts UUIDs in upper or lower case
+    return key.lower() if isinstance(key, str) else str(key)
+
+
+read_keys = ReadKeyIndex()
+"""The index shared by all ingest handlers"""
+
+metrics.registry.stats('foglamp_dedup', lambda: read_keys.stats(), counters=('hits', 'misses'))
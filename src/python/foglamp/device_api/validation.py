@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Payload validation for the ingest handlers
+
+The JSON schemas in src/json-schema are compiled once, when this module
+is imported, into nested closures that check a decoded payload without
+interpreting the schema again. Only the draft-04 keywords the schemas
+use are supported; :func:`compile_schema` raises ValueError for any
+other keyword so that a schema change cannot be silently ignored.
+
+:func:`parse_timestamp` turns the ISO 8601 timestamps sent by devices
+into UTC datetimes so that a malformed timestamp is rejected by the
+handler instead of by Postgres when the batch is inserted.
+"""
+
+import datetime
+import json
+import os
+import re
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+_SCHEMA_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 os.pardir, os.pardir, os.pardir, 'json-schema')
+
+_TYPES = {
+    'array': (list,),
+    'boolean': (bool,),
+    'integer': (int,),
+    'null': (type(None),),
+    'number': (int, float),
+    'object': (dict,),
+    'string': (str,)
+}
+"""JSON schema type -> Python types of decoded values"""
+
+_ANNOTATIONS = frozenset(['$schema', 'id', 'definitions', 'title', 'description'])
+"""Keywords that do not affect validation"""
+
+_PREFIX_LENGTH = len('2017-01-02T01:02')
+
+_PREFIX_RE = re.compile(r'(\d{4})-(\d{2})-(\d{2})[Tt ](\d{2}):(\d{2})')
+
+_SUFFIX_RE = re.compile(
+    r'(?::(\d{2})(?:[.,](\d{1,9}))?)?[Zz]?(?:([+-])(\d{2}):?(\d{2})?)?')
+"""Seconds, fraction and UTC offset. 'Z' followed by an offset, as in
+'2017-01-02T01:02:03.23232Z-05:00', is accepted and the offset is used.
+"""
+
+_MAX_CACHED_PREFIXES = 1024
+
+_prefixes = {}
+"""'YYYY-MM-DDTHH:MM' -> UTC datetime. Devices send many readings
+within the same minute so the calendar arithmetic is done once per minute.
+"""
+
+
+def compile_schema(schema, path='payload'):
+    """Returns a function that raises ValueError if its argument does not
+    conform to ``schema``
+
+    Args:
+        schema (dict): A draft-04 JSON schema
+        path (str): How the value is named in error messages
+
+    Raises:
+        ValueError: The schema uses an unsupported keyword
+    """
+    unsupported = set(schema) - _ANNOTATIONS - {
+        'type', 'properties', 'required', 'additionalProperties', 'items', 'enum',
+        'pattern', 'maxLength'}
+    if unsupported:
+        raise ValueError('Unsupported JSON schema keywords: {}'.format(', '.join(sorted(unsupported))))
+
+    checks = []
+
+    if 'type' in schema:
+        checks.append(_compile_type(schema['type'], path))
+
+    if 'enum' in schema:
+        checks.append(_compile_enum(schema['enum'], path))
+
+    if 'pattern' in schema:
+        checks.append(_compile_pattern(schema['pattern'], path))
+
+    if 'maxLength' in schema:
+        checks.append(_compile_max_length(schema['maxLength'], path))
+
+    if 'items' in schema:
+        checks.append(_compile_items(schema['items'], path))
+
+    if {'properties', 'required', 'additionalProperties'} & set(schema):
+        checks.append(_compile_object(schema, path))
+
+    if len(checks) == 1:
+        return checks[0]
+
+    def validate(value):
+        for check in checks:
+            check(value)
+
+    return validate
+
+
+def _compile_type(names, path):
+    if isinstance(names, str):
+        names = [names]
+
+    types = tuple(t for name in names for t in _TYPES[name])
+    # bool is a subclass of int but is not a JSON number
+    allow_bool = 'boolean' in names
+    message = '{} must be {}'.format(path, ' or '.join(names))
+
+    def check_type(value):
+        if not isinstance(value, types) or (isinstance(value, bool) and not allow_bool):
+            raise ValueError(message)
+
+    return check_type
+
+
+def _compile_enum(values, path):
+    message = '{} must be one of {}'.format(path, ', '.join(json.dumps(v) for v in values))
+
+    def check_enum(value):
+        if value not in values:
+            raise ValueError(message)
+
+    return check_enum
+
+
+def _compile_pattern(pattern, path):
+    message = '{} must match {}'.format(path, pattern)
+
+    # As in JSON schema's ECMA 262 patterns, '$' does not match before
+    # a trailing newline
+    if pattern.endswith('$') and not pattern.endswith('\\$'):
+        pattern = pattern[:-1] + r'\Z'
+    regex = re.compile(pattern)
+
+    def check_pattern(value):
+        if isinstance(value, str) and regex.search(value) is None:
+            raise ValueError(message)
+
+    return check_pattern
+
+
+def _compile_max_length(max_length, path):
+    message = '{} must be at most {} characters'.format(path, max_length)
+
+    def check_max_length(value):
+        if isinstance(value, str) and len(value) > max_length:
+            raise ValueError(message)
+
+    return check_max_length
+
+
+def _compile_items(schema, path):
+    validate_item = compile_schema(schema, path + '[]')
+
+    def check_items(value):
+        if isinstance(value, list):
+            for item in value:
+                validate_item(item)
+
+    return check_items
+
+
+def _compile_object(schema, path):
+    properties = {name: compile_schema(subschema, name)
+                  for name, subschema in schema.get('properties', {}).items()}
+    required = tuple(schema.get('required', ()))
+    additional = schema.get('additionalProperties', True)
+
+    if isinstance(additional, dict):
+        validate_additional = compile_schema(additional, path)
+    else:
+        validate_additional = None
+
+    def check_object(value):
+        if not isinstance(value, dict):
+            return
+
+        for name in required:
+            if name not in value:
+                raise ValueError('{} is required'.format(name))
+
+        for name, item in value.items():
+            validate_property = properties.get(name)
+            if validate_property is not None:
+                validate_property(item)
+            elif validate_additional is not None:
+                validate_additional(item)
+            elif additional is False:
+                raise ValueError('{} is not allowed'.format(name))
+
+    return check_object
+
+
+def load_schema(name):
+    """Returns the compiled schema src/json-schema/<name>.json"""
+    with open(os.path.join(_SCHEMA_DIRECTORY, name + '.json')) as schema_file:
+        return compile_schema(json.load(schema_file))
+
+
+def parse_timestamp(value):
+    """Converts an ISO 8601 timestamp to a UTC datetime
+
+    A timestamp without a UTC offset is taken to be UTC.
+
+    Args:
+        value (str): For example '2017-01-02T01:02:03.23232-05:00'
+
+    Raises:
+        ValueError: ``value`` is not a valid timestamp
+    """
+    if not isinstance(value, str):
+        raise ValueError('timestamp must be a string')
+
+    prefix = value[:_PREFIX_LENGTH]
+    minute = _prefixes.get(prefix)
+
+    if minute is None:
+        match = _PREFIX_RE.fullmatch(prefix)
+        if match is None:
+            raise ValueError('timestamp is not an ISO 8601 timestamp')
+
+        try:
+            minute = datetime.datetime(*map(int, match.groups()), tzinfo=datetime.timezone.utc)
+        except ValueError:
+            raise ValueError('timestamp is not a valid date and time')
+
+        if len(_prefixes) >= _MAX_CACHED_PREFIXES:
+            _prefixes.clear()
+        _prefixes[prefix] = minute
+
+    match = _SUFFIX_RE.fullmatch(value, _PREFIX_LENGTH)
+    if match is None:
+        raise ValueError('timestamp is not an ISO 8601 timestamp')
+
+    seconds, fraction, sign, offset_hours, offset_minutes = match.groups()
+
+    # 60 is a leap second
+    if (seconds is not None and int(seconds) > 60) or \
+            (sign is not None and (int(offset_hours) > 23 or int(offset_minutes or 0) > 59)):
+        raise ValueError('timestamp is not a valid date and time')
+
+    result = minute
+    if seconds is not None:
+        result += datetime.timedelta(
+            seconds=int(seconds),
+            microseconds=int(fraction[:6].ljust(6, '0')) if fraction else 0)
+
+    if sign is not None:
+        offset = datetime.timedelta(hours=int(offset_hours), minutes=int(offset_minutes or 0))
+        result = result - offset if sign == '+' else result + offset
+
+    return result
+
+
+sensor_values = load_schema('sensor-values')
+"""Validates a coap://other/sensor-values payload"""
@@ -1,6 +1,6 @@
 import os
+import pkgutil
 import yaml
-import pkg_resources
 import logging
 
 # TODO: write tests
@@ -15,6 +15,9 @@ db_connection_string = None
 # should be this?
 # http://docs.sqlalchemy.org/en/latest/dialects/postgresql.html#module-sqlalchemy.dialects.postgresql.psycopg2
 
+_Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+""" libyaml's loader when PyYAML was built with it: several times faster than the pure Python one """
+
 
 # this could have been a BaseConfig class
 def load_config():
@@ -25,12 +28,13 @@ def load_config():
     global config
     path = os.environ.get('FOGLAMP_ENV_PATH')
     if path is None:
-        resource_str = pkg_resources.resource_string('foglamp', 'foglamp-env.yaml')
-        config = yaml.load(resource_str)
+        # pkgutil rather than pkg_resources, which takes long to import
+        resource_str = pkgutil.get_data('foglamp', 'foglamp-env.yaml')
+        config = yaml.load(resource_str, Loader=_Loader)
 
     else:
         with open(path, 'r') as config_file:
-            config = yaml.load(config_file)
+            config = yaml.load(config_file, Loader=_Loader)
 
     global db_connection_string
     db_connection_string = get_db_connection_string()
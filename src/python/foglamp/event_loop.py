@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Event loop selection and monitoring
+
+The event loop implementation is chosen by the optional 'loop' section
+of foglamp-env.yaml::
+
+    loop:
+      policy: uvloop
+      lag_interval: 0.25
+      slow_callback_threshold: 0.1
+
+policy is 'asyncio' (the default) or 'uvloop'. uvloop is not a
+requirement of FogLAMP; when it is not installed the asyncio loop is
+used and a warning is logged.
+
+:data:`monitor` measures how late the loop runs a callback scheduled
+every ``lag_interval`` seconds. A thread watches for the loop falling
+more than ``slow_callback_threshold`` seconds behind and logs the stack
+of whatever is blocking it.
+"""
+
+import asyncio
+import collections
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from foglamp import env
+from foglamp import metrics
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    'policy': 'asyncio',
+    'lag_interval': 0.25,
+    'slow_callback_threshold': 0.1
+}
+"""Used for settings missing from the 'loop' section of foglamp-env.yaml
+
+- policy: 'asyncio' or 'uvloop'
+- lag_interval: Seconds between loop lag samples (0 disables the monitor)
+- slow_callback_threshold: Seconds the loop may be blocked before the
+  blocking stack is logged
+"""
+
+POLICIES = ('asyncio', 'uvloop')
+
+_SAMPLES = 1024
+"""Number of recent lag samples percentiles are computed from"""
+
+
+def settings():
+    """Returns the 'loop' section of foglamp-env.yaml merged over
+    :data:`DEFAULT_SETTINGS`
+    """
+    return dict(DEFAULT_SETTINGS, **((env.config or {}).get('loop') or {}))
+
+
+def install_policy(policy=None):
+    """Sets the event loop policy. Must be called before the event loop
+    is created.
+
+    Args:
+        policy (str): 'asyncio' or 'uvloop'. Defaults to the 'loop'
+            section of foglamp-env.yaml.
+
+    Returns:
+        str: The policy installed
+    """
+    if policy is None:
+        policy = settings()['policy']
+
+    if policy not in POLICIES:
+        raise ValueError('loop policy must be one of {}'.format(', '.join(POLICIES)))
+
+    if policy == 'uvloop':
+        try:
+            import uvloop
+        except ImportError:
+            _logger.warning('uvloop is not installed. Using the asyncio event loop.')
+            policy = 'asyncio'
+        else:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+    if policy == 'asyncio':
+        asyncio.set_event_loop_policy(None)
+
+    return policy
+
+
+class LagMonitor(object):
+    """Samples event loop lag and logs the stack of callbacks that
+    block the loop
+    """
+
+    def __init__(self):
+        self.interval = DEFAULT_SETTINGS['lag_interval']
+        self.threshold = DEFAULT_SETTINGS['slow_callback_threshold']
+
+        self._samples = collections.deque(maxlen=_SAMPLES)
+        self._counters = {
+            'samples': 0,
+            'slow_callbacks': 0
+        }
+
+        self._loop = None
+        self._handle = None
+        self._expected = None
+        self._heartbeat = None
+        self._loop_thread_id = None
+        self._watchdog = None
+        self._stopped = threading.Event()
+
+    def start(self, interval=None, threshold=None):
+        """Starts sampling the current event loop
+
+        Args:
+            interval (float): Defaults to lag_interval in foglamp-env.yaml
+            threshold (float): Defaults to slow_callback_threshold in
+                foglamp-env.yaml
+        """
+        if self._handle is not None:
+            return
+
+        loop_settings = settings()
+        self.interval = float(interval or loop_settings['lag_interval'])
+        self.threshold = float(threshold or loop_settings['slow_callback_threshold'])
+
+        if self.interval <= 0:
+            return
+
+        self._loop = asyncio.get_event_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._expected = self._heartbeat + self.interval
+        self._handle = self._loop.call_later(self.interval, self._sample)
+
+        self._stopped.clear()
+        self._watchdog = threading.Thread(target=self._watch, name='foglamp-loop-watchdog',
+                                          daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        if self._handle is None:
+            return
+
+        self._handle.cancel()
+        self._handle = None
+        self._stopped.set()
+        self._watchdog.join()
+        self._watchdog = None
+
+    def stats(self):
+        """Returns lag percentiles (seconds) over the recent samples and
+        counters as a dict
+        """
+        result = dict(self._counters)
+        samples = sorted(self._samples)
+
+        for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99)):
+            result[name] = samples[int(fraction * (len(samples) - 1))] if samples else 0.0
+        result['max'] = samples[-1] if samples else 0.0
+
+        return result
+
+    def _sample(self):
+        now = time.monotonic()
+        self._samples.append(max(0.0, now - self._expected))
+        self._counters['samples'] += 1
+
+        self._heartbeat = now
+        self._expected = now + self.interval
+        self._handle = self._loop.call_later(self.interval, self._sample)
+
+    def _watch(self):
+        """Runs in a thread. Logs the loop thread's stack once per stall."""
+        reported = None
+
+        while not self._stopped.wait(self.threshold / 2):
+            heartbeat = self._heartbeat
+            blocked = time.monotonic() - heartbeat - self.interval
+
+            if blocked < self.threshold or reported == heartbeat:
+                continue
+
+            reported = heartbeat
+            self._counters['slow_callbacks'] += 1
+
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is not None:
+                _logger.warning('The event loop has been blocked for %.3f seconds by:\n%s',
+                                blocked, ''.join(traceback.format_stack(frame)))
+
+
+monitor = LagMonitor()
+"""Monitors the event loop of this process"""
+
+metrics.registry.stats('foglamp_loop_lag', lambda: monitor.stats(),
+                       counters=('samples', 'slow_callbacks'))
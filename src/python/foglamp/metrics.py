@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Metrics for the ingest, storage and authentication hot paths
+
+Metrics are registered with :data:`registry` when their module is
+imported. Updating one is an attribute increment (counters and gauges)
+or a bisect and an increment (histograms), so they can be used on
+every request.
+
+Components that already keep counters in a ``stats()`` dict are
+exported with :meth:`Registry.stats` instead of being counted twice;
+their ``stats()`` function is only called when metrics are collected.
+
+:meth:`Registry.snapshot` returns plain lists and dicts that can be sent
+between processes, merged with :func:`merge` and rendered with
+:func:`to_prometheus` or :func:`to_json`.
+"""
+
+import bisect
+import collections
+import math
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+"""Upper bounds (seconds) of histogram buckets"""
+
+
+class _CounterValue(object):
+    __slots__ = ['value']
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, name, labels):
+        yield name + '_total', labels, self.value
+
+
+class _GaugeValue(object):
+    __slots__ = ['value']
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+
+class _HistogramValue(object):
+    __slots__ = ['bounds', 'counts', 'sum']
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        """Observations per bucket. The last bucket is +Inf."""
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.bounds + (math.inf,), self.counts):
+            cumulative += count
+            yield name + '_bucket', dict(labels, le=_format_value(bound)), cumulative
+        yield name + '_count', labels, cumulative
+        yield name + '_sum', labels, self.sum
+
+
+class _Metric(object):
+    """A metric family. Without label names it is also its own value."""
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = collections.OrderedDict()
+
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def labels(self, *labelvalues):
+        """Returns the value for ``labelvalues``, creating it if needed"""
+        value = self._values.get(labelvalues)
+
+        if value is None:
+            if len(labelvalues) != len(self.labelnames):
+                raise ValueError('{} has labels {}'.format(self.name, ', '.join(self.labelnames)))
+            value = self._values[labelvalues] = self._new_value()
+
+        return value
+
+    def samples(self):
+        for labelvalues, value in list(self._values.items()):
+            for sample in value.samples(self.name, dict(zip(self.labelnames, labelvalues))):
+                yield sample
+
+    def _new_value(self):
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """A value that only increases"""
+    type = 'counter'
+
+    def _new_value(self):
+        return _CounterValue()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+
+class Gauge(_Metric):
+    """A value that goes up and down"""
+    type = 'gauge'
+
+    def _new_value(self):
+        return _GaugeValue()
+
+    def set(self, value):
+        self._default.set(value)
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def dec(self, amount=1):
+        self._default.dec(amount)
+
+
+class Histogram(_Metric):
+    """Counts observations, such as latencies, in fixed buckets"""
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super(Histogram, self).__init__(name, help, labelnames)
+
+    def _new_value(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+
+class _Stats(object):
+    """Exports the numeric entries of a stats() dict"""
+
+    def __init__(self, prefix, function, counters):
+        self.prefix = prefix
+        self.function = function
+        self.counters = frozenset(counters)
+
+    def families(self):
+        for key, value in sorted(self.function().items()):
+            if isinstance(value, bool):
+                value = int(value)
+            elif not isinstance(value, (int, float)):
+                continue
+
+            name = '{}_{}'.format(self.prefix, key)
+
+            if key in self.counters:
+                yield _family(name, 'counter', '', [[name + '_total', {}, value]])
+            else:
+                yield _family(name, 'gauge', '', [[name, {}, value]])
+
+
+class Registry(object):
+    """A set of metrics"""
+
+    def __init__(self):
+        self._metrics = collections.OrderedDict()
+        self._stats = collections.OrderedDict()
+
+    def counter(self, name, help, labelnames=()):
+        """Registers and returns a :class:`Counter`"""
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        """Registers and returns a :class:`Gauge`"""
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """Registers and returns a :class:`Histogram`"""
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def stats(self, prefix, function, counters=()):
+        """Exports the numeric entries of the dict returned by ``function``
+
+        Args:
+            prefix (str): Prepended to each key to name its metric
+            function: Returns a dict, such as a component's stats()
+            counters: Keys that are counters. The other keys are gauges.
+        """
+        self._stats[prefix] = _Stats(prefix, function, counters)
+
+    def snapshot(self):
+        """Returns the current value of every metric as a list of dicts"""
+        families = [_family(metric.name, metric.type, metric.help,
+                            [list(sample) for sample in metric.samples()])
+                    for metric in self._metrics.values()]
+
+        for stats in self._stats.values():
+            families.extend(stats.families())
+
+        return families
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError('A metric named {} is already registered'.format(metric.name))
+        self._metrics[metric.name] = metric
+        return metric
+
+
+def _family(name, type, help, samples):
+    return {'name': name, 'type': type, 'help': help, 'samples': samples}
+
+
+def add_label(families, name, value):
+    """Returns a copy of ``families`` with a label added to every sample"""
+    return [dict(family, samples=[[sample_name, dict(labels, **{name: value}), sample_value]
+                                  for sample_name, labels, sample_value in family['samples']])
+            for family in families]
+
+
+def merge(*family_lists):
+    """Combines the samples of families with the same name"""
+    merged = collections.OrderedDict()
+
+    for families in family_lists:
+        for family in families:
+            existing = merged.get(family['name'])
+            if existing is None:
+                merged[family['name']] = dict(family, samples=list(family['samples']))
+            else:
+                existing['samples'].extend(family['samples'])
+
+    return list(merged.values())
+
+
+def to_json(families):
+    """Returns ``families`` as a JSON serializable dict"""
+    return {family['name']: {'type': family['type'],
+                             'help': family['help'],
+                             'samples': [{'name': name, 'labels': labels, 'value': value}
+                                         for name, labels, value in family['samples']]}
+            for family in families}
+
+
+def to_prometheus(families):
+    """Returns ``families`` in the Prometheus text exposition format"""
+    lines = []
+
+    for family in families:
+        if family['help']:
+            lines.append('# HELP {} {}'.format(
+                family['name'], family['help'].replace('\\', r'\\').replace('\n', r'\n')))
+        lines.append('# TYPE {} {}'.format(family['name'], family['type']))
+
+        for name, labels, value in family['samples']:
+            if labels:
+                name += '{' + ','.join('{}="{}"'.format(key, _escape_label(labels[key]))
+                                       for key in sorted(labels)) + '}'
+            lines.append('{} {}'.format(name, _format_value(value)))
+
+    lines.append('')
+    return '\n'.join(lines)
+
+
+def _escape_label(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+registry = Registry()
+"""The metrics of this process"""
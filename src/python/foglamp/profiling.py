@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""On-demand CPU and memory profiling of a running FogLAMP
+
+:data:`cpu` is a sampling profiler: while it runs, a thread records the
+stack of the main thread, which runs the event loop, every ``interval``
+seconds. Other threads, such as the password hashing pool, mostly wait
+and would rank their waits as hot spots, so they are only sampled when
+asked for. The report is in the collapsed stack format read by
+flamegraph.pl and speedscope::
+
+    MainThread;foglamp_start.py:main;...;sensor_values.py:render_post 42
+
+:data:`memory` takes tracemalloc snapshots and reports the lines that
+allocated the most memory, or the growth since the previous snapshot.
+
+Neither does anything until it is started: no thread runs, no trace
+function is installed and tracemalloc is off.
+"""
+
+import collections
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+DEFAULT_INTERVAL = 0.005
+"""Seconds between CPU samples"""
+
+MIN_INTERVAL = 0.001
+"""Shorter intervals would have the sampling thread compete with the
+event loop for the GIL"""
+
+MAX_SECONDS = 600
+"""A CPU profile stops by itself after this many seconds"""
+
+THREADS = ('main', 'all')
+"""Valid values of the CPU profiler's ``threads`` option"""
+
+_PATH_PREFIXES = sorted((os.path.join(os.path.abspath(path), '') for path in sys.path if path),
+                        key=len, reverse=True)
+
+
+class ProfilerError(Exception):
+    """Raised when a profiler is started twice or used while stopped"""
+    pass
+
+
+def _frame_name(code):
+    filename = code.co_filename
+    for prefix in _PATH_PREFIXES:
+        if filename.startswith(prefix):
+            filename = filename[len(prefix):]
+            break
+    return '{}:{}'.format(filename, code.co_name)
+
+
+class CpuProfiler(object):
+    """Samples the stacks of the main thread, or of all threads, from a
+    background thread"""
+
+    def __init__(self):
+        self._thread = None
+        self._stopped = threading.Event()
+        self._stacks = collections.Counter()
+        self._samples = 0
+        self._started_at = None
+        self._stopped_at = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds=MAX_SECONDS, interval=DEFAULT_INTERVAL, threads='main'):
+        """Starts sampling and discards the previous profile
+
+        Args:
+            seconds (float): Sampling stops after this many seconds
+                (at most :data:`MAX_SECONDS`)
+            interval (float): Seconds between samples, at least
+                :data:`MIN_INTERVAL`
+            threads (str): 'main' samples the main thread, 'all' every
+                thread, busy or not
+
+        Raises:
+            ProfilerError: The profiler is already running
+            ValueError: ``interval`` is too short or ``threads`` is not
+                one of :data:`THREADS`
+        """
+        seconds = float(seconds)
+        interval = float(interval)
+        if not interval >= MIN_INTERVAL:
+            raise ValueError('interval must be at least {} seconds'.format(MIN_INTERVAL))
+        if threads not in THREADS:
+            raise ValueError('threads must be one of {}'.format(', '.join(THREADS)))
+
+        if self.running:
+            raise ProfilerError('The CPU profiler is already running')
+
+        self._stacks = collections.Counter()
+        self._samples = 0
+        self._started_at = time.monotonic()
+        self._stopped_at = None
+        self._stopped.clear()
+
+        self._thread = threading.Thread(
+            target=self._run, args=(min(seconds, MAX_SECONDS), interval, threads == 'all'),
+            name='foglamp-cpu-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops sampling. The profile is kept for :meth:`report`."""
+        if self._thread is None:
+            raise ProfilerError('The CPU profiler has not been started')
+
+        self._stopped.set()
+        self._thread.join()
+
+    def stats(self):
+        """Returns whether the profiler is running, the number of samples
+        and the number of seconds sampled as a dict
+        """
+        if self._started_at is None:
+            seconds = 0
+        else:
+            seconds = (self._stopped_at or time.monotonic()) - self._started_at
+
+        return {'running': self.running, 'samples': self._samples, 'seconds': seconds}
+
+    def report(self):
+        """Returns the profile in the collapsed stack format, most
+        frequent stacks first
+        """
+        return ''.join('{} {}\n'.format(stack, count)
+                       for stack, count in self._stacks.most_common())
+
+    def _run(self, seconds, interval, all_threads):
+        deadline = self._started_at + seconds
+        own_id = threading.get_ident()
+        main_id = threading.main_thread().ident
+
+        while not self._stopped.wait(interval) and time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or not (all_threads or thread_id == main_id):
+                    continue
+
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+
+                self._stacks[';'.join(reversed(stack))] += 1
+
+            self._samples += 1
+
+        self._stopped_at = time.monotonic()
+
+
+class MemoryProfiler(object):
+    """Takes and compares tracemalloc snapshots"""
+
+    def __init__(self):
+        self._snapshot = None
+
+    @property
+    def running(self):
+        return tracemalloc.is_tracing()
+
+    def start(self, frames=1):
+        """Starts tracing allocations
+
+        Args:
+            frames (int): Number of frames recorded per allocation.
+                More frames give more context and cost more.
+
+        Raises:
+            ProfilerError: Allocations are already traced
+        """
+        if self.running:
+            raise ProfilerError('The memory profiler is already running')
+
+        self._snapshot = None
+        tracemalloc.start(int(frames))
+
+    def stop(self):
+        """Stops tracing allocations and frees the trace"""
+        if not self.running:
+            raise ProfilerError('The memory profiler has not been started')
+
+        self._snapshot = None
+        tracemalloc.stop()
+
+    def snapshot(self, limit=20):
+        """Takes a snapshot and returns the top allocators
+
+        When there is a previous snapshot, the lines whose allocations
+        grew the most since it are returned instead.
+
+        Args:
+            limit (int): Number of lines returned
+
+        Returns:
+            dict: 'current' and 'peak' traced bytes, 'compared' (whether
+            the top allocators are compared with a previous snapshot)
+            and 'top'
+        """
+        if not self.running:
+            raise ProfilerError('The memory profiler has not been started')
+
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<unknown>')))
+
+        if self._snapshot is None:
+            statistics = snapshot.statistics('traceback')
+        else:
+            statistics = snapshot.compare_to(self._snapshot, 'traceback')
+
+        top = []
+        for statistic in statistics[:int(limit)]:
+            entry = {'size': statistic.size,
+                     'count': statistic.count,
+                     'traceback': statistic.traceback.format()}
+            if self._snapshot is not None:
+                entry['size_diff'] = statistic.size_diff
+                entry['count_diff'] = statistic.count_diff
+            top.append(entry)
+
+        current, peak = tracemalloc.get_traced_memory()
+        result = {'current': current, 'peak': peak,
+                  'compared': self._snapshot is not None, 'top': top}
+
+        self._snapshot = snapshot
+        return result
+
+
+cpu = CpuProfiler()
+"""The CPU profiler of this process"""
+
+memory = MemoryProfiler()
+"""The memory profiler of this process"""
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Timings of FogLAMP's startup
+
+:func:`foglamp.controller.start` runs each step of startup in a
+:meth:`StartupProfile.phase`. With ``--startup-profile``, foglamp_start
+and foglamp_daemon also install an import hook before anything else is
+imported and log a report once startup is done::
+
+    Started in 0.412 s
+      0.021 s  configuration
+      0.140 s  database
+      ...
+    Slowest imports (self, cumulative):
+      0.052 s  0.090 s  sqlalchemy.sql.expression
+      ...
+
+An import's self time leaves out the modules it imported in turn.
+"""
+
+import builtins
+import collections
+import contextlib
+import logging
+import sys
+import threading
+import time
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+_logger = logging.getLogger(__name__)
+
+REPORTED_IMPORTS = 25
+"""Number of imports in the report"""
+
+
+def _absolute_name(name, globals, level):
+    if level == 0:
+        return name
+
+    package = (globals or {}).get('__package__') or (globals or {}).get('__name__', '')
+    base = package.rsplit('.', level - 1)[0] if level > 1 else package
+    return '{}.{}'.format(base, name) if name else base
+
+
+class StartupProfile(object):
+    """Durations of startup phases and, once installed, of imports"""
+
+    def __init__(self):
+        self.enabled = False
+        self._started = time.perf_counter()
+        self._phases = []
+        """(name, seconds)"""
+        self._imports = collections.OrderedDict()
+        """module name -> (self seconds, cumulative seconds)"""
+        self._stack = []
+        self._import = None
+        self._thread = None
+
+    def install(self):
+        """Starts timing imports made by the calling thread"""
+        if self._import is not None:
+            return
+
+        self.enabled = True
+        self._started = time.perf_counter()
+        self._thread = threading.get_ident()
+        self._import = builtins.__import__
+        builtins.__import__ = self._timed_import
+
+    def uninstall(self):
+        if self._import is None:
+            return
+
+        builtins.__import__ = self._import
+        self._import = None
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        original = self._import
+
+        if threading.get_ident() != self._thread:
+            return original(name, globals, locals, fromlist, level)
+
+        module_name = _absolute_name(name, globals, level)
+        if module_name in sys.modules:
+            return original(name, globals, locals, fromlist, level)
+
+        self._stack.append(0.0)
+        started = time.perf_counter()
+
+        try:
+            return original(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - started
+            children = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+            if module_name not in self._imports:
+                self._imports[module_name] = (elapsed - children, elapsed)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Records how long the body of a ``with`` statement takes"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._phases.append((name, time.perf_counter() - started))
+
+    def phases(self):
+        return list(self._phases)
+
+    def imports(self):
+        """Returns (module name, self seconds, cumulative seconds), slowest first"""
+        return sorted(((name,) + timings for name, timings in self._imports.items()),
+                      key=lambda entry: entry[1], reverse=True)
+
+    def report(self):
+        lines = ['Started in {:.3f} s'.format(time.perf_counter() - self._started)]
+        lines.extend('  {:.3f} s  {}'.format(seconds, name) for name, seconds in self._phases)
+
+        if self._imports:
+            lines.append('Slowest imports (self, cumulative):')
+            lines.extend('  {:.3f} s  {:.3f} s  {}'.format(self_seconds, seconds, name)
+                         for name, self_seconds, seconds in self.imports()[:REPORTED_IMPORTS])
+
+        return '\n'.join(lines)
+
+    def finish(self):
+        """Logs the report when enabled and stops timing imports"""
+        self.uninstall()
+        if self.enabled:
+            _logger.info('%s', self.report())
+
+
+profile = StartupProfile()
+"""The timings of this process's startup"""
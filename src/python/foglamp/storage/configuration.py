@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Reads runtime settings from the foglamp.configuration table
+
+Each row holds a 5 character key (for example 'PURGE') and a JSON
+object. See foglamp_init_data.sql for the keys and their defaults.
+
+Once :data:`cache` is started every row is held in memory, so
+:func:`get` and :meth:`ConfigurationCache.get` do not query the
+database. A trigger on foglamp.configuration (see foglamp_ddl.sql)
+sends a notification on the 'foglamp_configuration' channel for every
+change, and the cache reloads the row that changed. Without a
+notification for ``poll_interval`` seconds, or while the listening
+connection is down, the cache compares the table's latest ts and row
+count with its own and reloads every row when they differ. The trigger
+also sets ts on update and keeps the previous value in
+foglamp.configuration_changes.
+
+Components that can retune while running subscribe to their key::
+
+    configuration.cache.subscribe('INGST', buffer.configure, _DEFAULT_CONFIGURATION)
+"""
+
+import asyncio
+import logging
+
+import aiopg
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import JSONB
+
+from foglamp import metrics
+from foglamp.storage import pool
+import foglamp.env as env
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+_logger = logging.getLogger(__name__)
+
+CHANNEL = 'foglamp_configuration'
+"""The channel that foglamp_ddl.sql's trigger notifies. The payload is
+the key that changed."""
+
+_POLL_SECONDS = 30
+"""Seconds between checks for changes that were not notified"""
+
+_RETRY_SECONDS = 5
+"""How long to wait before listening again after the connection was lost"""
+
+_configuration_tbl = sa.Table(
+    'configuration',
+    sa.MetaData(),
+    sa.Column('key', sa.types.CHAR(5)),
+    sa.Column('value', JSONB),
+    sa.Column('ts', sa.types.TIMESTAMP(timezone=True)),
+    schema='foglamp')
+"""Defines the table that configuration is read from"""
+
+_VERSION_STATEMENT = sa.select([sa.func.max(_configuration_tbl.c.ts), sa.func.count()])
+"""Changes when a row is added, updated or deleted"""
+
+
+async def _select(key=None):
+    """Returns {key: (value, ts)} for one key or for every key"""
+    tbl = _configuration_tbl
+    query = sa.select([tbl.c.key, tbl.c.value, tbl.c.ts])
+    if key is not None:
+        query = query.where(tbl.c.key == key)
+
+    async with pool.acquire() as conn:
+        result = await conn.execute(query)
+        rows = await result.fetchall()
+
+    return {row['key'].strip(): (row['value'], row['ts']) for row in rows}
+
+
+async def _version():
+    async with pool.acquire() as conn:
+        result = await conn.execute(_VERSION_STATEMENT)
+        return tuple(await result.first())
+
+
+def _merge(value, defaults):
+    merged = dict(defaults or {})
+    if value:
+        merged.update(value)
+    return merged
+
+
+class ConfigurationCache(object):
+    """Every row of foglamp.configuration, held in memory"""
+
+    def __init__(self):
+        self._rows = {}
+        """key -> (value, ts)"""
+        self._version = None
+        """(latest ts, row count) when the rows were loaded"""
+        self._subscribers = {}
+        """key -> [(callback, defaults)]"""
+        self._task = None
+        self._loaded = False
+        self._counters = {'hits': 0, 'misses': 0, 'notifications': 0, 'reloads': 0}
+
+    @property
+    def loaded(self):
+        """Whether :meth:`start` has loaded the rows"""
+        return self._loaded
+
+    async def start(self, poll_interval=_POLL_SECONDS):
+        """Loads every row and starts following changes. Requires
+        :func:`foglamp.storage.pool.create`.
+        """
+        if self._task is not None:
+            return
+
+        await self.load()
+        self._task = asyncio.ensure_future(self._follow(poll_interval))
+
+    async def stop(self):
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def load(self):
+        """Replaces the cached rows with every row in the database"""
+        version = await _version()
+        rows = await _select()
+
+        changed = set(rows) ^ set(self._rows)
+        changed.update(key for key, row in rows.items() if key in self._rows and self._rows[key] != row)
+
+        self._rows = rows
+        self._version = version
+        self._loaded = True
+        self._counters['reloads'] += 1
+
+        for key in changed:
+            self._changed(key)
+
+    async def reload(self, key):
+        """Reads one row into the cache, or drops it when it no longer exists"""
+        row = (await _select(key)).get(key)
+        self._version = await _version()
+
+        if row == self._rows.get(key):
+            return
+
+        if row is None:
+            del self._rows[key]
+        else:
+            self._rows[key] = row
+        self._changed(key)
+
+    def get(self, key, defaults=None):
+        """Returns the value stored under a key merged over ``defaults``"""
+        row = self._rows.get(key)
+        self._counters['hits' if row is not None else 'misses'] += 1
+        return _merge(row[0] if row is not None else None, defaults)
+
+    def value(self, key, name, default):
+        """Returns one setting, converted to the type of ``default``
+
+        Raises:
+            ValueError: The stored setting cannot be converted
+        """
+        value = self.get(key).get(name, default)
+        if default is None or value is None or isinstance(value, type(default)):
+            return value
+        return type(default)(value)
+
+    def subscribe(self, key, callback, defaults=None):
+        """Calls ``callback(value)`` whenever the row of ``key`` changes,
+        with its value merged over ``defaults``. Subscribing a callback
+        again replaces its defaults.
+        """
+        self.unsubscribe(key, callback)
+        self._subscribers.setdefault(key, []).append((callback, defaults))
+
+    def unsubscribe(self, key, callback):
+        subscribers = self._subscribers.get(key, [])
+        self._subscribers[key] = [s for s in subscribers if s[0] != callback]
+
+    def _changed(self, key):
+        row = self._rows.get(key)
+
+        for callback, defaults in self._subscribers.get(key, ()):
+            try:
+                callback(_merge(row[0] if row is not None else None, defaults))
+            except Exception:
+                _logger.exception('Configuration subscriber of %s failed', key)
+
+    async def _poll(self):
+        if await _version() != self._version:
+            await self.load()
+
+    async def _follow(self, poll_interval):
+        """Follows the 'foglamp_configuration' channel on a connection of
+        its own, which is not returned to the pool, and polls while it
+        is quiet or down
+        """
+        while True:
+            try:
+                async with aiopg.connect(env.db_connection_string) as conn:
+                    async with conn.cursor() as cursor:
+                        await cursor.execute('LISTEN {}'.format(CHANNEL))
+
+                    # Changes made before LISTEN were not notified
+                    await self._poll()
+
+                    while True:
+                        try:
+                            notify = await asyncio.wait_for(conn.notifies.get(), poll_interval)
+                        except asyncio.TimeoutError:
+                            await self._poll()
+                            continue
+
+                        self._counters['notifications'] += 1
+                        await self.reload(notify.payload.strip())
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                _logger.exception('Not following configuration changes. Polling every %s seconds',
+                                  _RETRY_SECONDS)
+
+            try:
+                await asyncio.sleep(_RETRY_SECONDS)
+                await self._poll()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                _logger.exception('Unable to poll the configuration')
+
+    def stats(self):
+        result = dict(self._counters)
+        result['keys'] = len(self._rows)
+        return result
+
+
+cache = ConfigurationCache()
+"""The rows of foglamp.configuration"""
+
+metrics.registry.stats('foglamp_configuration', cache.stats,
+                       counters=('hits', 'misses', 'notifications', 'reloads'))
+
+
+async def get(key, defaults=None):
+    """Returns the value stored under a configuration key
+
+    Served from :data:`cache` once it is started, otherwise read from
+    the database.
+
+    Args:
+        key (str): A 5 character configuration key such as 'PURGE'
+        defaults (:obj:`dict`, optional): Values for settings that are
+            missing from the row (or for all settings when there is no row)
+
+    Returns:
+        dict: The row's JSON value merged over ``defaults``
+    """
+    if cache.loaded:
+        return cache.get(key, defaults)
+
+    row = (await _select(key)).get(key)
+    return _merge(row[0] if row is not None else None, defaults)
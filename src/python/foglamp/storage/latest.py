@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""The latest reading of each asset, held in memory
+
+The CoAP ingest handlers update :data:`cache` with every reading they
+accept, so the admin API can say what an asset is reading now without
+an ``ORDER BY user_ts DESC LIMIT 1`` query on foglamp.readings. At
+startup the cache is warmed with one index lookup per asset.
+
+A reading only replaces an asset's entry if its user_ts is not older,
+so a device that sends a backlog out of order does not roll the value
+back.
+
+CoAP ingest worker processes send the entries that changed since their
+last report to the main process with their stats (see
+:mod:`foglamp.device_api.coap.workers`), so there the cache lags ingest
+by up to ``stats_interval`` seconds.
+"""
+
+import logging
+
+import sqlalchemy as sa
+
+from foglamp import metrics
+from foglamp.storage import pool
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+_logger = logging.getLogger(__name__)
+
+_WARM_STATEMENT = sa.text("""
+WITH RECURSIVE assets AS (
+    (SELECT asset_code FROM foglamp.readings ORDER BY asset_code LIMIT 1)
+    UNION ALL
+    SELECT (SELECT r.asset_code FROM foglamp.readings r
+             WHERE r.asset_code > assets.asset_code ORDER BY r.asset_code LIMIT 1)
+      FROM assets
+     WHERE assets.asset_code IS NOT NULL)
+SELECT latest.asset_code, latest.user_ts, latest.reading
+  FROM assets,
+       LATERAL (SELECT r.asset_code, r.user_ts, r.reading FROM foglamp.readings r
+                 WHERE r.asset_code = assets.asset_code
+                 ORDER BY r.user_ts DESC, r.id DESC LIMIT 1) AS latest""")
+"""Finds the distinct asset codes by skipping through readings_ix2
+rather than scanning it, then each asset's latest reading"""
+
+
+class LatestReadings(object):
+    """asset_code -> (user_ts, reading)"""
+
+    def __init__(self):
+        self._entries = {}
+        self._changed = set()
+        self._counters = {'updates': 0, 'stale': 0}
+
+    async def start(self):
+        """Adds each asset's latest reading in foglamp.readings"""
+        async with pool.acquire() as conn:
+            result = await conn.execute(_WARM_STATEMENT)
+            rows = await result.fetchall()
+
+        for asset_code, user_ts, reading in rows:
+            self._update(asset_code, user_ts, reading)
+
+        _logger.info('Latest readings cache warmed with %s assets', len(rows))
+
+    def update(self, asset_code, user_ts, reading):
+        """Records a reading unless the asset has a newer one
+
+        Args:
+            user_ts (datetime): As in foglamp.readings
+        """
+        self._counters['updates'] += 1
+        if self._update(asset_code, user_ts, reading):
+            self._changed.add(asset_code)
+
+    def update_many(self, rows):
+        """Records readings given as dicts with asset_code, user_ts and reading"""
+        for row in rows:
+            self.update(row['asset_code'], row['user_ts'], row['reading'])
+
+    def _update(self, asset_code, user_ts, reading):
+        entry = self._entries.get(asset_code)
+
+        if entry is not None and entry[0] > user_ts:
+            self._counters['stale'] += 1
+            return False
+
+        self._entries[asset_code] = (user_ts, reading)
+        return True
+
+    def get(self, asset_code):
+        """Returns (user_ts, reading) or None"""
+        return self._entries.get(asset_code)
+
+    def get_many(self, asset_codes=None):
+        """Returns {asset_code: (user_ts, reading)} for the assets that
+        have a reading, or for every asset when ``asset_codes`` is None
+        """
+        if asset_codes is None:
+            return dict(self._entries)
+
+        entries = self._entries
+        return {asset_code: entries[asset_code] for asset_code in asset_codes
+                if asset_code in entries}
+
+    def changes(self):
+        """Returns the entries that changed since the last call"""
+        changed = self.get_many(self._changed)
+        self._changed = set()
+        return changed
+
+    def merge(self, entries):
+        """Adds entries returned by another process's :meth:`changes`"""
+        for asset_code, (user_ts, reading) in entries.items():
+            self._update(asset_code, user_ts, reading)
+
+    def clear(self):
+        self._entries.clear()
+        self._changed.clear()
+
+    def stats(self):
+        result = dict(self._counters)
+        result['assets'] = len(self._entries)
+        return result
+
+
+cache = LatestReadings()
+"""The latest reading of each asset"""
+
+metrics.registry.stats('foglamp_latest_readings', cache.stats, counters=('updates', 'stale'))
@@ -0,0 +1,392 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Time-range partitioning of foglamp.readings, foglamp.reading_values and foglamp.log
+
+PostgreSQL 9.6 has no declarative partitioning, so partitions are child
+tables that inherit from the parent and carry a CHECK constraint on
+their time range: user_ts for readings and reading_values, ts for log. Queries on the
+parent with a constant time range only scan the children whose range
+overlaps it (constraint_exclusion = partition, the default), and each
+child has its own, small indexes.
+
+A BEFORE INSERT trigger on each parent moves rows into their child.
+The trigger function is an IF/ELSIF chain over the newest partitions,
+regenerated whenever partitions are added, so routing a row costs a few
+comparisons. A row that matches no partition stays in the parent.
+Because unique indexes are per table, read_key is only unique within a
+partition; a retransmitted reading has the user_ts of the original, so
+it meets the original in the same partition.
+
+:class:`PartitionMaintenance` keeps partitions for the current and the
+next ``ahead`` units in place. The unit is read from the 'LOGPR' row of
+foglamp.configuration. A partition's range is in its name, for example
+readings_p20170102_0000_20170103_0000, so the partitions that exist are
+found in pg_inherits. When the unit changes, new partitions start where
+the existing ones end.
+"""
+
+import asyncio
+import calendar
+import datetime
+import logging
+import re
+
+import sqlalchemy as sa
+
+from foglamp import metrics
+from foglamp.storage import configuration
+from foglamp.storage import pool
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+_logger = logging.getLogger(__name__)
+
+_CONFIGURATION_KEY = 'LOGPR'
+
+_DEFAULT_CONFIGURATION = {
+    'unit': 'day',
+    'ahead': 2,
+    'interval': 3600
+}
+"""Used for settings missing from the 'LOGPR' configuration row
+
+- unit: One of :data:`UNITS`
+- ahead: Partitions created beyond the current one
+- interval: Seconds between maintenance runs. Runs are more frequent
+  when the partitions ahead would otherwise run out first, see
+  :func:`maintenance_delay`.
+"""
+
+_FIXED_UNITS = {
+    'minute': datetime.timedelta(minutes=1),
+    'half-hour': datetime.timedelta(minutes=30),
+    'hour': datetime.timedelta(hours=1),
+    '6-hour': datetime.timedelta(hours=6),
+    'half-day': datetime.timedelta(hours=12),
+    'day': datetime.timedelta(days=1),
+    'week': datetime.timedelta(weeks=1),
+    'fortnight': datetime.timedelta(weeks=2)
+}
+
+UNITS = ('minute', 'half-hour', 'hour', '6-hour', 'half-day', 'day', 'week', 'fortnight', 'month')
+"""Valid values of the 'unit' setting"""
+
+_EPOCH = datetime.datetime(1970, 1, 5, tzinfo=datetime.timezone.utc)
+"""A Monday, so that weeks and fortnights start on Mondays"""
+
+_TRIGGER_PARTITIONS = 64
+"""Newest partitions the insert trigger routes to. Rows older than
+all of them stay in the parent table."""
+
+_LOCK_ID = 0x466f674c
+"""pg_advisory_xact_lock key, so that processes do not maintain
+partitions at the same time"""
+
+_NAME_FORMAT = '%Y%m%d_%H%M'
+
+_NAME_RE = re.compile(r'_p(\d{8}_\d{4})_(\d{8}_\d{4})$')
+
+
+class _Partitioned(object):
+    """A parent table and how its children are built"""
+
+    def __init__(self, table, column, indexes, conflict=''):
+        self.table = table
+        self.column = column
+        self.indexes = indexes
+        """CREATE INDEX statements, formatted with the child's name"""
+        self.conflict = conflict
+        """ON CONFLICT clause of the trigger's INSERT"""
+
+
+TABLES = (
+    _Partitioned('readings', 'user_ts', (
+        'ALTER TABLE foglamp.{name} ADD CONSTRAINT {name}_pkey PRIMARY KEY (id)',
+        'CREATE UNIQUE INDEX {name}_ix1 ON foglamp.{name} USING btree (read_key)',
+        'CREATE INDEX {name}_ix2 ON foglamp.{name} USING btree (asset_code, user_ts, id)'),
+        conflict=' ON CONFLICT (read_key) DO NOTHING'),
+    _Partitioned('log', 'ts', (
+        'ALTER TABLE foglamp.{name} ADD CONSTRAINT {name}_pkey PRIMARY KEY (id)',
+        'CREATE INDEX {name}_ix1 ON foglamp.{name} USING btree (code, ts, level)')),
+    _Partitioned('reading_values', 'user_ts', (
+        'ALTER TABLE foglamp.{name} ADD CONSTRAINT {name}_pkey PRIMARY KEY (id)',
+        'CREATE INDEX {name}_ix1 ON foglamp.{name} USING btree (asset_code, point_path_id, user_ts)'))
+)
+"""The partitioned tables"""
+
+_TABLES_BY_NAME = {partitioned.table: partitioned for partitioned in TABLES}
+
+
+def partition_start(ts, unit):
+    """Returns the start of the partition of ``unit`` that ``ts`` is in"""
+    ts = ts.astimezone(datetime.timezone.utc)
+
+    if unit == 'month':
+        return ts.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+    width = _FIXED_UNITS[unit]
+    return _EPOCH + ((ts - _EPOCH) // width) * width
+
+
+def partition_end(start, unit):
+    """Returns the end of the partition of ``unit`` that starts at ``start``"""
+    if unit == 'month':
+        days = calendar.monthrange(start.year, start.month)[1]
+        return start + datetime.timedelta(days=days)
+    return start + _FIXED_UNITS[unit]
+
+
+def maintenance_delay(interval, unit, ahead):
+    """Returns the seconds to wait before the next maintenance run
+
+    That is ``interval``, but no more than half of the time the
+    partitions ahead cover, so that rows never outrun them into the
+    parent table.
+    """
+    # A month is at least 28 days
+    width = _FIXED_UNITS.get(unit, datetime.timedelta(days=28))
+    return min(interval, width.total_seconds() * max(ahead, 1) / 2)
+
+
+def partition_name(table, start, end):
+    return '{}_p{}_{}'.format(table, start.strftime(_NAME_FORMAT), end.strftime(_NAME_FORMAT))
+
+
+def parse_partition_name(name):
+    """Returns (start, end) from a partition's name, or None"""
+    match = _NAME_RE.search(name)
+    if match is None:
+        return None
+
+    return tuple(datetime.datetime.strptime(value, _NAME_FORMAT).replace(tzinfo=datetime.timezone.utc)
+                 for value in match.groups())
+
+
+def plan(existing, now, unit, ahead):
+    """Returns the (start, end) ranges of partitions to create
+
+    Args:
+        existing (list): (start, end) of the partitions that exist
+        now (datetime): The current time
+        unit (str): One of :data:`UNITS`
+        ahead (int): Partitions wanted beyond the one ``now`` is in
+    """
+    start = partition_start(now, unit)
+    until = start
+    for _ in range(ahead + 1):
+        until = partition_end(until, unit)
+
+    last_end = max((end for _, end in existing), default=None)
+    if last_end is not None and last_end > start:
+        start = last_end
+
+    ranges = []
+
+    while start < until:
+        # After a unit change the first partition may be shorter than a unit
+        end = partition_end(partition_start(start, unit), unit)
+        ranges.append((start, end))
+        start = end
+
+    return ranges
+
+
+def _literal(ts):
+    return "'{}'".format(ts.isoformat())
+
+
+def _trigger_function(partitioned, partitions):
+    """Returns CREATE FUNCTION for the parent's insert trigger
+
+    Args:
+        partitions (list): (name, start, end), newest first
+    """
+    column = partitioned.column
+    branches = []
+
+    for index, (name, start, end) in enumerate(partitions[:_TRIGGER_PARTITIONS]):
+        branches.append(
+            '    {} NEW.{column} >= {} AND NEW.{column} < {} THEN\n'
+            '        INSERT INTO foglamp.{} VALUES (NEW.*){};\n'.format(
+                'IF' if index == 0 else 'ELSIF', _literal(start), _literal(end), name,
+                partitioned.conflict, column=column))
+
+    if branches:
+        body = ''.join(branches) + '    ELSE\n        RETURN NEW;\n    END IF;\n    RETURN NULL;\n'
+    else:
+        body = '    RETURN NEW;\n'
+
+    return ('CREATE OR REPLACE FUNCTION foglamp.{}_partition_insert()\n'
+            '  RETURNS trigger\n'
+            '  LANGUAGE plpgsql\n'
+            'AS $$\n'
+            'BEGIN\n'
+            '{}'
+            'END;\n'
+            '$$').format(partitioned.table, body)
+
+
+async def _existing(conn, table):
+    """Returns (name, start, end) of a table's partitions, newest first"""
+    result = await conn.execute(sa.text(
+        "SELECT c.relname FROM pg_inherits i"
+        " JOIN pg_class c ON c.oid = i.inhrelid"
+        " JOIN pg_class p ON p.oid = i.inhparent"
+        " JOIN pg_namespace n ON n.oid = p.relnamespace"
+        " WHERE n.nspname = 'foglamp' AND p.relname = :table"), table=table)
+
+    partitions = []
+    for row in await result.fetchall():
+        bounds = parse_partition_name(row[0])
+        if bounds is not None:
+            partitions.append((row[0],) + bounds)
+
+    return sorted(partitions, key=lambda partition: partition[1], reverse=True)
+
+
+async def maintain(unit, ahead, now=None):
+    """Creates missing partitions of every table in :data:`TABLES` and
+    regenerates their insert triggers
+
+    Returns:
+        list: Names of the partitions created
+    """
+    if unit not in UNITS:
+        raise ValueError('unit must be one of {}'.format(', '.join(UNITS)))
+
+    if now is None:
+        now = datetime.datetime.now(datetime.timezone.utc)
+
+    created = []
+
+    async with pool.acquire() as conn:
+        async with conn.begin():
+            await conn.execute(sa.text('SELECT pg_advisory_xact_lock(:id)'), id=_LOCK_ID)
+
+            for partitioned in TABLES:
+                existing = await _existing(conn, partitioned.table)
+                ranges = plan([(start, end) for _, start, end in existing], now, unit, ahead)
+
+                for start, end in ranges:
+                    name = partition_name(partitioned.table, start, end)
+                    await conn.execute(
+                        'CREATE TABLE foglamp.{name} (CHECK ({column} >= {start} AND {column} < {end}))'
+                        ' INHERITS (foglamp.{table}) TABLESPACE foglamp'.format(
+                            name=name, column=partitioned.column, start=_literal(start),
+                            end=_literal(end), table=partitioned.table))
+                    for statement in partitioned.indexes:
+                        await conn.execute(statement.format(name=name))
+
+                    existing.insert(0, (name, start, end))
+                    created.append(name)
+
+                if ranges:
+                    await conn.execute(_trigger_function(partitioned, existing))
+
+    if created:
+        _logger.info('Created partitions: %s', ', '.join(created))
+
+    return created
+
+
+async def drop(table, before, max_id=None):
+    """Drops the partitions of a table that end at or before ``before``
+    and regenerates the table's insert trigger
+
+    Args:
+        table (str): The name of a table in :data:`TABLES`
+        before (datetime): Partitions ending later are kept
+        max_id (int): When not None, partitions that have a row with a
+            greater id are kept
+
+    Returns:
+        list: Names of the partitions dropped
+    """
+    partitioned = _TABLES_BY_NAME[table]
+    dropped = []
+
+    async with pool.acquire() as conn:
+        async with conn.begin():
+            await conn.execute(sa.text('SELECT pg_advisory_xact_lock(:id)'), id=_LOCK_ID)
+
+            existing = await _existing(conn, table)
+
+            for partition in list(existing):
+                name, _, end = partition
+                if end > before:
+                    continue
+
+                if max_id is not None:
+                    result = await conn.execute('SELECT max(id) FROM foglamp.{}'.format(name))
+                    last_id = await result.scalar()
+                    if last_id is not None and last_id > max_id:
+                        continue
+
+                await conn.execute('DROP TABLE foglamp.{}'.format(name))
+                existing.remove(partition)
+                dropped.append(name)
+
+            if dropped:
+                await conn.execute(_trigger_function(partitioned, existing))
+
+    if dropped:
+        _logger.info('Dropped partitions: %s', ', '.join(dropped))
+
+    return dropped
+
+
+class PartitionMaintenance(object):
+    """Runs :func:`maintain` at startup and then every
+    :func:`maintenance_delay` seconds"""
+
+    def __init__(self):
+        self._task = None
+        self._counters = {'runs': 0, 'failures': 0, 'created': 0}
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            interval = _DEFAULT_CONFIGURATION['interval']
+
+            try:
+                config = await configuration.get(_CONFIGURATION_KEY, _DEFAULT_CONFIGURATION)
+                interval = maintenance_delay(float(config['interval']), config['unit'], int(config['ahead']))
+                created = await maintain(config['unit'], int(config['ahead']))
+                self._counters['created'] += len(created)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self._counters['failures'] += 1
+                _logger.exception('Partition maintenance failed. Retrying in %s seconds', interval)
+
+            self._counters['runs'] += 1
+            await asyncio.sleep(interval)
+
+    def stats(self):
+        return dict(self._counters)
+
+
+maintenance = PartitionMaintenance()
+"""Maintains the partitions of foglamp.readings and foglamp.log"""
+
+metrics.registry.stats('foglamp_partitions', maintenance.stats, counters=('runs', 'failures', 'created'))
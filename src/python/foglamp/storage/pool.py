@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Shared PostgreSQL connection pool
+
+A single aiopg.sa engine is created at startup from
+:data:`foglamp.env.db_connection_string` and shared by every coroutine
+that talks to the database. Opening an engine per request costs a TCP
+connect and a Postgres authentication round trip; with the pool those
+costs are paid once per connection.
+
+The pool is configured by the optional ``pool`` section of
+foglamp-env.yaml::
+
+    pool:
+      min_size: 1
+      max_size: 10
+      acquire_timeout: 5
+      health_check_interval: 30
+      recycle: 3600
+
+Example:
+    ::
+
+        async with pool.acquire() as conn:
+            await conn.execute(...)
+"""
+
+import asyncio
+import logging
+import time
+import weakref
+
+import aiopg.sa
+
+from foglamp import metrics
+import foglamp.env as env
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+_logger = logging.getLogger(__name__)
+
+_DEFAULT_SETTINGS = {
+    'min_size': 1,
+    'max_size': 10,
+    'acquire_timeout': 5,
+    'health_check_interval': 30,
+    'recycle': 3600
+}
+"""Used for settings missing from the 'pool' section of foglamp-env.yaml
+
+- acquire_timeout: Seconds to wait for a free connection
+- health_check_interval: A connection that has been idle for longer than
+  this many seconds is checked with 'SELECT 1' before it is handed out
+- recycle: Seconds after which a connection is closed and reopened
+  (-1 disables recycling)
+"""
+
+_engine = None
+_settings = None
+_opened_at = weakref.WeakKeyDictionary()
+"""Raw connection -> time.monotonic() at which it was first handed out"""
+
+_released_at = weakref.WeakKeyDictionary()
+"""Raw connection -> time.monotonic() at which it was returned to the pool"""
+
+_counters = {
+    'acquired': 0,
+    'timeouts': 0,
+    'health_check_failures': 0,
+    'recycled': 0,
+    'wait_seconds': 0.0
+}
+
+
+class PoolNotCreated(Exception):
+    """Raised by :func:`acquire` when :func:`create` has not been called"""
+    pass
+
+
+def _load_settings():
+    settings = dict(_DEFAULT_SETTINGS)
+    if env.config is not None:
+        settings.update(env.config.get('pool') or {})
+    return settings
+
+
+async def create():
+    """Creates the shared engine. Calling it again is harmless.
+
+    Returns:
+        The aiopg.sa engine
+    """
+    global _engine, _settings
+
+    if _engine is not None:
+        return _engine
+
+    _settings = _load_settings()
+
+    _engine = await aiopg.sa.create_engine(
+        env.db_connection_string,
+        minsize=_settings['min_size'],
+        maxsize=_settings['max_size'])
+
+    _logger.info('Connection pool created: min_size=%s max_size=%s',
+                 _settings['min_size'], _settings['max_size'])
+
+    return _engine
+
+
+async def close():
+    """Closes all connections. Waits for acquired connections to be released."""
+    global _engine
+
+    if _engine is None:
+        return
+
+    engine = _engine
+    _engine = None
+    engine.close()
+    await engine.wait_closed()
+
+
+def acquire():
+    """Returns an async context manager that yields a
+    :class:`aiopg.sa.SAConnection` and releases it to the pool on exit
+
+    Raises:
+        PoolNotCreated: :func:`create` has not been called
+        asyncio.TimeoutError: No connection became free within
+            the configured acquire_timeout
+    """
+    return _AcquireContextManager()
+
+
+def stats():
+    """Returns pool utilisation and counters as a dict"""
+    result = dict(_counters)
+
+    if _engine is None:
+        result.update({'size': 0, 'free': 0, 'used': 0, 'min_size': 0, 'max_size': 0})
+    else:
+        result.update({
+            'size': _engine.size,
+            'free': _engine.freesize,
+            'used': _engine.size - _engine.freesize,
+            'min_size': _engine.minsize,
+            'max_size': _engine.maxsize
+        })
+
+    return result
+
+
+async def _is_usable(conn):
+    """Returns False for connections that are older than 'recycle' seconds
+    or that have been idle for longer than health_check_interval and
+    fail 'SELECT 1'
+    """
+    now = time.monotonic()
+    raw = conn.connection
+
+    opened_at = _opened_at.setdefault(raw, now)
+    if 0 <= _settings['recycle'] < now - opened_at:
+        _counters['recycled'] += 1
+        return False
+
+    released_at = _released_at.get(raw)
+    if released_at is None or now - released_at < _settings['health_check_interval']:
+        return True
+
+    try:
+        await conn.execute('SELECT 1')
+        return True
+    except Exception:
+        _counters['health_check_failures'] += 1
+        _logger.warning('Discarding a pooled connection that failed its health check',
+                        exc_info=True)
+        return False
+
+
+class _AcquireContextManager:
+    def __init__(self):
+        self._engine = None
+        self._conn = None
+
+    async def __aenter__(self):
+        engine = _engine
+
+        if engine is None:
+            raise PoolNotCreated()
+
+        start = time.monotonic()
+
+        while True:
+            remaining = _settings['acquire_timeout'] - (time.monotonic() - start)
+
+            try:
+                conn = await asyncio.wait_for(engine.acquire(), max(remaining, 0))
+            except asyncio.TimeoutError:
+                _counters['timeouts'] += 1
+                raise
+
+            if await _is_usable(conn):
+                break
+
+            # A closed connection is dropped by the pool on release
+            conn.connection.close()
+            engine.release(conn)
+
+        _counters['acquired'] += 1
+        _counters['wait_seconds'] += time.monotonic() - start
+
+        self._engine = engine
+        self._conn = conn
+        return conn
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        _released_at[self._conn.connection] = time.monotonic()
+        self._engine.release(self._conn)
+        self._engine = None
+        self._conn = None
+
+
+metrics.registry.stats('foglamp_pool', stats,
+                       counters=('acquired', 'timeouts', 'health_check_failures', 'recycled',
+                                 'wait_seconds'))
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Removes expired rows from foglamp.readings, foglamp.reading_values and foglamp.log
+
+Readings (and their values in foglamp.reading_values) older than the
+'age' of the 'PURGE' configuration row and log entries older than the
+'retention' of the 'SYPRG' row are removed every 'interval' seconds.
+
+Whole partitions (see :mod:`foglamp.storage.partitions`) whose range has
+expired are dropped first, which costs the same however many rows they
+hold. The rows left over, in the parent tables or in partitions that
+are only partly expired, are deleted ``batch_size`` at a time in id
+order. Each batch is a short transaction of its own and starts after the
+last id the previous batch deleted, so it neither holds locks for long
+nor rescans what was already removed. Deleting stops for the cycle once
+it has taken 'budget' seconds and picks up where it left off next cycle.
+
+With 'retain_unsent', readings that an active stream has not sent north
+yet are kept. For a stream filtered by asset code, that is from its
+first unsent reading of those assets, so a stream whose assets are quiet
+does not hold back readings it will never send. Values are not sent
+north and are always removed.
+
+Each cycle sets 'last purge' in the 'SYPRG' row and writes what it
+removed to foglamp.log under the 'PURGE' code.
+"""
+
+import asyncio
+import datetime
+import logging
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import JSONB
+
+from foglamp import metrics
+from foglamp.storage import configuration
+from foglamp.storage import partitions
+from foglamp.storage import pool
+from foglamp.storage import readings
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+_logger = logging.getLogger(__name__)
+
+_CONFIGURATION_KEY = 'PURGE'
+
+_DEFAULT_CONFIGURATION = {
+    'age': 259200,
+    'enabled': True,
+    'interval': 3600,
+    'batch_size': 1000,
+    'budget': 60,
+    'pause': 0.05,
+    'retain_unsent': True
+}
+"""Used for settings missing from the 'PURGE' configuration row
+
+- age: Seconds readings are kept, by user_ts
+- enabled: When false nothing is removed
+- interval: Seconds between cycles
+- batch_size: Rows deleted per statement
+- budget: Seconds a cycle may spend deleting rows
+- pause: Seconds between batches
+- retain_unsent: Keep readings that a stream has not sent yet
+"""
+
+_SYSTEM_CONFIGURATION_KEY = 'SYPRG'
+
+_DEFAULT_SYSTEM_CONFIGURATION = {
+    'retention': 259200
+}
+"""Used for settings missing from the 'SYPRG' configuration row
+
+- retention: Seconds log entries are kept, by ts
+"""
+
+_LOG_CODE = 'PURGE'
+
+_LOG_SUCCESS = 0
+_LOG_FAILURE = 1
+"""Values of foglamp.log.level"""
+
+_TIME_COLUMNS = {'readings': 'user_ts', 'reading_values': 'user_ts', 'log': 'ts'}
+
+_DELETE_BATCH = """
+WITH deleted AS (
+    DELETE FROM foglamp.{table}
+     WHERE id IN (SELECT id FROM foglamp.{table}
+                   WHERE id > :after AND {column} < :before{unsent}
+                   ORDER BY id
+                   LIMIT :batch_size)
+    RETURNING id)
+SELECT count(*), max(id) FROM deleted"""
+
+_STREAMS_STATEMENT = sa.text("""
+SELECT s.last_object, s.object_filter
+  FROM foglamp.streams s
+  JOIN foglamp.destinations d ON d.id = s.destination_id
+ WHERE s.active AND d.active""")
+
+_NEXT_UNSENT_STATEMENT = sa.text("""
+SELECT min(id)
+  FROM foglamp.readings
+ WHERE id > :after AND asset_code = ANY(:asset_codes)""")
+"""The id of a filtered stream's first unsent reading"""
+
+_metadata = sa.MetaData()
+
+_log_tbl = sa.Table(
+    'log',
+    _metadata,
+    sa.Column('id', sa.types.BIGINT, primary_key=True),
+    sa.Column('code', sa.types.CHAR(5)),
+    sa.Column('level', sa.types.SMALLINT),
+    sa.Column('log', JSONB),
+    sa.Column('ts', sa.types.TIMESTAMP(timezone=True)),
+    schema='foglamp')
+
+_configuration_tbl = sa.Table(
+    'configuration',
+    _metadata,
+    sa.Column('key', sa.types.CHAR(5)),
+    sa.Column('value', JSONB),
+    sa.Column('ts', sa.types.TIMESTAMP(timezone=True)),
+    schema='foglamp')
+
+
+def _delete_statement(table, unsent):
+    return sa.text(_DELETE_BATCH.format(
+        table=table, column=_TIME_COLUMNS[table], unsent=' AND id <= :max_id' if unsent else ''))
+
+
+async def _last_sent_id():
+    """Returns an id such that every active stream has sent the readings
+    up to it that it will send, or None when there are no active streams"""
+    async with pool.acquire() as conn:
+        result = await conn.execute(_STREAMS_STATEMENT)
+        streams = await result.fetchall()
+        max_id = None
+        last_id = None
+
+        for last_object, object_filter in streams:
+            asset_codes = (object_filter or {}).get('asset_codes')
+            sent_id = last_object
+
+            if asset_codes:
+                if last_id is None:
+                    # Ids above this may still be inserted with one of the assets
+                    last_id = await readings.committed_id(conn)
+                result = await conn.execute(_NEXT_UNSENT_STATEMENT,
+                                            {'after': last_object, 'asset_codes': list(asset_codes)})
+                next_id = await result.scalar()
+                sent_id = max(last_object, last_id if next_id is None else min(next_id - 1, last_id))
+
+            max_id = sent_id if max_id is None else min(max_id, sent_id)
+
+        return max_id
+
+
+async def _write_log(level, log):
+    async with pool.acquire() as conn:
+        await conn.execute(_log_tbl.insert().values(code=_LOG_CODE, level=level, log=log))
+
+
+async def _set_last_purge(now):
+    tbl = _configuration_tbl
+    async with pool.acquire() as conn:
+        await conn.execute(tbl.update().where(tbl.c.key == _SYSTEM_CONFIGURATION_KEY).values(
+            value=tbl.c.value.op('||')(sa.func.jsonb_build_object('last purge', now))))
+
+
+class Purge(object):
+    """Runs :meth:`run_once` every 'interval' seconds"""
+
+    def __init__(self):
+        self._task = None
+        self._after = {'readings': 0, 'reading_values': 0, 'log': 0}
+        """The last id deleted from each table by an unfinished pass"""
+        self._counters = {'runs': 0, 'failures': 0, 'readings_deleted': 0, 'reading_values_deleted': 0,
+                          'log_deleted': 0, 'partitions_dropped': 0}
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            interval = _DEFAULT_CONFIGURATION['interval']
+
+            try:
+                config = await configuration.get(_CONFIGURATION_KEY, _DEFAULT_CONFIGURATION)
+                interval = float(config['interval'])
+
+                if config['enabled']:
+                    system_config = await configuration.get(
+                        _SYSTEM_CONFIGURATION_KEY, _DEFAULT_SYSTEM_CONFIGURATION)
+                    await self.run_once(config, system_config)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._counters['failures'] += 1
+                _logger.exception('Purge failed. Retrying in %s seconds', interval)
+                try:
+                    await _write_log(_LOG_FAILURE, {'error': str(e)})
+                except Exception:
+                    pass
+
+            await asyncio.sleep(interval)
+
+    async def run_once(self, config=None, system_config=None, now=None):
+        """Removes expired partitions and rows
+
+        Args:
+            config (dict): The 'PURGE' settings
+            system_config (dict): The 'SYPRG' settings
+
+        Returns:
+            dict: What was removed from each table, as written to foglamp.log
+        """
+        config = dict(_DEFAULT_CONFIGURATION, **(config or {}))
+        system_config = dict(_DEFAULT_SYSTEM_CONFIGURATION, **(system_config or {}))
+
+        if now is None:
+            now = datetime.datetime.now(datetime.timezone.utc)
+
+        deadline = asyncio.get_event_loop().time() + float(config['budget'])
+        max_id = await _last_sent_id() if config['retain_unsent'] else None
+
+        report = {}
+
+        readings_before = now - datetime.timedelta(seconds=float(config['age']))
+
+        for table, before, table_max_id in (
+                ('readings', readings_before, max_id),
+                ('reading_values', readings_before, None),
+                ('log', now - datetime.timedelta(seconds=float(system_config['retention'])), None)):
+            dropped = await partitions.drop(table, before, table_max_id)
+            deleted, complete = await self._delete(
+                table, before, table_max_id, int(config['batch_size']), float(config['pause']), deadline)
+
+            self._counters['partitions_dropped'] += len(dropped)
+            self._counters[table + '_deleted'] += deleted
+            report[table] = {
+                'before': before.isoformat(),
+                'partitions_dropped': dropped,
+                'deleted': deleted,
+                'complete': complete
+            }
+
+        if max_id is not None:
+            report['readings']['max_id'] = max_id
+
+        await _set_last_purge(now)
+        await _write_log(_LOG_SUCCESS, report)
+        self._counters['runs'] += 1
+
+        _logger.info('Purged %s readings and %s log entries',
+                     report['readings']['deleted'], report['log']['deleted'])
+
+        return report
+
+    async def _delete(self, table, before, max_id, batch_size, pause, deadline):
+        """Deletes rows in batches until none are left or the deadline passes
+
+        Returns:
+            tuple: (rows deleted, whether no expired rows are left)
+        """
+        statement = _delete_statement(table, max_id is not None)
+        params = {'before': before, 'batch_size': batch_size}
+        if max_id is not None:
+            params['max_id'] = max_id
+
+        loop = asyncio.get_event_loop()
+        deleted = 0
+
+        while True:
+            params['after'] = self._after[table]
+
+            async with pool.acquire() as conn:
+                result = await conn.execute(statement, params)
+                count, last_id = await result.first()
+
+            deleted += count
+
+            if count < batch_size:
+                self._after[table] = 0
+                return deleted, True
+
+            self._after[table] = last_id
+
+            if loop.time() >= deadline:
+                return deleted, False
+
+            await asyncio.sleep(pause)
+
+    def stats(self):
+        return dict(self._counters)
+
+
+task = Purge()
+"""Removes expired readings and log entries"""
+
+metrics.registry.stats('foglamp_purge', task.stats,
+                       counters=('runs', 'failures', 'readings_deleted', 'reading_values_deleted',
+                                 'log_deleted', 'partitions_dropped'))
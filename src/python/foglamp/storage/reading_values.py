@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""The numeric values of readings, one row each, in foglamp.reading_values
+
+With the 'flatten_values' setting of the 'INGST' configuration row,
+:class:`foglamp.storage.readings.ReadingsBuffer` writes every number in
+a reading to foglamp.reading_values, in the same transaction as the
+reading. A value's path is made of the keys from the top of the reading
+down to it, joined by '.'::
+
+    {'velocity': 3, 'temperature': {'value': 21.5, 'unit': 'C'}}
+
+has the values velocity = 3.0 and temperature.value = 21.5. Strings,
+booleans and lists are left out.
+
+Paths are interned in foglamp.point_paths and a value row holds the
+path's id. Paths are only ever added, so their ids are cached in memory
+for good. Queries on a single value of an asset use the index on
+(asset_code, point_path_id, user_ts).
+
+A value row also holds the id of its reading. Several readings of an
+asset can share a user_ts, so values are only told apart by reading.
+The readings insert skips retransmitted readings, and values are only
+written for the readings it stored.
+"""
+
+import logging
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import insert
+
+from foglamp import metrics
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+_logger = logging.getLogger(__name__)
+
+MAX_VALUES = 100
+"""Values taken from one reading. The rest are left out."""
+
+MAX_DEPTH = 8
+"""Values nested deeper than this are left out"""
+
+MAX_PATH_LENGTH = 255
+"""Length of foglamp.point_paths.path"""
+
+MAX_PATHS = 10000
+"""Paths cached by a process. Values of new paths are left out once
+this many are cached, so that devices sending ever new keys do not
+fill foglamp.point_paths."""
+
+_metadata = sa.MetaData()
+
+_point_paths_tbl = sa.Table(
+    'point_paths',
+    _metadata,
+    sa.Column('id', sa.types.INTEGER, primary_key=True),
+    sa.Column('path', sa.types.VARCHAR(MAX_PATH_LENGTH)),
+    schema='foglamp')
+
+_reading_values_tbl = sa.Table(
+    'reading_values',
+    _metadata,
+    sa.Column('id', sa.types.BIGINT, primary_key=True),
+    sa.Column('reading_id', sa.types.BIGINT),
+    sa.Column('asset_code', sa.types.VARCHAR(50)),
+    sa.Column('point_path_id', sa.types.INTEGER),
+    sa.Column('user_ts', sa.types.TIMESTAMP(timezone=True)),
+    sa.Column('value', sa.types.FLOAT),
+    schema='foglamp')
+"""Defines the table that values are inserted into"""
+
+
+def flatten(reading):
+    """Returns the numbers in a reading
+
+    Args:
+        reading (dict): The sensor values of a reading
+
+    Returns:
+        list: (path, float) tuples, at most :data:`MAX_VALUES`
+    """
+    values = []
+    if isinstance(reading, dict):
+        _flatten(reading, '', 1, values)
+    return values
+
+
+def _flatten(node, prefix, depth, values):
+    for key, value in node.items():
+        if len(values) >= MAX_VALUES:
+            return
+
+        path = prefix + str(key)
+
+        if isinstance(value, dict):
+            if depth < MAX_DEPTH:
+                _flatten(value, path + '.', depth + 1, values)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            if len(path) > MAX_PATH_LENGTH:
+                continue
+            try:
+                values.append((path, float(value)))
+            except OverflowError:
+                pass
+
+
+class PointPaths(object):
+    """The ids of point paths, cached in memory"""
+
+    def __init__(self):
+        self._ids = {}
+        """path -> id"""
+        self._counters = {'interned': 0, 'skipped': 0}
+
+    async def ids(self, conn, paths):
+        """Returns the ids of paths, adding the paths that are new to
+        foglamp.point_paths
+
+        Args:
+            conn: A connection from :func:`foglamp.storage.pool.acquire`
+            paths (iterable): Point paths
+
+        Returns:
+            dict: path -> id, without the paths left out because
+            :data:`MAX_PATHS` are cached
+        """
+        missing = [path for path in set(paths) if path not in self._ids]
+        room = MAX_PATHS - len(self._ids)
+
+        if len(missing) > room:
+            self._counters['skipped'] += len(missing) - max(room, 0)
+            missing = missing[:max(room, 0)]
+
+        if missing:
+            tbl = _point_paths_tbl
+            await conn.execute(insert(tbl).values(
+                [{'path': path} for path in missing]).on_conflict_do_nothing(index_elements=['path']))
+            result = await conn.execute(sa.select([tbl.c.id, tbl.c.path]).where(tbl.c.path.in_(missing)))
+
+            for row in await result.fetchall():
+                self._ids[row['path']] = row['id']
+            self._counters['interned'] += len(missing)
+
+        return self._ids
+
+    def stats(self):
+        result = dict(self._counters)
+        result['cached'] = len(self._ids)
+        return result
+
+
+point_paths = PointPaths()
+"""The point paths seen by this process"""
+
+metrics.registry.stats('foglamp_point_paths', point_paths.stats, counters=('interned', 'skipped'))
+
+
+async def point_values(conn, readings):
+    """Returns the numbers of each reading, adding new paths to
+    foglamp.point_paths
+
+    Args:
+        conn: A connection from :func:`foglamp.storage.pool.acquire`
+        readings (list): dicts with a 'reading'
+
+    Returns:
+        list: A list of (point_path_id, float) tuples for each reading
+    """
+    flattened = [flatten(reading['reading']) for reading in readings]
+    ids = await point_paths.ids(conn, (path for values in flattened for path, _ in values))
+
+    return [[(ids[path], value) for path, value in values if path in ids] for values in flattened]
+
+
+def rows(readings, values, inserted):
+    """Returns the foglamp.reading_values rows of the readings that were
+    inserted
+
+    Args:
+        readings (list): dicts with id, asset_code and user_ts
+        values (list): As returned by :func:`point_values`
+        inserted (set): Ids of the readings that were inserted
+    """
+    return [{'reading_id': reading['id'],
+             'asset_code': reading['asset_code'],
+             'point_path_id': point_path_id,
+             'user_ts': reading['user_ts'],
+             'value': value}
+            for reading, reading_values in zip(readings, values) if reading['id'] in inserted
+            for point_path_id, value in reading_values]
+
+
+def insert_statement(rows):
+    """Returns a multi-row INSERT of values"""
+    return insert(_reading_values_tbl).values(rows)
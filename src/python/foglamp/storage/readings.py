@@ -0,0 +1,499 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Write-behind buffer for the foglamp.readings table
+
+Readings are accumulated in memory and written with one multi-row
+INSERT per batch instead of one INSERT (and one transaction) per
+reading. A batch is flushed when it reaches ``batch_size`` rows or when
+its oldest reading has waited ``max_latency`` seconds, whichever comes
+first. Both settings are read from the 'INGST' row of
+foglamp.configuration when the buffer starts, and follow changes to it
+while it runs.
+
+Readings can be held in an on-disk spool (see :mod:`foglamp.storage.spool`)
+instead of memory.
+
+Rows whose read_key already exists are skipped by
+``ON CONFLICT (read_key) DO NOTHING`` so a retransmitted reading does
+not fail the batch it is in.
+
+A batch is inserted in a transaction that first takes a shared
+advisory lock keyed by the current value of readings_id_seq, and holds
+it until the batch commits. :func:`committed_id` returns no id above
+the smallest such key, so the streamer and purge never pass readings
+that are still being written (see :mod:`foglamp.streaming.streamer`).
+
+With 'flatten_values', the numbers in each batch are also written to
+foglamp.reading_values (see :mod:`foglamp.storage.reading_values`), in
+the same transaction as the batch. The batch's ids are drawn from
+readings_id_seq first so that values can refer to their reading, and
+values are left out for the retransmitted readings the insert skipped.
+"""
+
+import asyncio
+import logging
+import time
+
+import psycopg2
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import JSONB, UUID, insert
+
+from foglamp import metrics
+from foglamp.storage import configuration
+from foglamp.storage import pool
+from foglamp.storage import reading_values
+from foglamp.storage import spool
+import foglamp.env as env
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+_logger = logging.getLogger(__name__)
+
+_readings_tbl = sa.Table(
+    'readings',
+    sa.MetaData(),
+    sa.Column('id', sa.types.BIGINT, primary_key=True),
+    sa.Column('asset_code', sa.types.VARCHAR(50)),
+    sa.Column('read_key', UUID),
+    sa.Column('user_ts', sa.types.TIMESTAMP(timezone=True)),
+    sa.Column('reading', JSONB),
+    sa.Column('ts', sa.types.TIMESTAMP(timezone=True)),
+    schema='foglamp')
+"""Defines the table that readings are inserted into"""
+
+_CONFIGURATION_KEY = 'INGST'
+
+_DEFAULT_CONFIGURATION = {
+    'batch_size': 250,
+    'max_latency': 0.5,
+    'high_watermark': 100000,
+    'low_watermark': 75000,
+    'flatten_values': False
+}
+"""Used for settings missing from the 'INGST' configuration row
+
+- batch_size: Maximum number of readings in one INSERT
+- max_latency: Maximum number of seconds a reading waits in memory
+- high_watermark: :meth:`ReadingsBuffer.is_full` returns True once this
+  many readings are pending...
+- low_watermark: ...until no more than this many are pending
+- flatten_values: Also write the numbers in readings to
+  foglamp.reading_values
+"""
+
+_IN_FLIGHT_STATEMENT = 'SELECT pg_advisory_xact_lock_shared(last_value) FROM foglamp.readings_id_seq'
+"""Taken before the readings of a transaction draw their ids, which are
+therefore all greater than its key"""
+
+_LAST_ID_STATEMENT = 'SELECT last_value FROM foglamp.readings_id_seq'
+
+_LOCKS_STATEMENT = """
+SELECT min((l.classid::bigint << 32) | l.objid::bigint)
+  FROM pg_locks l
+  JOIN pg_database d ON d.oid = l.database
+ WHERE d.datname = current_database() AND l.locktype = 'advisory'
+   AND l.objsubid = 1 AND l.mode = 'ShareLock'"""
+"""The smallest key of the locks held by transactions inserting readings.
+A bigint key is split into classid (high half) and objid (low half),
+and partition maintenance only takes exclusive locks."""
+
+_IDS_STATEMENT = sa.text("SELECT nextval('foglamp.readings_id_seq') FROM generate_series(1, :count)")
+
+_RETRY_SECONDS = 1
+"""How long to wait before retrying a batch that failed because
+the database was unavailable"""
+
+
+class _MemoryQueue(object):
+    """Holds buffered readings when the spool is disabled. Has the
+    same interface as :class:`foglamp.storage.spool.Spool`.
+    """
+
+    def __init__(self):
+        self._rows = []
+
+    def __len__(self):
+        return len(self._rows)
+
+    def append(self, row):
+        self._rows.append(row)
+
+    def extend(self, rows):
+        self._rows.extend(rows)
+
+    def peek(self, count):
+        return self._rows[:count]
+
+    def consume(self, count):
+        del self._rows[:count]
+
+    def close(self):
+        pass
+
+
+class ReadingsBuffer(object):
+    """Accumulates readings and flushes them to foglamp.readings in batches
+
+    Readings are held in memory or, when the 'spool' section of
+    foglamp-env.yaml enables it, in a :class:`foglamp.storage.spool.Spool`
+    so that they survive restarts and database outages. Either way a
+    reading is only removed after it has been written.
+
+    Attributes:
+        batch_size (int): Maximum number of readings in one INSERT
+        max_latency (float): Maximum number of seconds a reading waits
+            before it is flushed
+        high_watermark (int): See :meth:`is_full`
+        low_watermark (int): See :meth:`is_full`
+        flatten_values (bool): Whether the numbers in readings are also
+            written to foglamp.reading_values
+    """
+
+    def __init__(self, batch_size=None, max_latency=None):
+        self.batch_size = batch_size or _DEFAULT_CONFIGURATION['batch_size']
+        self.max_latency = max_latency or _DEFAULT_CONFIGURATION['max_latency']
+        self.high_watermark = _DEFAULT_CONFIGURATION['high_watermark']
+        self.low_watermark = _DEFAULT_CONFIGURATION['low_watermark']
+        self.flatten_values = _DEFAULT_CONFIGURATION['flatten_values']
+        self._full = False
+
+        self._queue = _MemoryQueue()
+        self._oldest = None
+        """time.monotonic() at which the oldest buffered reading was added"""
+
+        self._wakeup = None
+        self._task = None
+        self._stopping = False
+
+        self._counters = {
+            'added': 0,
+            'inserted': 0,
+            'rejected': 0,
+            'batches': 0,
+            'flush_failures': 0,
+            'values': 0
+        }
+
+    async def start(self, spool_directory=None):
+        """Reads the 'INGST' configuration, opens the spool (if enabled)
+        and starts the flushing task
+
+        Args:
+            spool_directory (str): Overrides the spool directory set in
+                foglamp-env.yaml, so that processes do not share a spool
+        """
+        if self._task is not None:
+            return
+
+        try:
+            config = await configuration.get(_CONFIGURATION_KEY, _DEFAULT_CONFIGURATION)
+        except Exception:
+            _logger.exception('Unable to read the %s configuration. Using defaults.',
+                              _CONFIGURATION_KEY)
+            config = _DEFAULT_CONFIGURATION
+
+        self.configure(config)
+        configuration.cache.subscribe(_CONFIGURATION_KEY, self.configure, _DEFAULT_CONFIGURATION)
+
+        spool_settings = dict((env.config or {}).get('spool') or {})
+        if spool_directory is not None:
+            spool_settings['directory'] = spool_directory
+
+        disk_queue = spool.create(spool_settings)
+
+        if disk_queue is not None:
+            # Readings added before start() move to the spool
+            disk_queue.extend(self._queue.peek(len(self._queue)))
+            self._queue = disk_queue
+
+        if len(self._queue):
+            self._oldest = time.monotonic()
+
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+        _logger.info('Readings buffer started: batch_size=%s max_latency=%s spool=%s',
+                     self.batch_size, self.max_latency, disk_queue is not None)
+
+    def configure(self, config):
+        """Applies 'INGST' settings"""
+        self.batch_size = int(config['batch_size'])
+        self.max_latency = float(config['max_latency'])
+        self.high_watermark = int(config['high_watermark'])
+        self.low_watermark = int(config['low_watermark'])
+        self.flatten_values = bool(config['flatten_values'])
+
+        if self._wakeup is not None:
+            # The flushing task recomputes its timeout
+            self._wakeup.set()
+
+    async def stop(self):
+        """Flushes buffered readings and stops the flushing task"""
+        if self._task is None:
+            return
+
+        configuration.cache.unsubscribe(_CONFIGURATION_KEY, self.configure)
+
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+
+        self._queue.close()
+
+    def add(self, asset_code, user_ts, reading, read_key=None):
+        """Buffers a reading. Returns as soon as the reading is in
+        memory (or in the spool); it is written by the flushing task.
+
+        Args:
+            asset_code (str): The asset the reading belongs to
+            user_ts: The timestamp supplied by the device
+            reading (dict): The sensor values
+            read_key (:obj:`str`, optional): A UUID used to detect duplicates
+
+        Raises:
+            foglamp.storage.spool.RecordTooLarge: The reading does not
+                fit in a spool segment
+        """
+        self._queue.append({'asset_code': asset_code,
+                            'read_key': read_key,
+                            'user_ts': user_ts,
+                            'reading': reading})
+        self._added(1)
+
+    def add_many(self, rows):
+        """Buffers several readings at once
+
+        Args:
+            rows (list): dicts with the same keys as the arguments of :meth:`add`
+        """
+        if not rows:
+            return
+
+        self._queue.extend([{'asset_code': row['asset_code'],
+                             'read_key': row.get('read_key'),
+                             'user_ts': row['user_ts'],
+                             'reading': row['reading']} for row in rows])
+        self._added(len(rows))
+
+    def is_full(self):
+        """Returns True from the time high_watermark readings are pending
+        until the backlog has drained to low_watermark. Ingest handlers
+        refuse readings while the buffer is full.
+        """
+        pending = len(self._queue)
+
+        if self._full:
+            if pending <= self.low_watermark:
+                self._full = False
+                _logger.info('Readings buffer accepting readings again: %s pending', pending)
+        elif pending >= self.high_watermark:
+            self._full = True
+            _logger.warning('Readings buffer is full: %s pending', pending)
+
+        return self._full
+
+    def stats(self):
+        """Returns counters and the number of buffered readings as a dict"""
+        result = dict(self._counters)
+        result['pending'] = len(self._queue)
+        result['full'] = self._full
+        return result
+
+    def _added(self, count):
+        pending = len(self._queue)
+
+        if pending == count:
+            self._oldest = time.monotonic()
+
+        self._counters['added'] += count
+
+        if self._wakeup is not None and \
+                (pending == count or pending >= self.batch_size):
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            await self._wait_for_batch()
+
+            if not len(self._queue):
+                if self._stopping:
+                    return
+                continue
+
+            batch = self._queue.peek(self.batch_size)
+            failed = await self._flush(batch)
+            self._queue.consume(len(batch) - len(failed))
+
+            if len(self._queue):
+                self._oldest = time.monotonic()
+
+            if failed:
+                if self._stopping:
+                    _logger.error('Stopping with %s readings that were not written',
+                                  len(self._queue))
+                    return
+
+                await asyncio.sleep(_RETRY_SECONDS)
+
+    async def _wait_for_batch(self):
+        """Returns when the batch is full, when the oldest reading
+        is max_latency seconds old or when stop() is called
+        """
+        while not self._stopping:
+            pending = len(self._queue)
+
+            if not pending:
+                timeout = None
+            elif pending >= self.batch_size:
+                return
+            else:
+                timeout = self._oldest + self.max_latency - time.monotonic()
+                if timeout <= 0:
+                    return
+
+            self._wakeup.clear()
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                return
+
+    async def _flush(self, batch):
+        """Inserts a batch with one multi-row INSERT
+
+        Returns:
+            list: Rows that were not inserted and should be retried
+        """
+        try:
+            async with pool.acquire() as conn:
+                started = time.monotonic()
+                await self._write(conn, batch)
+                _insert_seconds.observe(time.monotonic() - started)
+        except (psycopg2.DataError, psycopg2.IntegrityError):
+            # One malformed row must not hold back the rest
+            return await self._flush_rows(batch)
+        except Exception:
+            self._counters['flush_failures'] += 1
+            _logger.exception('Unable to insert %s readings', len(batch))
+            return batch
+
+        self._counters['batches'] += 1
+        self._counters['inserted'] += len(batch)
+        return []
+
+    async def _flush_rows(self, batch):
+        """Inserts rows one at a time, dropping rows the database rejects
+
+        Returns:
+            list: Rows that were not inserted and should be retried
+        """
+        index = 0
+
+        try:
+            async with pool.acquire() as conn:
+                for index, row in enumerate(batch):
+                    try:
+                        await self._write(conn, [row])
+                        self._counters['inserted'] += 1
+                    except (psycopg2.DataError, psycopg2.IntegrityError):
+                        self._counters['rejected'] += 1
+                        _logger.exception('Rejected reading:\n%s', row)
+        except Exception:
+            self._counters['flush_failures'] += 1
+            _logger.exception('Unable to insert %s readings', len(batch) - index)
+            return batch[index:]
+
+        self._counters['batches'] += 1
+        return []
+
+    async def _write(self, conn, rows):
+        """Inserts readings and, with flatten_values, their values"""
+        if not self.flatten_values:
+            async with conn.begin():
+                await conn.execute(_IN_FLIGHT_STATEMENT)
+                await conn.execute(self._insert_statement(rows))
+            return
+
+        # New paths are interned first, so that they are never cached
+        # with an id that a rolled back transaction added
+        point_values = await reading_values.point_values(conn, rows)
+
+        async with conn.begin():
+            await conn.execute(_IN_FLIGHT_STATEMENT)
+
+            result = await conn.execute(_IDS_STATEMENT, count=len(rows))
+            rows = [dict(row, id=id) for row, (id,) in zip(rows, await result.fetchall())]
+            await conn.execute(self._insert_statement(rows))
+
+            inserted = {row['id'] for row in rows}
+            if any(row['read_key'] is not None for row in rows):
+                inserted = await self._inserted_ids(conn, inserted)
+
+            values = reading_values.rows(rows, point_values, inserted)
+            if values:
+                await conn.execute(reading_values.insert_statement(values))
+
+        self._counters['values'] += len(values)
+
+    @staticmethod
+    async def _inserted_ids(conn, ids):
+        """Returns the ids that the readings insert stored, leaving out
+        the rows skipped because their read_key exists"""
+        result = await conn.execute(sa.select([_readings_tbl.c.id]).where(_readings_tbl.c.id.in_(sorted(ids))))
+        return {row['id'] for row in await result.fetchall()}
+
+    @staticmethod
+    def _insert_statement(rows):
+        return insert(_readings_tbl).values(rows).on_conflict_do_nothing(
+            index_elements=['read_key'])
+
+
+buffer = ReadingsBuffer()
+"""The buffer shared by all ingest handlers"""
+
+_insert_seconds = metrics.registry.histogram(
+    'foglamp_readings_insert_seconds', 'Time to insert a batch of readings')
+
+metrics.registry.stats('foglamp_readings', lambda: buffer.stats(),
+                       counters=('added', 'inserted', 'rejected', 'batches', 'flush_failures', 'values'))
+
+
+async def committed_id(conn):
+    """Returns an id such that every reading up to it has been committed
+    or never will be
+
+    The sequence is read before the locks: a transaction that locks
+    after that draws greater ids, and one that unlocks before the locks
+    are read has committed before the readings are.
+    """
+    result = await conn.execute(_LAST_ID_STATEMENT)
+    last_id = await result.scalar()
+    result = await conn.execute(_LOCKS_STATEMENT)
+    in_flight = await result.scalar()
+    return last_id if in_flight is None else min(last_id, in_flight)
+
+
+async def recent_read_keys(limit):
+    """Returns the most recently inserted read keys
+
+    Args:
+        limit (int): Maximum number of keys
+
+    Returns:
+        list: (read_key, ts) tuples, newest first
+    """
+    query = sa.select([_readings_tbl.c.read_key, _readings_tbl.c.ts]).where(
+        _readings_tbl.c.read_key.isnot(None)).order_by(
+        _readings_tbl.c.id.desc()).limit(limit)
+
+    async with pool.acquire() as conn:
+        result = await conn.execute(query)
+        return [(str(row[0]), row[1]) for row in await result.fetchall()]
@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Reads an asset's readings from foglamp.readings in user_ts order
+
+Pages are selected by keyset rather than by OFFSET: a page starts after
+the (user_ts, id) of the last row of the previous page, so every page
+is a range scan of the readings_ix2 index on (asset_code, user_ts, id)
+no matter how deep into the readings it is.
+
+Rows are read through a server-side cursor ``fetch_size`` rows at a
+time, so a page of a million rows never has to fit in memory.
+
+Example:
+    ::
+
+        async with ReadingsQuery('mouse', start=start, limit=10000) as query:
+            async for rows in query:
+                ...
+        next_page = query.last_key
+
+:func:`summarize` aggregates numeric values inside ``reading`` into
+fixed-width time buckets in the database, so its result grows with the
+number of buckets rather than with the number of readings. :func:`lttb`
+downsamples its result for plotting.
+"""
+
+import datetime
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import JSONB, UUID
+
+from foglamp.storage import pool
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+_readings_tbl = sa.Table(
+    'readings',
+    sa.MetaData(),
+    sa.Column('id', sa.types.BIGINT, primary_key=True),
+    sa.Column('asset_code', sa.types.VARCHAR(50)),
+    sa.Column('read_key', UUID),
+    sa.Column('user_ts', sa.types.TIMESTAMP(timezone=True)),
+    sa.Column('reading', JSONB),
+    sa.Column('ts', sa.types.TIMESTAMP(timezone=True)),
+    schema='foglamp')
+"""Defines the table that readings are read from"""
+
+_CURSOR = 'foglamp_readings_query'
+
+DEFAULT_FETCH_SIZE = 500
+"""Rows read from the server-side cursor at a time"""
+
+_dialect = postgresql.dialect()
+
+MAX_BUCKETS = 10000
+"""Most buckets :func:`summarize` returns"""
+
+MAX_PATHS = 10
+"""Most JSON paths :func:`summarize` aggregates at once"""
+
+_SUMMARY_COLUMNS = """
+    count(v{i}) AS count_{i},
+    min(v{i}) AS min_{i},
+    max(v{i}) AS max_{i},
+    avg(v{i}) AS avg_{i},
+    avg(t) FILTER (WHERE v{i} IS NOT NULL) AS avg_t_{i},
+    min(ARRAY[t, v{i}]) FILTER (WHERE v{i} IS NOT NULL) AS first_{i},
+    max(ARRAY[t, v{i}]) FILTER (WHERE v{i} IS NOT NULL) AS last_{i},
+    min(ARRAY[v{i}, t]) FILTER (WHERE v{i} IS NOT NULL) AS min_point_{i},
+    max(ARRAY[v{i}, t]) FILTER (WHERE v{i} IS NOT NULL) AS max_point_{i}"""
+
+_SUMMARY_VALUE = """
+        CASE WHEN jsonb_typeof(reading #> :path_{i}) = 'number'
+             THEN (reading #>> :path_{i})::double precision END AS v{i}"""
+
+_SUMMARY = """
+SELECT bucket, count(*) AS row_count,{columns}
+  FROM (SELECT floor(extract(epoch FROM user_ts - :start) / :width)::bigint AS bucket,
+               extract(epoch FROM user_ts) AS t,{values}
+          FROM foglamp.readings
+         WHERE asset_code = :asset_code AND user_ts >= :start AND user_ts < :end) AS r
+ GROUP BY bucket
+ ORDER BY bucket"""
+"""Arrays of (time, value) or (value, time) carry the time of the first,
+last, smallest and largest value of each bucket through min() and max(),
+which need no more memory per bucket than a number would"""
+
+
+class ReadingsQuery(object):
+    """An asset's readings in (user_ts, id) order
+
+    An async context manager that holds a pooled connection and a
+    transaction while the rows are read, and an async iterator that
+    yields lists of up to ``fetch_size`` rows.
+
+    Attributes:
+        last_key (tuple): (user_ts, id) of the last row read, or None.
+            Pass it as ``after`` to read the next page.
+        count (int): Rows read so far
+    """
+
+    def __init__(self, asset_code, start=None, end=None, after=None, limit=None,
+                 fetch_size=DEFAULT_FETCH_SIZE):
+        """
+        Args:
+            start (datetime): Earliest user_ts (inclusive)
+            end (datetime): Latest user_ts (exclusive)
+            after (tuple): (user_ts, id) of the last row of the previous page
+            limit (int): Maximum number of rows
+        """
+        self.asset_code = asset_code
+        self.start = start
+        self.end = end
+        self.after = after
+        self.limit = limit
+        self.fetch_size = fetch_size
+        self.last_key = None
+        self.count = 0
+        self._acquire = None
+        self._conn = None
+        self._transaction = None
+
+    def statement(self):
+        """Returns the SELECT statement"""
+        tbl = _readings_tbl
+        query = sa.select([tbl.c.id, tbl.c.read_key, tbl.c.reading, tbl.c.user_ts, tbl.c.ts]).where(
+            tbl.c.asset_code == self.asset_code)
+
+        if self.start is not None:
+            query = query.where(tbl.c.user_ts >= self.start)
+        if self.end is not None:
+            query = query.where(tbl.c.user_ts < self.end)
+        if self.after is not None:
+            query = query.where(sa.tuple_(tbl.c.user_ts, tbl.c.id) > sa.tuple_(*self.after))
+
+        query = query.order_by(tbl.c.user_ts, tbl.c.id)
+
+        if self.limit is not None:
+            query = query.limit(self.limit)
+
+        return query
+
+    async def __aenter__(self):
+        compiled = self.statement().compile(dialect=_dialect)
+
+        self._acquire = pool.acquire()
+        self._conn = await self._acquire.__aenter__()
+
+        try:
+            # A cursor only lives as long as the transaction it is declared in
+            self._transaction = await self._conn.begin()
+            await self._conn.execute(
+                'DECLARE {} NO SCROLL CURSOR FOR {}'.format(_CURSOR, compiled), compiled.params)
+        except BaseException as e:
+            await self._close(type(e), e, e.__traceback__)
+            raise
+
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self._close(exc_type, exc_val, exc_tb)
+
+    async def _close(self, exc_type, exc_val, exc_tb):
+        try:
+            if self._transaction is not None:
+                # Nothing was written, so the transaction is always rolled back
+                await self._transaction.rollback()
+        finally:
+            acquire = self._acquire
+            self._transaction = None
+            self._acquire = None
+            self._conn = None
+            await acquire.__aexit__(exc_type, exc_val, exc_tb)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._conn is None:
+            raise StopAsyncIteration
+
+        result = await self._conn.execute('FETCH FORWARD {} FROM {}'.format(self.fetch_size, _CURSOR))
+        rows = await result.fetchall()
+
+        if not rows:
+            raise StopAsyncIteration
+
+        self.count += len(rows)
+        self.last_key = (rows[-1]['user_ts'], rows[-1]['id'])
+        return rows
+
+
+def _summary_statement(paths):
+    indexes = range(len(paths))
+    return _SUMMARY.format(columns=','.join(_SUMMARY_COLUMNS.format(i=i) for i in indexes),
+                           values=','.join(_SUMMARY_VALUE.format(i=i) for i in indexes))
+
+
+def _timestamp(epoch):
+    return datetime.datetime.fromtimestamp(epoch, datetime.timezone.utc)
+
+
+async def summarize(asset_code, start, end, bucket_seconds, paths):
+    """Aggregates numbers in an asset's readings by user_ts bucket
+
+    Args:
+        start (datetime): Start of the first bucket
+        end (datetime): Latest user_ts (exclusive)
+        bucket_seconds (float): Width of a bucket
+        paths (list): Dotted paths of numbers inside ``reading``, for
+            example 'temperature.value'. Readings where a path is
+            missing or not a number are left out of that path's values.
+
+    Returns:
+        list: A dict for each bucket that has readings, in time order::
+
+            {
+                'start': datetime,
+                'rows': 60,
+                'values': {
+                    'temperature.value': {
+                        'count': 60, 'min': 20.5, 'max': 21.0, 'avg': 20.7,
+                        'first': (datetime, 20.5), 'last': (datetime, 21.0),
+                        'min_point': (datetime, 20.5), 'max_point': (datetime, 21.0),
+                        'avg_ts': datetime
+                    }
+                }
+            }
+
+        A path with no numbers in a bucket is missing from its 'values'.
+
+    Raises:
+        ValueError: The arguments would return more than
+            :data:`MAX_BUCKETS` buckets or aggregate more than
+            :data:`MAX_PATHS` paths
+    """
+    if not paths or len(paths) > MAX_PATHS:
+        raise ValueError('between 1 and {} paths are required'.format(MAX_PATHS))
+    if not 0 < bucket_seconds < float('inf'):
+        raise ValueError('bucket must be a positive number of seconds')
+    if (end - start).total_seconds() / bucket_seconds > MAX_BUCKETS:
+        raise ValueError('the range must be at most {} buckets'.format(MAX_BUCKETS))
+
+    params = {'asset_code': asset_code, 'start': start, 'end': end, 'width': bucket_seconds}
+    for i, path in enumerate(paths):
+        params['path_{}'.format(i)] = path.split('.')
+
+    async with pool.acquire() as conn:
+        result = await conn.execute(sa.text(_summary_statement(paths)), params)
+        rows = await result.fetchall()
+
+    buckets = []
+
+    for row in rows:
+        values = {}
+
+        for i, path in enumerate(paths):
+            if not row['count_{}'.format(i)]:
+                continue
+
+            first, last, min_point, max_point = (
+                row['{}_{}'.format(name, i)] for name in ('first', 'last', 'min_point', 'max_point'))
+            values[path] = {
+                'count': row['count_{}'.format(i)],
+                'min': row['min_{}'.format(i)],
+                'max': row['max_{}'.format(i)],
+                'avg': row['avg_{}'.format(i)],
+                'avg_ts': _timestamp(row['avg_t_{}'.format(i)]),
+                'first': (_timestamp(first[0]), first[1]),
+                'last': (_timestamp(last[0]), last[1]),
+                'min_point': (_timestamp(min_point[1]), min_point[0]),
+                'max_point': (_timestamp(max_point[1]), max_point[0])
+            }
+
+        buckets.append({
+            'start': start + datetime.timedelta(seconds=row['bucket'] * bucket_seconds),
+            'rows': row['row_count'],
+            'values': values
+        })
+
+    return buckets
+
+
+def _doubled_area(a_t, a_value, point, c_t, c_value):
+    """Returns twice the area of the triangle between (a_t, a_value),
+    a (datetime, value) point and (c_t, c_value)"""
+    return abs((a_t - c_t) * (point[1] - a_value) - (a_t - point[0].timestamp()) * (c_value - a_value))
+
+
+def lttb(buckets, path):
+    """Picks one point per bucket for plotting a path, with
+    Largest-Triangle-Three-Buckets
+
+    The candidates in each bucket are its first, last, smallest and
+    largest value (which are all a line chart of the bucket can show);
+    the one that makes the largest triangle with the point picked for
+    the previous bucket and the average of the next bucket is picked.
+    The first and last buckets keep their first and last points.
+
+    Args:
+        buckets (list): As returned by :func:`summarize`
+
+    Returns:
+        list: (datetime, value) tuples in time order
+    """
+    summaries = [bucket['values'][path] for bucket in buckets if path in bucket['values']]
+
+    if len(summaries) < 3:
+        points = []
+        for summary in summaries:
+            points.extend(sorted({summary['first'], summary['last']}))
+        return points
+
+    points = [summaries[0]['first']]
+
+    for index in range(1, len(summaries) - 1):
+        a_ts, a_value = points[-1]
+        a_t = a_ts.timestamp()
+        following = summaries[index + 1]
+        c_t = following['avg_ts'].timestamp()
+        c_value = following['avg']
+
+        summary = summaries[index]
+        candidates = (summary['first'], summary['min_point'], summary['max_point'], summary['last'])
+
+        areas = [_doubled_area(a_t, a_value, point, c_t, c_value) for point in candidates]
+        points.append(candidates[areas.index(max(areas))])
+
+    points.append(summaries[-1]['last'])
+    return points
@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Append-only on-disk spool for readings that have not been written
+to foglamp.readings yet
+
+The spool lets the ingest handlers acknowledge a reading as soon as it
+is on local disk. While the database is slow or down, readings
+accumulate in the spool instead of being lost, and the readings
+buffer's flushing task replays them in order once it is back.
+
+The spool is a directory of fixed-size segment files that are memory
+mapped. Each record is::
+
+    length (4 bytes, big endian) | crc32 (4 bytes, big endian) | CBOR row
+
+A zero length marks the end of the written part of a segment. The
+position of the first reading that has not been written to the
+database is stored in the 'checkpoint' file; segments before it are
+deleted.
+
+The spool is configured by the optional ``spool`` section of
+foglamp-env.yaml::
+
+    spool:
+      enabled: true
+      directory: ~/var/spool/foglamp
+      segment_size: 16777216
+      fsync: interval
+      fsync_interval: 1
+
+fsync is one of:
+
+- always: Segments are flushed to disk after every append. Nothing is
+  lost if the machine loses power, at the cost of one msync per request.
+- interval: Segments are flushed at most every fsync_interval seconds
+- never: The operating system decides when to write pages to disk.
+  Readings survive a FogLAMP crash but not a power loss.
+"""
+
+import asyncio
+import logging
+import mmap
+import os
+import struct
+import zlib
+
+from cbor2 import dumps, loads
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    'enabled': False,
+    'directory': '~/var/spool/foglamp',
+    'segment_size': 16 * 1024 * 1024,
+    'fsync': 'interval',
+    'fsync_interval': 1
+}
+"""Used for settings missing from the 'spool' section of foglamp-env.yaml"""
+
+FSYNC_POLICIES = ('always', 'interval', 'never')
+
+_HEADER = struct.Struct('>II')
+_SEGMENT_SUFFIX = '.seg'
+_CHECKPOINT_FILE = 'checkpoint'
+
+
+class RecordTooLarge(ValueError):
+    """Raised when an encoded reading does not fit in a segment"""
+    pass
+
+
+class _Segment(object):
+    """A memory mapped segment file"""
+
+    def __init__(self, path, number, size):
+        self.path = path
+        self.number = number
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o640)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self.map = mmap.mmap(fd, 0)
+        finally:
+            os.close(fd)
+
+        self.end = self._find_end()
+        """Offset after the last valid record"""
+
+    def _find_end(self):
+        """Skips valid records. A torn record left by a crash ends the segment."""
+        offset = 0
+        size = len(self.map)
+
+        while offset + _HEADER.size <= size:
+            length, crc = _HEADER.unpack_from(self.map, offset)
+            start = offset + _HEADER.size
+
+            if length == 0 or start + length > size or \
+                    zlib.crc32(self.map[start:start + length]) != crc:
+                break
+
+            offset = start + length
+
+        return offset
+
+    def has_room(self, length):
+        # Leave room for the zero length that marks the end
+        return self.end + _HEADER.size + length + _HEADER.size <= len(self.map)
+
+    def append(self, data):
+        start = self.end + _HEADER.size
+        self.map[start:start + len(data)] = data
+        # Write the header last so a torn write is never mistaken for a record
+        _HEADER.pack_into(self.map, self.end, len(data), zlib.crc32(data))
+        self.end = start + len(data)
+
+    def read(self, offset):
+        """Returns (data, next offset) or (None, offset) at the end"""
+        if offset >= self.end:
+            return None, offset
+
+        length, _ = _HEADER.unpack_from(self.map, offset)
+        start = offset + _HEADER.size
+        return self.map[start:start + length], start + length
+
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        self.map.close()
+
+
+class Spool(object):
+    """A FIFO of readings stored in memory mapped segment files
+
+    Readings are read with :meth:`peek` and removed with :meth:`consume`
+    once they have been written to the database, so a reading is never
+    removed before it is stored.
+    """
+
+    def __init__(self, directory, segment_size=DEFAULT_SETTINGS['segment_size'],
+                 fsync=DEFAULT_SETTINGS['fsync'],
+                 fsync_interval=DEFAULT_SETTINGS['fsync_interval']):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError('fsync must be one of {}'.format(', '.join(FSYNC_POLICIES)))
+
+        self._directory = os.path.expanduser(directory)
+        self._segment_size = segment_size
+        self._fsync = fsync
+        self._fsync_interval = fsync_interval
+        self._sync_handle = None
+
+        os.makedirs(self._directory, 0o750, exist_ok=True)
+
+        self._segments = [self._open_segment(number) for number in self._segment_numbers()]
+
+        self._read_number, self._read_offset = self._read_checkpoint()
+        self._delete_consumed_segments()
+
+        if not self._segments:
+            self._segments.append(self._open_segment(self._read_number))
+
+        self._peeked = []
+        """(segment number, offset) after each record returned by the last peek()"""
+
+        self._length = self._count()
+
+        if self._length:
+            _logger.info('Spool %s holds %s readings', self._directory, self._length)
+
+    def __len__(self):
+        """Returns the number of readings that have not been consumed"""
+        return self._length
+
+    def append(self, row):
+        """Appends a reading (a dict)
+
+        Raises:
+            RecordTooLarge: The encoded reading is larger than a segment
+        """
+        self._append(self._encode(row))
+        self._written()
+
+    def extend(self, rows):
+        """Appends several readings with at most one flush to disk. Either
+        all readings are appended or, if one is too large, none are.
+        """
+        for data in [self._encode(row) for row in rows]:
+            self._append(data)
+        self._written()
+
+    def peek(self, count):
+        """Returns up to ``count`` of the oldest readings without removing them"""
+        rows = []
+        self._peeked = []
+
+        number, offset = self._read_number, self._read_offset
+        index = self._segment_index(number)
+
+        if index < len(self._segments) and self._segments[index].number != number:
+            offset = 0
+
+        while len(rows) < count and index < len(self._segments):
+            segment = self._segments[index]
+            data, offset = segment.read(offset)
+
+            if data is None:
+                index += 1
+                offset = 0
+                continue
+
+            rows.append(loads(data))
+            self._peeked.append((segment.number, offset))
+
+        return rows
+
+    def consume(self, count):
+        """Removes the first ``count`` readings returned by the last :meth:`peek`"""
+        if count <= 0:
+            return
+
+        self._read_number, self._read_offset = self._peeked[count - 1]
+        del self._peeked[:count]
+        self._length -= count
+
+        self._write_checkpoint()
+        self._delete_consumed_segments()
+
+    def close(self):
+        """Flushes and unmaps all segments"""
+        if self._sync_handle is not None:
+            self._sync_handle.cancel()
+            self._sync_handle = None
+
+        for segment in self._segments:
+            segment.flush()
+            segment.close()
+
+        self._segments = []
+
+    def _encode(self, row):
+        data = dumps(row)
+
+        if len(data) + 2 * _HEADER.size > self._segment_size:
+            raise RecordTooLarge('A reading of {} bytes does not fit in a spool segment'
+                                 .format(len(data)))
+
+        return data
+
+    def _append(self, data):
+        segment = self._segments[-1]
+
+        if not segment.has_room(len(data)):
+            segment.flush()
+            segment = self._open_segment(segment.number + 1)
+            self._segments.append(segment)
+
+        segment.append(data)
+        self._length += 1
+
+    def _written(self):
+        if self._fsync == 'always':
+            self._segments[-1].flush()
+        elif self._fsync == 'interval' and self._sync_handle is None:
+            self._sync_handle = asyncio.get_event_loop().call_later(
+                self._fsync_interval, self._sync)
+
+    def _sync(self):
+        self._sync_handle = None
+        if self._segments:
+            self._segments[-1].flush()
+
+    def _segment_path(self, number):
+        return os.path.join(self._directory, '{:020d}{}'.format(number, _SEGMENT_SUFFIX))
+
+    def _segment_numbers(self):
+        return sorted(int(name[:-len(_SEGMENT_SUFFIX)])
+                      for name in os.listdir(self._directory)
+                      if name.endswith(_SEGMENT_SUFFIX))
+
+    def _open_segment(self, number):
+        return _Segment(self._segment_path(number), number, self._segment_size)
+
+    def _segment_index(self, number):
+        for index, segment in enumerate(self._segments):
+            if segment.number >= number:
+                return index
+        return len(self._segments)
+
+    def _read_checkpoint(self):
+        try:
+            with open(os.path.join(self._directory, _CHECKPOINT_FILE)) as f:
+                number, offset = f.read().split()
+                return int(number), int(offset)
+        except FileNotFoundError:
+            if self._segments:
+                return self._segments[0].number, 0
+            return 0, 0
+
+    def _write_checkpoint(self):
+        path = os.path.join(self._directory, _CHECKPOINT_FILE)
+        temp_path = path + '.tmp'
+
+        with open(temp_path, 'w') as f:
+            f.write('{} {}'.format(self._read_number, self._read_offset))
+            if self._fsync == 'always':
+                f.flush()
+                os.fsync(f.fileno())
+
+        os.replace(temp_path, path)
+
+    def _delete_consumed_segments(self):
+        # The segment being written to is never deleted
+        while len(self._segments) > 1 and self._segments[0].number < self._read_number:
+            segment = self._segments.pop(0)
+            segment.close()
+            os.remove(segment.path)
+
+        # Every reading has been consumed. Start the segment again
+        # so it does not grow until it is full.
+        if len(self._segments) == 1:
+            segment = self._segments[0]
+            if segment.number == self._read_number and self._read_offset == segment.end \
+                    and segment.end > 0:
+                segment.close()
+                os.remove(segment.path)
+                self._segments[0] = self._open_segment(segment.number + 1)
+                self._read_number, self._read_offset = segment.number + 1, 0
+                self._write_checkpoint()
+
+    def _count(self):
+        count = 0
+        number, offset = self._read_number, self._read_offset
+
+        for segment in self._segments[self._segment_index(number):]:
+            if segment.number != number:
+                offset = 0
+            while True:
+                data, offset = segment.read(offset)
+                if data is None:
+                    break
+                count += 1
+
+        return count
+
+
+def create(settings):
+    """Returns a :class:`Spool` configured by the 'spool' section of
+    foglamp-env.yaml or None if the spool is disabled
+
+    Args:
+        settings (dict): The 'spool' section (may be None)
+    """
+    settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+
+    if not settings['enabled']:
+        return None
+
+    return Spool(settings['directory'],
+                 segment_size=int(settings['segment_size']),
+                 fsync=settings['fsync'],
+                 fsync_interval=float(settings['fsync_interval']))
@@ -0,0 +1,530 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Sends readings north, to the destinations of foglamp.streams
+
+Each active stream of an active destination has a task that reads
+readings in id order from its last_object onwards, ``batch_size`` at a
+time. A batch is turned into one request body by the stream's transform
+(see :mod:`foglamp.streaming.transform`), compressed with gzip, and
+posted to the destination's URL. Encoding runs on a thread so that it
+does not hold up ingest on the event loop.
+
+A stream keeps up to ``max_in_flight`` batches posted at once, and a
+destination serves at most its own ``max_in_flight`` requests across its
+streams. A stream's last_object is only advanced past a batch once that
+batch and every batch before it have been accepted, with an UPDATE that
+never moves it backwards. When a stream has read every reading up to
+the last committed id, last_object moves there, so a stream filtered by
+asset code does not rescan readings of other assets. When a request
+fails, the stream starts again from last_object, so readings are sent at
+least once.
+
+A destination's properties hold::
+
+    {
+        "url": "https://pi-server/ingress/messages",
+        "producer_token": "...",            (OMF)
+        "index": "foglamp",                 (Elasticsearch)
+        "compression": "gzip",              (or "none")
+        "max_in_flight": 4
+    }
+
+A stream's object_filter may list the asset codes it sends as
+``{"asset_codes": ["mouse", ...]}``, and its properties may override
+``batch_size``.
+
+Streams send only while the 'status' of the 'STRMN' configuration row is
+not 'off' and the local time is in both its 'window' and the
+destination's active_window. A window is a list of "always" or
+"HH:MM-HH:MM" ranges, which may wrap past midnight.
+
+Ids are drawn when a reading is inserted, but transactions commit in
+any order, so a stream reads no id greater than the one returned by
+:func:`foglamp.storage.readings.committed_id`.
+"""
+
+import asyncio
+import collections
+import datetime
+import gzip
+import json
+import logging
+
+import aiohttp
+import sqlalchemy as sa
+
+from foglamp import metrics
+from foglamp.storage import configuration
+from foglamp.storage import pool
+from foglamp.storage import readings
+from foglamp.streaming.transform import compile_transform
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+_logger = logging.getLogger(__name__)
+
+_CONFIGURATION_KEY = 'STRMN'
+
+_DEFAULT_CONFIGURATION = {
+    'status': 'on',
+    'window': ['always'],
+    'batch_size': 5000,
+    'max_in_flight': 4,
+    'poll_interval': 1,
+    'timeout': 60,
+    'retry': 5,
+    'reload_interval': 60
+}
+"""Used for settings missing from the 'STRMN' configuration row
+
+- status: 'off' stops every stream
+- window: When streams send, see :func:`parse_window`
+- batch_size: Readings per request
+- max_in_flight: Requests a stream, or a destination, has posted at once
+- poll_interval: Seconds to wait for new readings when a stream has
+  sent them all, or while it is outside its window
+- timeout: Seconds a destination has to answer a request
+- retry: Seconds to wait after a failed request
+- reload_interval: Seconds between checks of the configuration and of
+  foglamp.streams for changes
+"""
+
+DESTINATION_OMF = 1
+DESTINATION_ELASTICSEARCH = 2
+"""Values of foglamp.destinations.type"""
+
+_metadata = sa.MetaData()
+
+_streams_tbl = sa.Table(
+    'streams',
+    _metadata,
+    sa.Column('id', sa.types.INT, primary_key=True),
+    sa.Column('last_object', sa.types.BIGINT),
+    sa.Column('ts', sa.types.TIMESTAMP(timezone=True)),
+    schema='foglamp')
+
+_STREAMS_STATEMENT = sa.text("""
+SELECT s.id, s.destination_id, s.properties, s.object_stream, s.object_filter, s.last_object,
+       d.type AS destination_type, d.properties AS destination_properties,
+       d.active_window AS destination_window
+  FROM foglamp.streams s
+  JOIN foglamp.destinations d ON d.id = s.destination_id
+ WHERE s.active AND d.active""")
+
+_READINGS_STATEMENT = """
+SELECT id, asset_code, read_key, user_ts, reading, ts
+  FROM foglamp.readings
+ WHERE id > :after AND id <= :last_id{assets}
+ ORDER BY id
+ LIMIT :batch_size"""
+
+_READINGS = sa.text(_READINGS_STATEMENT.format(assets=''))
+_ASSET_READINGS = sa.text(_READINGS_STATEMENT.format(assets=' AND asset_code = ANY(:asset_codes)'))
+
+_DEFINITION_COLUMNS = ('destination_id', 'properties', 'object_stream', 'object_filter',
+                       'destination_type', 'destination_properties', 'destination_window')
+"""A stream is restarted when one of these changes"""
+
+
+class SendError(Exception):
+    """A destination did not accept a batch"""
+
+
+def parse_window(window):
+    """Returns a window's (start, end) times, or None for always
+
+    Args:
+        window (list): "always" or "HH:MM-HH:MM" strings. Empty means always.
+
+    Raises:
+        ValueError: A range is not valid
+    """
+    if not window or 'always' in window:
+        return None
+
+    ranges = []
+    for entry in window:
+        try:
+            start, end = (datetime.datetime.strptime(value.strip(), '%H:%M').time()
+                          for value in entry.split('-'))
+        except (AttributeError, ValueError):
+            raise ValueError("'{}' is not 'always' or HH:MM-HH:MM".format(entry))
+        ranges.append((start, end))
+
+    return ranges
+
+
+def in_window(ranges, time):
+    """Whether ``time`` is in one of the ranges returned by :func:`parse_window`"""
+    if ranges is None:
+        return True
+
+    for start, end in ranges:
+        if start <= end:
+            if start <= time < end:
+                return True
+        elif time >= start or time < end:
+            return True
+
+    return False
+
+
+def _encode_omf(rows, transform, properties):
+    containers = collections.OrderedDict()
+    for row in rows:
+        containers.setdefault(row['asset_code'], []).append(transform(row))
+
+    return json.dumps([{'containerid': asset_code, 'values': values}
+                       for asset_code, values in containers.items()])
+
+
+def _encode_elasticsearch(rows, transform, properties):
+    index = properties.get('index', 'foglamp')
+    doc_type = properties.get('doc_type', 'reading')
+    lines = []
+
+    for row in rows:
+        # The reading's id as the document id makes resending a batch harmless
+        lines.append(json.dumps({'index': {'_index': index, '_type': doc_type, '_id': row['id']}}))
+        lines.append(json.dumps(transform(row)))
+
+    return '\n'.join(lines) + '\n'
+
+
+class _Destination(object):
+    """A row of foglamp.destinations"""
+
+    def __init__(self, id, type, properties, active_window, max_in_flight):
+        """
+        Raises:
+            ValueError: The row is not valid
+        """
+        properties = properties or {}
+
+        if type == DESTINATION_OMF:
+            self._encode = _encode_omf
+            self.headers = {
+                'Content-Type': 'application/json',
+                'producertoken': properties.get('producer_token', ''),
+                'messagetype': 'data',
+                'action': 'create',
+                'messageformat': 'JSON',
+                'omfversion': '1.0'
+            }
+        elif type == DESTINATION_ELASTICSEARCH:
+            self._encode = _encode_elasticsearch
+            self.headers = {'Content-Type': 'application/x-ndjson'}
+        else:
+            raise ValueError('destination {} has unknown type {}'.format(id, type))
+
+        if not properties.get('url'):
+            raise ValueError('destination {} has no url'.format(id))
+
+        self.id = id
+        self.type = type
+        self.url = properties['url']
+        self.properties = properties
+        self.compress = properties.get('compression', 'gzip') != 'none'
+        if self.compress:
+            self.headers['Content-Encoding'] = 'gzip'
+        self.window = parse_window(active_window)
+        self.semaphore = asyncio.Semaphore(int(properties.get('max_in_flight', max_in_flight)))
+
+    def encode(self, rows, transform):
+        """Returns the request body for a batch of rows"""
+        body = self._encode(rows, transform, self.properties).encode('utf-8')
+        if self.compress:
+            body = gzip.compress(body)
+        return body
+
+    async def check(self, response):
+        """Raises SendError unless ``response`` accepted the batch"""
+        if response.status >= 300:
+            raise SendError('destination {} answered {}: {}'.format(
+                self.id, response.status, (await response.text())[:200]))
+
+        if self.type == DESTINATION_ELASTICSEARCH:
+            # A bulk request answers 200 even when some documents failed
+            result = await response.json()
+            if result.get('errors'):
+                raise SendError('destination {} refused documents'.format(self.id))
+
+
+class _Stream(object):
+    """A row of foglamp.streams"""
+
+    def __init__(self, row, destination, batch_size):
+        """
+        Raises:
+            ValueError: The row is not valid
+        """
+        self.id = row['id']
+        self.destination = destination
+        self.transform = compile_transform(row['object_stream'])
+        self.asset_codes = (row['object_filter'] or {}).get('asset_codes')
+        self.batch_size = int((row['properties'] or {}).get('batch_size', batch_size))
+        self.last_object = row['last_object']
+
+    def encode(self, rows):
+        return self.destination.encode(rows, self.transform)
+
+
+async def _active_streams():
+    async with pool.acquire() as conn:
+        result = await conn.execute(_STREAMS_STATEMENT)
+        return await result.fetchall()
+
+
+async def _fetch(after, asset_codes, batch_size):
+    """Returns up to ``batch_size`` committed readings with an id greater
+    than ``after``, with no uncommitted reading between them
+
+    Returns:
+        tuple: (rows, last id). When there are fewer than ``batch_size``
+        rows, they are every reading of the stream up to the last id.
+    """
+    params = {'after': after, 'batch_size': batch_size}
+    statement = _READINGS
+
+    if asset_codes:
+        statement = _ASSET_READINGS
+        params['asset_codes'] = list(asset_codes)
+
+    async with pool.acquire() as conn:
+        params['last_id'] = await readings.committed_id(conn)
+        if params['last_id'] <= after:
+            return [], after
+
+        result = await conn.execute(statement, params)
+        return await result.fetchall(), params['last_id']
+
+
+async def _save_checkpoint(stream_id, last_object):
+    tbl = _streams_tbl
+    async with pool.acquire() as conn:
+        await conn.execute(tbl.update().where(
+            (tbl.c.id == stream_id) & (tbl.c.last_object < last_object)).values(
+            last_object=last_object, ts=sa.func.now()))
+
+
+class Streamer(object):
+    """Runs a task for each active stream"""
+
+    def __init__(self):
+        self._task = None
+        self._session = None
+        self._config = dict(_DEFAULT_CONFIGURATION)
+        self._window = None
+        self._streams = {}
+        """stream id -> (definition, task)"""
+        self._destinations = {}
+        """destination id -> (definition, _Destination), shared by its streams"""
+        self._counters = {'batches': 0, 'readings': 0, 'bytes': 0, 'failures': 0}
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        tasks = [task for _, task in self._streams.values()]
+        if self._task is not None:
+            tasks.append(self._task)
+
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.wait(tasks)
+
+        self._streams = {}
+        self._destinations = {}
+        self._task = None
+
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.reload()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                _logger.exception('Unable to read the streams')
+
+            await asyncio.sleep(float(self._config['reload_interval']))
+
+    async def reload(self):
+        """Starts, restarts and stops stream tasks to match foglamp.streams"""
+        self.configure(await configuration.get(_CONFIGURATION_KEY, _DEFAULT_CONFIGURATION))
+        configuration.cache.subscribe(_CONFIGURATION_KEY, self.configure, _DEFAULT_CONFIGURATION)
+        config = self._config
+
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+
+        rows = {row['id']: row for row in await _active_streams()}
+
+        for stream_id, (definition, task) in list(self._streams.items()):
+            row = rows.get(stream_id)
+            if row is None or _definition(row) != definition:
+                task.cancel()
+                del self._streams[stream_id]
+
+        for stream_id, row in rows.items():
+            if stream_id in self._streams:
+                continue
+
+            try:
+                destination = self._destination(row, int(config['max_in_flight']))
+                stream = _Stream(row, destination, int(config['batch_size']))
+            except ValueError as e:
+                _logger.error('Stream %s is not started: %s', stream_id, e)
+                continue
+
+            self._streams[stream_id] = (_definition(row), asyncio.ensure_future(self._stream(stream)))
+            _logger.info('Streaming to destination %s from reading %s', destination.id, stream.last_object)
+
+    def configure(self, config):
+        """Applies 'STRMN' settings. Changes to status and window apply
+        at once, the others when a stream next reads or is restarted.
+
+        Raises:
+            ValueError: The window is not valid
+        """
+        self._window = parse_window(config['window'])
+        self._config = config
+
+    def _destination(self, row, max_in_flight):
+        definition = (row['destination_type'], row['destination_properties'], row['destination_window'])
+        destination_id = row['destination_id']
+        known = self._destinations.get(destination_id)
+
+        if known is None or known[0] != definition:
+            known = (definition, _Destination(destination_id, *definition, max_in_flight=max_in_flight))
+            self._destinations[destination_id] = known
+
+        return known[1]
+
+    def _sending(self, destination):
+        if self._config['status'] == 'off':
+            return False
+
+        now = datetime.datetime.now().time()
+        return in_window(self._window, now) and in_window(destination.window, now)
+
+    async def _stream(self, stream):
+        loop = asyncio.get_event_loop()
+        # (last id, future) of the batches posted, in id order
+        pending = collections.deque()
+
+        while True:
+            after = stream.last_object
+
+            try:
+                while True:
+                    config = self._config
+                    rows = None
+
+                    if self._sending(stream.destination):
+                        rows, last_id = await _fetch(after, stream.asset_codes, stream.batch_size)
+
+                    if not rows:
+                        # Readings up to last_id are not in the stream, and a
+                        # filtered stream moves past them once the batches drain
+                        if rows is not None:
+                            after = last_id
+                        await self._checkpoint(stream, pending, wait=True, caught_up=after)
+                        await asyncio.sleep(float(config['poll_interval']))
+                        continue
+
+                    body = await loop.run_in_executor(None, stream.encode, rows)
+                    after = rows[-1]['id'] if len(rows) >= stream.batch_size else last_id
+                    pending.append((after, asyncio.ensure_future(
+                        self._send(stream.destination, body, len(rows), float(config['timeout'])))))
+
+                    if len(pending) >= int(config['max_in_flight']):
+                        await asyncio.wait([pending[0][1]])
+                    await self._checkpoint(stream, pending)
+            except asyncio.CancelledError:
+                _discard(pending)
+                raise
+            except Exception:
+                self._counters['failures'] += 1
+                retry = float(self._config['retry'])
+                _logger.exception('Stream %s failed. Resending from reading %s in %s seconds',
+                                  stream.id, stream.last_object, retry)
+
+                _discard(pending)
+                await asyncio.sleep(retry)
+
+    async def _send(self, destination, body, count, timeout):
+        async with destination.semaphore:
+            async with self._session.post(destination.url, data=body, headers=destination.headers,
+                                          timeout=timeout) as response:
+                await destination.check(response)
+
+        self._counters['batches'] += 1
+        self._counters['readings'] += count
+        self._counters['bytes'] += len(body)
+
+    async def _checkpoint(self, stream, pending, wait=False, caught_up=None):
+        """Advances last_object past the leading batches that were sent
+
+        Args:
+            wait: Waits for every batch to be sent first
+            caught_up: An id up to which every reading of the stream was
+                read. last_object moves to it once every batch is sent.
+
+        Raises:
+            Exception: What sending a batch raised
+        """
+        if wait and pending:
+            await asyncio.wait([future for _, future in pending])
+
+        last_object = None
+
+        while pending and pending[0][1].done():
+            last_id, future = pending.popleft()
+            future.result()
+            last_object = last_id
+
+        if not pending and caught_up is not None and caught_up > max(last_object or 0, stream.last_object):
+            last_object = caught_up
+
+        if last_object is not None:
+            await _save_checkpoint(stream.id, last_object)
+            stream.last_object = last_object
+
+    def stats(self):
+        result = dict(self._counters)
+        result['streams'] = len(self._streams)
+        return result
+
+
+def _discard(pending):
+    """Cancels the batches being sent, which will be sent again"""
+    for _, future in pending:
+        if future.done():
+            if not future.cancelled():
+                future.exception()
+        else:
+            future.cancel()
+    pending.clear()
+
+
+def _definition(row):
+    return tuple(row[column] for column in _DEFINITION_COLUMNS)
+
+
+service = Streamer()
+"""Sends readings to the destinations of foglamp.streams"""
+
+metrics.registry.stats('foglamp_streaming', service.stats,
+                       counters=('batches', 'readings', 'bytes', 'failures'))
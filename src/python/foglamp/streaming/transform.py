@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""Turns rows of foglamp.readings into the objects a stream sends
+
+A stream's object_stream column says which values each object has::
+
+    {
+        "fields": {
+            "Time": "user_ts",
+            "temperature": "reading.temperature.value"
+        },
+        "static": {"source": "gateway-1"}
+    }
+
+The first part of a field's path is a column of foglamp.readings (id,
+asset_code, read_key, user_ts, ts or reading), the rest are keys inside
+that column's JSON. Fields whose path is missing from a reading are
+left out of its object. Without 'fields', objects have the asset_code,
+read_key, user_ts and reading of the row.
+
+:func:`compile_transform` parses object_stream once, when the stream is
+started, into a function that only does dict lookups per row.
+"""
+
+import datetime
+import uuid
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__ = "Apache 2.0"
+__version__ = "${VERSION}"
+
+COLUMNS = ('id', 'asset_code', 'read_key', 'user_ts', 'ts', 'reading')
+"""Columns a field's path can start with"""
+
+_DEFAULT_FIELDS = {
+    'asset_code': 'asset_code',
+    'read_key': 'read_key',
+    'user_ts': 'user_ts',
+    'reading': 'reading'
+}
+
+_MISSING = object()
+
+
+def _json_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+def _getter(path):
+    """Returns a function that looks ``path`` up in a row"""
+    keys = path.split('.')
+    column = keys.pop(0)
+
+    if column not in COLUMNS:
+        raise ValueError("'{}' must start with one of {}".format(path, ', '.join(COLUMNS)))
+
+    if not keys:
+        return lambda row: _json_value(row[column])
+
+    def get(row):
+        value = row[column]
+        for key in keys:
+            if not isinstance(value, dict):
+                return _MISSING
+            value = value.get(key, _MISSING)
+            if value is _MISSING:
+                return _MISSING
+        return value
+
+    return get
+
+
+def compile_transform(object_stream):
+    """Returns a function that turns a row into an object to send
+
+    Args:
+        object_stream (dict): The object_stream of a foglamp.streams row
+
+    Raises:
+        ValueError: object_stream is not valid
+    """
+    object_stream = object_stream or {}
+    if not isinstance(object_stream, dict):
+        raise ValueError('object_stream must be an object')
+
+    fields = object_stream.get('fields') or _DEFAULT_FIELDS
+    static = object_stream.get('static') or {}
+
+    if not isinstance(fields, dict) or not isinstance(static, dict):
+        raise ValueError('fields and static must be objects')
+
+    for name, path in fields.items():
+        if not isinstance(path, str):
+            raise ValueError("The path of field '{}' must be a string".format(name))
+
+    getters = tuple((name, _getter(path)) for name, path in fields.items())
+
+    def transform(row):
+        result = dict(static)
+        for name, get in getters:
+            value = get(row)
+            if value is not _MISSING:
+                result[name] = value
+        return result
+
+    return transform
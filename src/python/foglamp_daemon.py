@@ -7,7 +7,7 @@ import logging
 import daemon
 from daemon import pidfile
 
-from foglamp.controller import start
+from foglamp.startup import profile
 
 
 def do_something(logf):
@@ -26,16 +26,19 @@ def do_something(logf):
     logger.addHandler(file_handler)
     logger.setLevel(logging.DEBUG)
 
+    # Imported after the import hook is installed
+    from foglamp.controller import start
     start()
 
 
-def start_daemon(pidf, logf, wdir):
+def start_daemon(pidf, logf, wdir, startup_profile=False):
     """
     Launches the daemon
 
     :param pidf: pidfile
     :param logf: log file
     :param wdir: working directory
+    :param startup_profile: log how long each startup phase and import takes
     """
 
     # XXX: pidfile is a context
@@ -44,6 +47,8 @@ def start_daemon(pidf, logf, wdir):
         umask=0o002,
         pidfile=pidfile.TimeoutPIDLockFile(pidf)
     ) as context:
+        if startup_profile:
+            profile.install()
         do_something(logf)
 
 
@@ -64,6 +69,8 @@ def main():
     parser.add_argument('-p', '--pid-file', default='~/var/run/foglamp.pid')
     parser.add_argument('-l', '--log-file', default='~/var/log/foglamp.log')
     parser.add_argument('-w', '--working-dir', default='~/var/log')
+    parser.add_argument('--startup-profile', action='store_true',
+                        help='log how long each startup phase and import takes')
 
     args = parser.parse_args()
 
@@ -74,7 +81,8 @@ def main():
     # TODO: ['start', 'stop', 'restart', 'status', 'info']
     start_daemon(pidf=os.path.expanduser(args.pid_file),
                  logf=os.path.expanduser(args.log_file),
-                 wdir=os.path.expanduser(args.working_dir))
+                 wdir=os.path.expanduser(args.working_dir),
+                 startup_profile=args.startup_profile)
 
 
 if __name__ == "__main__":
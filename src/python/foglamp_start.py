@@ -1,10 +1,36 @@
+import argparse
 import logging
-from foglamp.controller import start
+import sys
+
+from foglamp.startup import profile
+
 
 def main():
+    parser = argparse.ArgumentParser(description="FogLAMP")
+    parser.add_argument('--startup-profile', action='store_true',
+                        help='log how long each startup phase and import takes')
+
+    commands = parser.add_subparsers(dest='command')
+    create_user = commands.add_parser('create-user', help='add an admin API user and exit')
+    create_user.add_argument('name')
+    create_user.add_argument('--role-id', type=int, default=1,
+                             help='role of the user (default: 1, Power User)')
+    create_user.add_argument('--description', default='')
+
+    args = parser.parse_args()
+
+    if args.command == 'create-user':
+        from foglamp.admin_api import create_user as create_user_command
+        sys.exit(create_user_command.main(args.name, args.role_id, args.description))
+
+    if args.startup_profile:
+        profile.install()
+
     logging.basicConfig(level=logging.DEBUG)
     logging.getLogger("foglamp").setLevel(logging.DEBUG)
 
+    # Imported after the import hook is installed
+    from foglamp.controller import start
     start()
 
 
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+import time
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+
+import jwt
+import pytest
+
+from foglamp.admin_api import auth
+from foglamp.admin_api.auth import TokenCache
+from foglamp.admin_api.model import User
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__   = "Apache 2.0"
+__version__   = "${VERSION}"
+
+
+def _token(user_id=1, minutes=15):
+    payload = {'user_id': user_id, 'exp': datetime.utcnow() + timedelta(minutes=minutes), 'access': 1}
+    return jwt.encode(payload, auth.JWT_SECRET, auth.JWT_ALGORITHM).decode('utf-8')
+
+
+class TestTokenCache:
+    def test_get_put(self):
+        cache = TokenCache()
+        assert cache.get('a') is None
+        cache.put('a', {'user_id': 1, 'exp': time.time() + 60}, 'user')
+        payload, user = cache.get('a')
+        assert payload['user_id'] == 1
+        assert user == 'user'
+
+    def test_expired_entry_is_dropped(self):
+        cache = TokenCache()
+        cache.put('a', {'user_id': 1, 'exp': time.time() - 1}, 'user')
+        assert cache.get('a') is None
+        assert len(cache._entries) == 0
+
+    def test_least_recently_used_is_evicted(self):
+        cache = TokenCache(size=2)
+        exp = time.time() + 60
+        cache.put('a', {'user_id': 1, 'exp': exp}, 'user')
+        cache.put('b', {'user_id': 1, 'exp': exp}, 'user')
+        cache.get('a')
+        cache.put('c', {'user_id': 1, 'exp': exp}, 'user')
+        assert cache.get('a') is not None
+        assert cache.get('b') is None
+
+    def test_invalidate_user(self):
+        cache = TokenCache()
+        exp = time.time() + 60
+        cache.put('a', {'user_id': 1, 'exp': exp}, 'user1')
+        cache.put('b', {'user_id': 1, 'exp': exp}, 'user1')
+        cache.put('c', {'user_id': 2, 'exp': exp}, 'user2')
+        cache.invalidate_user(1)
+        assert cache.get('a') is None and cache.get('b') is None
+        assert cache.get('c') is not None
+
+
+class TestAuthMiddleware:
+    @pytest.mark.asyncio
+    async def test_verified_token_is_cached(self, mocker):
+        mocker.patch('foglamp.admin_api.auth.token_cache', new=TokenCache())
+        user = User(1, 'admin', 'password')
+        get_user = mocker.patch('foglamp.admin_api.model.User.objects.get', return_value=user)
+        decode = mocker.spy(jwt, 'decode')
+
+        async def handler(request):
+            return request.user
+
+        middleware = await auth.auth_middleware(None, handler)
+        token = _token()
+
+        for _ in range(3):
+            request = MagicMock(headers={'authorization': token})
+            assert await middleware(request) is user
+            assert request.jwt_payload['user_id'] == 1
+
+        assert decode.call_count == 1
+        assert get_user.call_count == 1
+
+    @pytest.mark.asyncio
+    async def test_expired_token_is_rejected(self, mocker):
+        mocker.patch('foglamp.admin_api.auth.token_cache', new=TokenCache())
+        middleware = await auth.auth_middleware(None, None)
+        response = await middleware(MagicMock(headers={'authorization': _token(minutes=-1)}))
+        assert response.status == 401
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+import io
+
+import psycopg2
+import pytest
+
+from foglamp.admin_api import create_user
+from foglamp.admin_api.model import User
+from tests.device_api.coap.test_sensor_values import async_mock
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__   = "Apache 2.0"
+__version__   = "${VERSION}"
+
+
+class _Terminal(io.StringIO):
+    def isatty(self):
+        return True
+
+
+@pytest.fixture
+def database(mocker):
+    mocker.patch('foglamp.env.load_config')
+    mocker.patch('foglamp.storage.pool.create', new=async_mock())
+    mocker.patch('foglamp.storage.pool.close', new=async_mock())
+
+
+class TestCreateUser:
+    def test_password_from_stdin(self):
+        assert create_user.read_password(io.StringIO('secret\n')) == 'secret'
+
+        with pytest.raises(create_user.PasswordError):
+            create_user.read_password(io.StringIO('\n'))
+
+    def test_password_must_be_confirmed(self, mocker):
+        mocker.patch('getpass.getpass', side_effect=['secret', 'typo'])
+
+        with pytest.raises(create_user.PasswordError):
+            create_user.read_password(_Terminal())
+
+    def test_main(self, database, mocker):
+        mocker.patch.object(create_user, 'read_password', return_value='secret')
+        calls = []
+
+        async def create(*args, **kwargs):
+            calls.append((args, kwargs))
+            return User(1, 'admin', 'hash')
+
+        mocker.patch.object(User.objects, 'create', new=create)
+
+        assert create_user.main('admin') == 0
+        assert calls == [(('admin', 'secret'), {'role_id': 1, 'description': ''})]
+
+    def test_existing_user(self, database, mocker):
+        mocker.patch.object(create_user, 'read_password', return_value='secret')
+        mocker.patch.object(User.objects, 'create', side_effect=psycopg2.IntegrityError())
+
+        assert create_user.main('admin') == 1
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+import json
+from unittest.mock import MagicMock
+
+import pytest
+
+from foglamp.admin_api.metrics import get_metrics
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__   = "Apache 2.0"
+__version__   = "${VERSION}"
+
+
+class TestGetMetrics:
+    @pytest.mark.asyncio
+    async def test_prometheus(self):
+        request = MagicMock(query={}, headers={})
+        response = await get_metrics(request)
+        assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+        assert '# TYPE foglamp_readings_insert_seconds histogram' in response.body.decode('utf-8')
+
+    @pytest.mark.asyncio
+    async def test_json(self):
+        request = MagicMock(query={'format': 'json'}, headers={})
+        response = await get_metrics(request)
+        body = json.loads(response.body.decode('utf-8'))
+        assert body['foglamp_coap_requests']['type'] == 'counter'
+        assert 'foglamp_pool_acquired' in body
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+import asyncio
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from foglamp.admin_api import auth
+from foglamp.admin_api import login
+from foglamp.admin_api import model
+from foglamp.admin_api import passwords
+from foglamp.admin_api.auth import TokenCache
+from foglamp.admin_api.model import User
+from tests.admin_api.test_auth import _token
+from tests.device_api.coap.test_sensor_values import async_mock
+from tests.storage.conftest import FakeConnection
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__   = "Apache 2.0"
+__version__   = "${VERSION}"
+
+
+def _row(id, uid, role_id=1, pwd='password', access_method=model.ACCESS_PASSWORD):
+    return {'id': id, 'uid': uid, 'role_id': role_id, 'description': '', 'pwd': pwd,
+            'access_method': access_method}
+
+
+@pytest.fixture
+def users(mocker):
+    """Empties the indexes and routes pool.acquire() to a FakeConnection"""
+    mocker.patch.object(User.objects, '_by_id', {})
+    mocker.patch.object(User.objects, '_by_name', {})
+    mocker.patch.object(User.objects, '_role_permissions', {})
+    connection = FakeConnection()
+    mocker.patch('foglamp.storage.pool.acquire', return_value=connection)
+    return connection
+
+
+class TestUsers:
+    @pytest.mark.asyncio
+    async def test_load(self, users):
+        users.results = [
+            [(1, 'PURGE_MGR ', {'access': 'set'})],
+            [(2, 'PURGE_MGR ', {'access': 'none'})],
+            [_row(1, 'admin'), _row(2, 'guest')]
+        ]
+        await User.objects.load()
+
+        assert User.objects.get(name='admin').id == 1
+        assert User.objects.get(id=2).name == 'guest'
+        assert User.objects.get(id=1).permissions == {'PURGE_MGR': {'access': 'set'}}
+        assert User.objects.get(id=2).permissions == {'PURGE_MGR': {'access': 'none'}}
+        assert len(User.objects.all()) == 2
+
+    def test_get(self, users):
+        User.objects._put(User(1, 'admin', 'password'))
+
+        assert User.objects.get(id=1, name='admin').id == 1
+        assert User.objects.filter(name='admin')[0].id == 1
+        assert User.objects.filter(id=1, name='guest') == []
+        with pytest.raises(User.DoesNotExist):
+            User.objects.get(name='guest')
+        with pytest.raises(User.DoesNotExist):
+            User.objects.get(id=1, name='guest')
+
+    @pytest.mark.asyncio
+    async def test_create(self, users, mocker):
+        mocker.patch.object(passwords.hasher, 'encode', new=async_mock(return_value='hash'))
+        users.results = [[(3,)], [_row(3, 'new')], []]
+        user = await User.objects.create('new', 'password')
+
+        assert user.id == 3
+        assert User.objects.get(name='new') is user
+        assert users.statements[0].compile().params['pwd'] == 'hash'
+
+    @pytest.mark.asyncio
+    async def test_rename_updates_name_index(self, users):
+        User.objects._put(User(1, 'admin', 'password'))
+        users.results = [None, [_row(1, 'root')], []]
+        await User.objects.update(1, name='root')
+
+        assert User.objects.get(name='root').id == 1
+        with pytest.raises(User.DoesNotExist):
+            User.objects.get(name='admin')
+
+    @pytest.mark.asyncio
+    async def test_deleted_user_is_dropped_on_notification(self, users):
+        User.objects._put(User(1, 'admin', 'password'))
+        users.results = [[]]
+        await User.objects._notified('1')
+
+        with pytest.raises(User.DoesNotExist):
+            User.objects.get(id=1)
+
+    @pytest.mark.asyncio
+    async def test_change_invalidates_cached_tokens(self, users, mocker):
+        cache = TokenCache()
+        mocker.patch('foglamp.admin_api.auth.token_cache', new=cache)
+        cache.put('token', {'user_id': 1, 'exp': time.time() + 60}, 'admin')
+
+        User.objects._put(User(1, 'admin', 'password'))
+        assert cache.get('token') is not None
+
+        users.results = [[_row(1, 'admin', pwd='changed')], []]
+        await User.objects.reload(1)
+        assert cache.get('token') is None
+
+    @pytest.mark.asyncio
+    async def test_disabled_user_cannot_log_in(self, mocker):
+        mocker.patch('foglamp.admin_api.passwords.needs_rehash', return_value=False)
+        encoded = passwords.encode('password', iterations=10)
+
+        user = User(1, 'admin', encoded, access_method=model.ACCESS_DISABLED)
+        with pytest.raises(User.PasswordDoesNotMatch):
+            await user.match_password('password')
+        await User(1, 'admin', encoded).match_password('password')
+
+    @pytest.mark.asyncio
+    async def test_password_is_rehashed(self, users, mocker):
+        updates = []
+
+        async def update(id, **values):
+            updates.append((id, values))
+
+        mocker.patch.object(User.objects, 'update', new=update)
+        user = User(1, 'admin', passwords.encode('password', iterations=10))
+
+        await user.match_password('password')
+        assert updates == [(1, {'password': 'password'})]
+
+        with pytest.raises(User.PasswordDoesNotMatch):
+            await user.match_password('wrong')
+
+
+class TestAuthMiddleware:
+    @pytest.mark.asyncio
+    async def test_unknown_user_is_rejected(self, users, mocker):
+        mocker.patch('foglamp.admin_api.auth.token_cache', new=TokenCache())
+        middleware = await auth.auth_middleware(None, None)
+        response = await middleware(MagicMock(headers={'authorization': _token(user_id=5)}))
+        assert response.status == 401
+
+    @pytest.mark.asyncio
+    async def test_disabled_user_is_rejected(self, users, mocker):
+        mocker.patch('foglamp.admin_api.auth.token_cache', new=TokenCache())
+
+        async def handler(request):
+            return request.user
+
+        middleware = await auth.auth_middleware(None, handler)
+        token = _token(user_id=1)
+        User.objects._put(User(1, 'admin', 'password'))
+        assert (await middleware(MagicMock(headers={'authorization': token}))).id == 1
+
+        # Disabling the user drops its cached tokens
+        users.results = [[_row(1, 'admin', access_method=model.ACCESS_DISABLED)], []]
+        await User.objects.reload(1)
+
+        response = await middleware(MagicMock(headers={'authorization': token}))
+        assert response.status == 401
+
+    @pytest.mark.asyncio
+    async def test_disabled_user_cannot_refresh(self):
+        request = MagicMock(jwt_payload={'user_id': 1, 'access': 0})
+        request.user = User(1, 'admin', 'password', access_method=model.ACCESS_DISABLED)
+
+        response = await login.refresh_token(request)
+        assert response.status == 401
+
+        request.user = User(1, 'admin', 'password')
+        response = await login.refresh_token(request)
+        assert response.status == 200
+
+
+class _Notifies:
+    async def get(self):
+        await asyncio.sleep(60)
+
+
+class _ListeningConnection:
+    def __init__(self, statements):
+        self.statements = statements
+        self.notifies = _Notifies()
+
+    def cursor(self):
+        return self
+
+    async def execute(self, statement):
+        self.statements.append(statement)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class TestListen:
+    @pytest.mark.asyncio
+    async def test_users_are_loaded_after_listen(self, mocker):
+        statements = []
+
+        async def load():
+            statements.append('load')
+
+        mocker.patch.object(User.objects, 'load', new=load)
+        mocker.patch('aiopg.connect', return_value=_ListeningConnection(statements))
+
+        task = asyncio.ensure_future(User.objects._listen())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        assert statements == ['LISTEN foglamp_users', 'load']
+
+
+class TestLogin:
+    @pytest.mark.asyncio
+    async def test_unknown_user_costs_a_password_check(self, users, mocker):
+        checked = []
+
+        async def check_unknown(password):
+            checked.append(password)
+            return False
+
+        mocker.patch.object(passwords.hasher, 'check_unknown', new=check_unknown)
+        request = MagicMock()
+
+        async def body():
+            return {'username': 'nobody', 'password': 'secret'}
+
+        request.json = body
+
+        response = await login.login(request)
+
+        assert response.status == 400
+        assert checked == ['secret']
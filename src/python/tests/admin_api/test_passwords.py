@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+import asyncio
+
+import pytest
+
+from foglamp.admin_api import passwords
+from foglamp.admin_api.passwords import HasherBusy, PasswordHasher
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__   = "Apache 2.0"
+__version__   = "${VERSION}"
+
+
+@pytest.fixture
+def cheap(mocker):
+    mocker.patch('foglamp.admin_api.passwords.settings',
+                 return_value=dict(passwords.DEFAULT_SETTINGS, iterations=10, workers=1, max_pending=2))
+
+
+class TestEncode:
+    def test_check(self, cheap):
+        encoded = passwords.encode('secret')
+        assert encoded.startswith('pbkdf2_sha256$10$')
+        assert passwords.check('secret', encoded)
+        assert not passwords.check('Secret', encoded)
+
+    def test_salted(self, cheap):
+        assert passwords.encode('secret') != passwords.encode('secret')
+
+    def test_unknown_format_does_not_match(self):
+        assert not passwords.check('secret', 'secret')
+        assert not passwords.check('secret', None)
+        assert not passwords.check('secret', 'md5$1$AA==$AA==')
+
+    def test_needs_rehash(self, cheap):
+        assert not passwords.needs_rehash(passwords.encode('secret'))
+        assert passwords.needs_rehash(passwords.encode('secret', iterations=20))
+        assert passwords.needs_rehash('secret')
+
+
+class TestPasswordHasher:
+    @pytest.mark.asyncio
+    async def test_encode_check(self, cheap):
+        hasher = PasswordHasher()
+        try:
+            encoded = await hasher.encode('secret')
+            assert await hasher.check('secret', encoded)
+            assert not await hasher.check('wrong', encoded)
+        finally:
+            hasher.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_check_unknown_costs_a_check(self, cheap, mocker):
+        check = mocker.spy(passwords, 'check')
+        hasher = PasswordHasher()
+        try:
+            assert not await hasher.check_unknown('secret')
+            assert not await hasher.check_unknown('secret')
+        finally:
+            hasher.shutdown()
+
+        assert check.call_count == 2
+        assert check.call_args[0][1].startswith('pbkdf2_sha256$10$')
+
+    @pytest.mark.asyncio
+    async def test_pending_hashes_are_capped(self, cheap, mocker):
+        started = asyncio.Event()
+        release = asyncio.Event()
+        loop = asyncio.get_event_loop()
+
+        def slow(password):
+            loop.call_soon_threadsafe(started.set)
+            asyncio.run_coroutine_threadsafe(release.wait(), loop).result()
+            return password
+
+        mocker.patch('foglamp.admin_api.passwords.encode', side_effect=slow)
+        hasher = PasswordHasher()
+        try:
+            first = asyncio.ensure_future(hasher.encode('a'))
+            second = asyncio.ensure_future(hasher.encode('b'))
+            await started.wait()
+            assert hasher.stats() == {'pending': 2}
+
+            with pytest.raises(HasherBusy):
+                await hasher.encode('c')
+
+            release.set()
+            assert await asyncio.gather(first, second) == ['a', 'b']
+            assert hasher.stats() == {'pending': 0}
+        finally:
+            hasher.shutdown()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+import asyncio
+import json
+from unittest.mock import MagicMock
+
+import pytest
+
+from foglamp.admin_api import profiling as profiling_handlers
+from foglamp.profiling import CpuProfiler
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__   = "Apache 2.0"
+__version__   = "${VERSION}"
+
+
+def _request(user=True):
+    request = MagicMock(has_body=False, jwt_payload={'access': 1})
+    request.user = MagicMock() if user else None
+    return request
+
+
+async def _call(handler, request):
+    # authentication_required returns a response without awaiting
+    # the handler when the request is not authenticated
+    response = handler(request)
+    if asyncio.iscoroutine(response):
+        response = await response
+    return response
+
+
+class TestProfilingHandlers:
+    @pytest.mark.asyncio
+    async def test_authentication_required(self):
+        response = await _call(profiling_handlers.start_cpu, _request(user=False))
+        assert response.status == 403
+
+    @pytest.mark.asyncio
+    async def test_cpu_profile(self, mocker):
+        mocker.patch('foglamp.profiling.cpu', new=CpuProfiler())
+
+        response = await _call(profiling_handlers.start_cpu, _request())
+        assert json.loads(response.body.decode('utf-8'))['running']
+
+        response = await _call(profiling_handlers.start_cpu, _request())
+        assert response.status == 409
+
+        response = await _call(profiling_handlers.stop_cpu, _request())
+        assert response.status == 200
+        assert response.content_type == 'text/plain'
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('interval', [0, -1, 0.0001])
+    async def test_short_interval_is_refused(self, mocker, interval):
+        profiler = mocker.patch('foglamp.profiling.cpu', new=CpuProfiler())
+        request = _request()
+        request.has_body = True
+
+        async def options():
+            return {'interval': interval}
+
+        request.json = options
+
+        response = await _call(profiling_handlers.start_cpu, request)
+
+        assert response.status == 400
+        assert not profiler.running
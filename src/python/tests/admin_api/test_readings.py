@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+import asyncio
+import datetime
+import uuid
+from unittest.mock import MagicMock
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp import test_utils
+
+from foglamp.admin_api import readings as readings_handlers
+from foglamp.storage.latest import LatestReadings
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__   = "Apache 2.0"
+__version__   = "${VERSION}"
+
+_T0 = datetime.datetime(2017, 1, 2, tzinfo=datetime.timezone.utc)
+
+
+class _Query:
+    """Stands in for ReadingsQuery with ``total`` readings"""
+    total = 5
+    instances = []
+
+    def __init__(self, asset_code, start=None, end=None, after=None, limit=None):
+        self.asset_code = asset_code
+        self.after = after
+        self.limit = limit
+        self.count = 0
+        self.last_key = None
+        self.closed = False
+        first = after[1] + 1 if after else 1
+        self._ids = list(range(first, min(first + limit, self.total + 1)))
+        _Query.instances.append(self)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.closed = True
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._ids:
+            raise StopAsyncIteration
+        ids, self._ids = self._ids[:2], self._ids[2:]
+        rows = [{'id': id, 'read_key': uuid.UUID(int=id), 'reading': {'x': id},
+                 'user_ts': _T0 + datetime.timedelta(seconds=id), 'ts': _T0} for id in ids]
+        self.count += len(rows)
+        self.last_key = (rows[-1]['user_ts'], rows[-1]['id'])
+        return rows
+
+
+async def _user_middleware(app, handler):
+    async def middleware(request):
+        request.user = MagicMock()
+        request.jwt_payload = {'access': 1}
+        return await handler(request)
+    return middleware
+
+
+@pytest.fixture
+def client(event_loop, mocker):
+    mocker.patch('foglamp.admin_api.readings.ReadingsQuery', new=_Query)
+    _Query.instances = []
+    app = web.Application(middlewares=[_user_middleware], loop=event_loop)
+    readings_handlers.register_handlers(app.router)
+    client = test_utils.TestClient(test_utils.TestServer(app, loop=event_loop), loop=event_loop)
+    event_loop.run_until_complete(client.start_server())
+    yield client
+    event_loop.run_until_complete(client.close())
+
+
+class TestReadingsHandlers:
+    @pytest.mark.asyncio
+    async def test_pages(self, client):
+        response = await client.get('/api/readings/mouse', params={'limit': '3'})
+        assert response.status == 200
+        body = await response.json()
+
+        assert body['asset_code'] == 'mouse'
+        assert [reading['id'] for reading in body['readings']] == [1, 2, 3]
+        assert body['readings'][0]['read_key'] == str(uuid.UUID(int=1))
+
+        response = await client.get('/api/readings/mouse', params={'limit': '3', 'next': body['next']})
+        body = await response.json()
+
+        assert _Query.instances[1].after == (_T0 + datetime.timedelta(seconds=3), 3)
+        assert [reading['id'] for reading in body['readings']] == [4, 5]
+        assert body['next'] is None
+
+    @pytest.mark.asyncio
+    async def test_invalid_query(self, client):
+        for params in ({'limit': '0'}, {'from': 'yesterday'}, {'next': 'abc'}):
+            response = await client.get('/api/readings/mouse', params=params)
+            assert response.status == 400
+
+    @pytest.mark.asyncio
+    async def test_streams_are_limited(self, client, mocker):
+        mocker.patch.object(readings_handlers, '_streams', readings_handlers.MAX_STREAMS)
+
+        response = await client.get('/api/readings/mouse')
+        assert response.status == 503
+        assert not _Query.instances
+
+    @pytest.mark.asyncio
+    async def test_stalled_client_is_disconnected(self, client, mocker):
+        async def drain():
+            await asyncio.sleep(60)
+
+        mocker.patch('aiohttp.web.StreamResponse.drain', side_effect=drain)
+        mocker.patch.object(readings_handlers, 'WRITE_TIMEOUT', 0.01)
+
+        with pytest.raises(aiohttp.ClientError):
+            response = await client.get('/api/readings/mouse')
+            await response.read()
+
+        assert _Query.instances[0].closed
+        assert readings_handlers._streams == 0
+
+    @pytest.mark.asyncio
+    async def test_summary(self, client, mocker):
+        summary = {'count': 2, 'min': 1.0, 'max': 2.0, 'avg': 1.5, 'avg_ts': _T0,
+                   'first': (_T0, 1.0), 'last': (_T0, 2.0), 'min_point': (_T0, 1.0), 'max_point': (_T0, 2.0)}
+        buckets = [{'start': _T0, 'rows': 2, 'values': {'x': summary}}]
+        calls = []
+
+        async def summarize(*args):
+            calls.append(args)
+            return buckets
+
+        mocker.patch('foglamp.storage.readings_query.summarize', new=summarize)
+        params = {'from': '2017-01-02T00:00:00Z', 'to': '2017-01-03T00:00:00Z', 'bucket': '60', 'paths': 'x'}
+
+        response = await client.get('/api/readings/sensor/summary', params=params)
+        body = await response.json()
+        assert calls[0] == ('sensor', _T0, _T0 + datetime.timedelta(days=1), 60.0, ['x'])
+        assert body['buckets'] == [{'ts': _T0.isoformat(), 'rows': 2, 'values': {'x': {
+            'count': 2, 'min': 1.0, 'max': 2.0, 'avg': 1.5, 'first': 1.0, 'last': 2.0}}}]
+
+        response = await client.get('/api/readings/sensor/summary', params=dict(params, mode='lttb'))
+        body = await response.json()
+        assert body['points'] == {'x': [[_T0.isoformat(), 1.0], [_T0.isoformat(), 2.0]]}
+
+        response = await client.get('/api/readings/sensor/summary', params=dict(params, bucket='x'))
+        assert response.status == 400
+
+    @pytest.mark.asyncio
+    async def test_latest_readings(self, client, mocker):
+        cache = mocker.patch('foglamp.storage.latest.cache', new=LatestReadings())
+        cache.update('mouse', _T0, {'x': 1})
+
+        response = await client.get('/api/latest-readings', params={'assets': 'mouse,pump1'})
+        assert await response.json() == {
+            'readings': {'mouse': {'user_ts': _T0.isoformat(), 'reading': {'x': 1}}},
+            'missing': ['pump1']}
+
+        response = await client.get('/api/latest-readings/mouse')
+        assert await response.json() == {'user_ts': _T0.isoformat(), 'reading': {'x': 1}}
+
+        response = await client.get('/api/latest-readings/pump1')
+        assert response.status == 404
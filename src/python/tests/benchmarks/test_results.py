@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+import pytest
+
+from benchmarks import results
+from benchmarks.payloads import PayloadGenerator
+from foglamp.device_api import validation
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__   = "Apache 2.0"
+__version__   = "${VERSION}"
+
+
+def _result(**metrics):
+    return {'benchmark': 'coap', 'parameters': {}, 'environment': {}, 'metrics': metrics}
+
+
+class TestCompare:
+    def test_regressions(self):
+        rows = results.compare(_result(throughput=1000, latency_p99=0.010, count=100, errors=0),
+                               _result(throughput=850, latency_p99=0.0105, count=50, errors=2),
+                               tolerance=0.1)
+        regressed = {name: regressed for name, _, _, _, regressed in rows}
+        assert regressed == {'throughput': True, 'latency_p99': False, 'count': False, 'errors': True}
+
+    def test_different_benchmarks(self):
+        with pytest.raises(ValueError):
+            results.compare(_result(), dict(_result(), benchmark='admin'))
+
+    def test_latency_summary(self):
+        latencies = results.Latencies()
+        for i in range(100):
+            latencies.add(i / 1000, '2.03')
+        summary = latencies.summary('whoami_')
+        assert summary['whoami_count'] == 100
+        assert summary['whoami_latency_p50'] == 0.049
+        assert summary['whoami_latency_max'] == 0.099
+
+
+class TestPayloads:
+    @pytest.mark.parametrize("shape", ['mouse', 'clock', 'sensortag', 'mixed'])
+    def test_payloads_are_valid(self, shape):
+        for payload in PayloadGenerator(shape).batch(20):
+            validation.sensor_values(payload)
+            validation.parse_timestamp(payload['timestamp'])
+
+    def test_reproducible(self):
+        first = PayloadGenerator('sensortag', seed=1).reading()
+        second = PayloadGenerator('sensortag', seed=1).reading()
+        assert first['key'] == second['key']
+        assert first['sensor_values'] == second['sensor_values']
@@ -8,8 +8,13 @@ import pytest
 from unittest.mock import MagicMock
 from cbor2 import dumps
 from aiocoap.numbers.codes import Code as CoAP_CODES
+from aiocoap.numbers.optionnumbers import OptionNumber
 
 from foglamp.device_api.coap.sensor_values import SensorValues
+from foglamp.device_api.dedup import ReadKeyIndex
+from foglamp.storage import pool
+from foglamp.storage.latest import LatestReadings
+from foglamp.storage.readings import ReadingsBuffer
 
 __author__    = "Terris Linenbach"
 __copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
@@ -22,9 +27,10 @@ __version__   = "${VERSION}"
 #
 # Mock the following code:
 #
-#async with aiopg.sa.create_engine('...') as engine:
-#    async with engine.acquire() as conn:
-#        await conn.execute(...)
+#engine = await aiopg.sa.create_engine('...')
+#conn = await engine.acquire()
+#await conn.execute(...)
+#engine.release(conn)
 def async_mock(*args, **kwargs):
     """Returns a coroutine that does nothing
     """
@@ -42,33 +48,20 @@ class MockConnection(MagicMock):
     execute = async_mock()
 
 
-class AcquireContextManager(MagicMock):
-    """An async context manager that returns a MockConnection in __aenter__
-    """
-    async def __aenter__(self):
-        return MockConnection()
-
-    async def __aexit__(self, exc_type, exc_val, exc_tb):
-        pass
-
-
 class MockEngine(MagicMock):
-    """aquire() returns a AcquireContextManager object
+    """acquire() returns a coroutine that returns a MockConnection
     """
-    acquire = AcquireContextManager()
+    acquire = async_mock(return_value=MockConnection())
+    wait_closed = async_mock()
+    size = 1
+    freesize = 0
+    minsize = 1
+    maxsize = 1
 
 
-class CreateEngineContextManager(MagicMock):
-    """An async context manager that returns a MockEngine in __aenter__
-    """
-    async def __aenter__(self):
-        return MockEngine()
-
-    async def __aexit__(self, exc_type, exc_val, exc_tb):
-        pass
-        
-def _mock_create_engine(mocker):
-    mocker.patch('aiopg.sa.create_engine', return_value=CreateEngineContextManager())
+async def _create_mock_pool(mocker):
+    mocker.patch('aiopg.sa.create_engine', new=async_mock(return_value=MockEngine()))
+    await pool.create()
 # END
 
 
@@ -80,7 +73,9 @@ class TestSensorValues:
         ('hello world', CoAP_CODES.BAD_REQUEST),
         ({'asset':'test'}, CoAP_CODES.BAD_REQUEST),
         ({'timestamp':'2017-01-01T00:00:00Z'}, CoAP_CODES.BAD_REQUEST),
-        ({'timestamp':'2017-01-01T00:00:00Z', 'asset':'test'}, CoAP_CODES.VALID)
+        ({'timestamp':'2017-01-01T00:00:00Z', 'asset':'test'}, CoAP_CODES.VALID),
+        ({'timestamp':'2017-13-01T00:00:00Z', 'asset':'test'}, CoAP_CODES.BAD_REQUEST),
+        ({'timestamp':'2017-01-01T00:00:00Z', 'asset':'test', 'unknown':1}, CoAP_CODES.BAD_REQUEST)
     ]
     """An array of tuples consisting of (payload, expected status code)
     """
@@ -89,10 +84,40 @@ class TestSensorValues:
     @pytest.mark.asyncio
     async def test_payload(self, mocker, dict_payload, expected):
         """Runs all test cases in the __requests array"""
-        _mock_create_engine(mocker)
-        sv = SensorValues()
+        await _create_mock_pool(mocker)
+        buffer = mocker.patch('foglamp.storage.readings.buffer', new=ReadingsBuffer())
+        cache = mocker.patch('foglamp.storage.latest.cache', new=LatestReadings())
+        try:
+            sv = SensorValues()
+            request = MagicMock()
+            request.payload = dumps(dict_payload)
+            return_val = await sv.render_post(request)
+            assert return_val.code == expected
+            assert buffer.stats()['pending'] == (1 if expected == CoAP_CODES.VALID else 0)
+            assert (cache.get('test') is not None) == (expected == CoAP_CODES.VALID)
+        finally:
+            await pool.close()
+
+    @pytest.mark.asyncio
+    async def test_busy(self, mocker):
+        """Readings are refused with 5.03 and Max-Age when the buffer is full"""
+        mocker.patch('foglamp.storage.readings.buffer.is_full', return_value=True)
         request = MagicMock()
-        request.payload = dumps(dict_payload)
-        return_val = await sv.render_post(request)
-        assert return_val.code == expected
+        request.payload = dumps({'timestamp': '2017-01-01T00:00:00Z', 'asset': 'test'})
+        return_val = await SensorValues().render_post(request)
+        assert return_val.code == CoAP_CODES.SERVICE_UNAVAILABLE
+        assert return_val.opt.get_option(OptionNumber.MAX_AGE)[0].value == 5
+
 
+    @pytest.mark.asyncio
+    async def test_duplicate(self, mocker):
+        """A retransmitted reading is acknowledged but buffered once"""
+        buffer = mocker.patch('foglamp.storage.readings.buffer', new=ReadingsBuffer())
+        mocker.patch('foglamp.device_api.dedup.read_keys', new=ReadKeyIndex())
+        request = MagicMock()
+        request.payload = dumps({'timestamp': '2017-01-01T00:00:00Z', 'asset': 'test',
+                                 'key': 'f1e2d3c4-b5a6-4978-8f6e-5d4c3b2a1f0e'})
+        for _ in range(2):
+            return_val = await SensorValues().render_post(request)
+            assert return_val.code == CoAP_CODES.VALID
+        assert buffer.stats()['pending'] == 1
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+import pytest
+from unittest.mock import MagicMock
+from cbor2 import dumps, loads
+from aiocoap.numbers.codes import Code as CoAP_CODES
+
+from foglamp.device_api.compression import CompressionFilters
+from foglamp.device_api.coap.sensor_values_batch import SensorValuesBatch
+from foglamp.storage.readings import ReadingsBuffer
+from foglamp.storage.spool import RecordTooLarge
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__   = "Apache 2.0"
+__version__   = "${VERSION}"
+
+
+class TestSensorValuesBatch:
+    """Unit tests for SensorValuesBatch
+    """
+    __requests = [
+        ('hello world', CoAP_CODES.BAD_REQUEST, None),
+        ({'asset': 'test'}, CoAP_CODES.BAD_REQUEST, None),
+        ([], CoAP_CODES.VALID, []),
+        ([{'timestamp': '2017-01-01T00:00:00Z', 'asset': 'test'},
+          {'asset': 'test'},
+          'hello world',
+          {'timestamp': '2017-01-01T00:00:01Z', 'asset': 'test', 'sensor_values': {'x': 1}}],
+         CoAP_CODES.VALID,
+         ['ok', 'timestamp is required', 'payload must be object', 'ok'])
+    ]
+    """An array of tuples consisting of (payload, expected status code, expected per-item statuses)
+    """
+
+    @pytest.mark.parametrize("payload, expected, expected_statuses", __requests)
+    @pytest.mark.asyncio
+    async def test_payload(self, mocker, payload, expected, expected_statuses):
+        """Runs all test cases in the __requests array"""
+        buffer = mocker.patch('foglamp.storage.readings.buffer', new=ReadingsBuffer())
+        request = MagicMock()
+        request.payload = dumps(payload)
+        return_val = await SensorValuesBatch().render_post(request)
+        assert return_val.code == expected
+
+        if expected_statuses is not None:
+            statuses = loads(return_val.payload)
+            assert statuses == expected_statuses
+            assert buffer.stats()['pending'] == statuses.count('ok')
+
+    @pytest.mark.asyncio
+    async def test_compressed_readings_are_acknowledged(self, mocker):
+        """Readings dropped by compression are 'ok' but not buffered"""
+        buffer = mocker.patch('foglamp.storage.readings.buffer', new=ReadingsBuffer())
+        filters = mocker.patch('foglamp.device_api.compression.filters', new=CompressionFilters())
+        filters.configure({'default': {'type': 'deadband', 'deviation': 1}, 'assets': {}})
+        request = MagicMock()
+        request.payload = dumps([
+            {'timestamp': '2017-01-01T00:00:0{}Z'.format(i), 'asset': 'test', 'sensor_values': {'x': 1}}
+            for i in range(3)])
+
+        return_val = await SensorValuesBatch().render_post(request)
+
+        assert loads(return_val.payload) == ['ok', 'ok', 'ok']
+        assert buffer.stats()['pending'] == 1
+        assert filters.stats()['received'] == 3
+
+    @pytest.mark.asyncio
+    async def test_readings_too_large_leave_filters_unchanged(self, mocker):
+        buffer = mocker.patch('foglamp.storage.readings.buffer', new=ReadingsBuffer())
+        mocker.patch.object(buffer, 'add_many', side_effect=RecordTooLarge())
+        filters = mocker.patch('foglamp.device_api.compression.filters', new=CompressionFilters())
+        filters.configure({'default': {'type': 'deadband', 'deviation': 1}, 'assets': {}})
+        request = MagicMock()
+        request.payload = dumps([{'timestamp': '2017-01-01T00:00:00Z', 'asset': 'test', 'sensor_values': {'x': 1}}])
+
+        return_val = await SensorValuesBatch().render_post(request)
+
+        assert return_val.code == CoAP_CODES.REQUEST_ENTITY_TOO_LARGE
+        assert filters.stats()['received'] == 0
+        assert filters.stats()['assets'] == 0
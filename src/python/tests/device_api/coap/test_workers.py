@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+from unittest.mock import MagicMock
+
+from foglamp.device_api.coap import workers
+from foglamp.device_api.coap.workers import Supervisor, _Worker
+from foglamp.storage.latest import LatestReadings
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__   = "Apache 2.0"
+__version__   = "${VERSION}"
+
+
+def _worker(index, stats):
+    worker = _Worker(index)
+    worker.process = MagicMock(pid=100 + index, exitcode=1)
+    worker.process.is_alive.return_value = True
+    worker.conn = MagicMock()
+    worker.conn.fileno.return_value = 10 + index
+    worker.stats = stats
+    return worker
+
+
+class TestSupervisor:
+    def test_settings(self, mocker):
+        mocker.patch('foglamp.env.config', new={'coap': {'workers': 4}})
+        assert workers.settings() == {'workers': 4, 'stats_interval': 5}
+
+    def test_stats_are_totalled(self):
+        supervisor = Supervisor()
+        supervisor._workers = [
+            _worker(0, {'readings': {'added': 3, 'full': False}, 'dedup': {'hits': 1}}),
+            _worker(1, {'readings': {'added': 4, 'full': True}, 'dedup': {'hits': 0}})]
+
+        stats = supervisor.stats()
+        assert stats['totals'] == {'readings': {'added': 7}, 'dedup': {'hits': 1}}
+        assert [w['pid'] for w in stats['workers']] == [100, 101]
+        assert stats['workers'][1]['readings']['added'] == 4
+
+    def test_exited_worker_is_restarted(self, mocker):
+        loop = MagicMock()
+        mocker.patch('asyncio.get_event_loop', return_value=loop)
+        supervisor = Supervisor()
+        worker = _worker(0, {'readings': {'added': 3}})
+        worker.conn.recv.side_effect = EOFError()
+        supervisor._workers = [worker]
+
+        supervisor._receive(worker)
+
+        loop.remove_reader.assert_called_once_with(10)
+        assert worker.conn is None
+        assert worker.restarts == 1
+        assert worker.stats == {}
+        loop.call_later.assert_called_once_with(workers._RESTART_SECONDS, supervisor._restart, worker)
+
+    def test_stats_are_received(self, mocker):
+        supervisor = Supervisor()
+        worker = _worker(0, {})
+        worker.conn.recv.return_value = {'readings': {'added': 1}}
+        supervisor._receive(worker)
+        assert worker.stats == {'readings': {'added': 1}}
+
+    def test_latest_readings_are_merged(self, mocker):
+        cache = mocker.patch('foglamp.storage.latest.cache', new=LatestReadings())
+        supervisor = Supervisor()
+        worker = _worker(0, {})
+        worker.conn.recv.return_value = {'readings': {'added': 1}, 'latest': {'mouse': (1, {'x': 1})}}
+        supervisor._receive(worker)
+        assert worker.stats == {'readings': {'added': 1}}
+        assert cache.get('mouse') == (1, {'x': 1})
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+import pytest
+
+from foglamp.device_api import admission
+from foglamp.device_api.admission import AdmissionControl
+from foglamp.storage.readings import ReadingsBuffer
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__   = "Apache 2.0"
+__version__   = "${VERSION}"
+
+
+class TestAdmissionControl:
+    @pytest.fixture
+    def buffer(self, mocker):
+        buffer = ReadingsBuffer()
+        buffer.high_watermark = 4
+        buffer.low_watermark = 2
+        return mocker.patch('foglamp.storage.readings.buffer', new=buffer)
+
+    def test_device_rate_limit(self, buffer, mocker):
+        now = [100.0]
+        mocker.patch('time.monotonic', new=lambda: now[0])
+
+        control = AdmissionControl()
+        control.device_rate = 10
+        control.device_burst = 3
+
+        assert control.admit('10.0.0.1', 2) is None
+        assert control.admit('10.0.0.1') is None
+        assert control.admit('10.0.0.1') == 1
+
+        # Another device has its own bucket
+        assert control.admit('10.0.0.2', 3) is None
+
+        # 0.2 seconds refill 2 tokens
+        now[0] += 0.2
+        assert control.admit('10.0.0.1', 2) is None
+
+        stats = control.stats()
+        assert stats['rejected_rate'] == 1
+        assert stats['devices']['10.0.0.1']['admitted'] == 5
+        assert stats['devices']['10.0.0.1']['rejected'] == 1
+
+    def test_batch_larger_than_burst(self, buffer):
+        control = AdmissionControl()
+        control.device_rate = 10
+        control.device_burst = 3
+        assert control.admit('10.0.0.1', 100) is None
+        assert control.admit('10.0.0.1', 100) is not None
+
+    def test_devices_are_bounded(self, buffer, mocker):
+        now = [100.0]
+        mocker.patch('time.monotonic', new=lambda: now[0])
+        mocker.patch.object(admission, '_MAX_DEVICES', 3)
+        mocker.patch.object(admission, '_STATS_DEVICES', 2)
+
+        control = AdmissionControl()
+        control.device_rate = 10
+        control.device_burst = 3
+
+        for source in ['10.0.0.1', '10.0.0.2', '10.0.0.3', '10.0.0.1', '10.0.0.4', '10.0.0.5', '10.0.0.5']:
+            now[0] += 0.01
+            assert control.admit(source) is None
+            assert len(control._devices) <= 3
+
+        # The least recently updated devices were forgotten
+        assert list(control._devices) == ['10.0.0.1', '10.0.0.4', '10.0.0.5']
+
+        stats = control.stats()
+        assert stats['tracked_devices'] == 3
+        assert sorted(stats['devices']) == ['10.0.0.1', '10.0.0.5']
+
+    def test_unlimited_device_rate(self, buffer):
+        control = AdmissionControl()
+        control.device_rate = 0
+        for _ in range(10):
+            assert control.admit('10.0.0.1', 1000) is None
+
+    def test_watermarks(self, buffer):
+        control = AdmissionControl()
+        control.busy_max_age = 7
+
+        for i in range(3):
+            buffer.add('asset', '2017-01-01T00:00:00Z', {})
+        assert control.admit('10.0.0.1') is None
+
+        buffer.add('asset', '2017-01-01T00:00:00Z', {})
+        assert control.admit('10.0.0.1') == 7
+
+        # Still refused until the buffer drains to the low watermark
+        buffer._queue.consume(1)
+        assert control.admit('10.0.0.1') == 7
+        buffer._queue.consume(1)
+        assert control.admit('10.0.0.1') is None
+
+        assert control.stats()['rejected_busy'] == 2
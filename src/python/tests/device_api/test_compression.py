@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+import datetime
+
+import pytest
+
+from foglamp.device_api import compression
+from foglamp.device_api.compression import CompressionFilters
+from foglamp.storage.spool import RecordTooLarge
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__   = "Apache 2.0"
+__version__   = "${VERSION}"
+
+_T0 = datetime.datetime(2017, 1, 2, tzinfo=datetime.timezone.utc)
+
+
+def _row(seconds, reading, asset_code='pump1'):
+    return {'asset_code': asset_code, 'read_key': None,
+            'user_ts': _T0 + datetime.timedelta(seconds=seconds), 'reading': reading}
+
+
+def _filters(assets, default=None):
+    filters = CompressionFilters()
+    filters.configure({'default': default or {'type': 'none'}, 'assets': assets})
+    return filters
+
+
+def _stored(filters, rows):
+    return [(row['user_ts'] - _T0).total_seconds() for row in filters.apply(rows)]
+
+
+class TestDeadband:
+    def test_absolute(self):
+        filters = _filters({'pump1': {'type': 'deadband', 'deviation': 0.5}})
+
+        rows = [_row(i, {'velocity': v}) for i, v in enumerate([10, 10.2, 10.4, 10.6, 10.7, 9.9])]
+
+        assert _stored(filters, rows) == [0, 3, 5]
+        assert filters.stats()['reduction'] == 0.5
+
+    def test_percent(self):
+        filters = _filters({'pump1': {'type': 'deadband', 'percent': 10}})
+
+        rows = [_row(i, {'temperature': {'value': v, 'unit': 'C'}}) for i, v in enumerate([100, 109, 111, 119])]
+
+        assert _stored(filters, rows) == [0, 2]
+
+    def test_deviation_or_percent(self):
+        filters = _filters({'pump1': {'type': 'deadband', 'deviation': 5, 'percent': 10}})
+
+        # 6 is more than the deviation, 1.1 more than 10 percent of 10
+        rows = [_row(i, {'velocity': v}) for i, v in enumerate([100, 104, 106, 10, 10.5, 11.6])]
+
+        assert _stored(filters, rows) == [0, 2, 3, 5]
+
+    def test_max_interval(self):
+        filters = _filters({'pump1': {'type': 'deadband', 'max_interval': 10}})
+
+        assert _stored(filters, [_row(i, {'velocity': 1}) for i in range(0, 25, 5)]) == [0, 10, 20]
+
+    def test_other_changes_are_stored(self):
+        filters = _filters({}, default={'type': 'deadband', 'deviation': 1})
+
+        rows = [_row(0, {'velocity': 1, 'state': 'on'}),
+                _row(1, {'velocity': 1, 'state': 'on'}),
+                _row(2, {'velocity': 1, 'state': 'off'}),
+                _row(3, {'velocity': 1, 'state': 'off', 'rpm': 5}),
+                _row(4, {'velocity': 1, 'state': 'off', 'rpm': 5}, asset_code='pump2'),
+                _row(4, {'velocity': 1, 'state': 'off', 'rpm': 5})]
+
+        assert _stored(filters, rows) == [0, 2, 3, 4]
+
+    def test_points(self):
+        filters = _filters({'pump1': {'type': 'deadband', 'deviation': 100,
+                                      'points': {'rpm': {'deviation': 1}, 'raw': {'type': 'none'}}}})
+
+        assert _stored(filters, [_row(0, {'velocity': 1, 'rpm': 1}),
+                                 _row(1, {'velocity': 2, 'rpm': 1}),
+                                 _row(2, {'velocity': 2, 'rpm': 3})]) == [0, 2]
+        assert _stored(filters, [_row(3, {'raw': 1}), _row(4, {'raw': 1})]) == [3, 4]
+
+
+class TestSwingingDoor:
+    def test_line_is_compressed(self):
+        filters = _filters({'pump1': {'type': 'swinging_door', 'deviation': 0.1}})
+
+        rows = [_row(i, {'velocity': float(i)}) for i in range(10)]
+
+        assert _stored(filters, rows) == [0]
+
+    def test_held_reading_is_stored_at_a_turn(self):
+        filters = _filters({'pump1': {'type': 'swinging_door', 'deviation': 0.1}})
+
+        # Rises to 4 at t=4 then stays flat
+        values = [0, 1, 2, 3, 4, 4, 4, 4]
+        stored = []
+        for i, v in enumerate(values):
+            stored.extend(_stored(filters, [_row(i, {'velocity': v})]))
+
+        assert stored == [0, 4]
+        assert filters.stats()['held_stored'] == 1
+
+    def test_held_reading_is_stored_when_keys_change(self):
+        filters = _filters({'pump1': {'type': 'swinging_door', 'deviation': 0.1}})
+
+        assert _stored(filters, [_row(i, {'velocity': float(i)}) for i in range(3)]) == [0]
+        assert _stored(filters, [_row(3, {'velocity': 3.0, 'torque': 1.0})]) == [2, 3]
+        assert filters.stats()['held_stored'] == 1
+
+    def test_max_interval(self):
+        filters = _filters({'pump1': {'type': 'swinging_door', 'deviation': 0.1, 'max_interval': 5}})
+
+        assert _stored(filters, [_row(i, {'velocity': 1}) for i in range(8)]) == [0, 5]
+
+
+class TestCompressionFilters:
+    def test_without_filters_every_reading_is_stored(self):
+        filters = CompressionFilters()
+        rows = [_row(0, {'velocity': 1}), _row(0, {'velocity': 1})]
+
+        assert filters.apply(rows) == rows
+        assert filters.stats() == {'received': 2, 'stored': 2, 'held_stored': 0, 'reduction': 0.0, 'assets': 0}
+
+    def test_out_of_order_readings_are_stored(self):
+        filters = _filters({'pump1': {'type': 'deadband', 'deviation': 1}})
+
+        assert _stored(filters, [_row(5, {'velocity': 1}), _row(4, {'velocity': 1})]) == [5, 4]
+
+    def test_invalid_configuration_keeps_filters(self):
+        filters = _filters({'pump1': {'type': 'deadband'}})
+
+        with pytest.raises(ValueError):
+            filters.configure({'default': {'type': 'zip'}, 'assets': {}})
+
+        assert _stored(filters, [_row(0, {'velocity': 1}), _row(1, {'velocity': 1})]) == [0]
+
+    def test_least_recently_seen_assets_are_forgotten(self, mocker):
+        mocker.patch.object(compression, '_MAX_ASSETS', 2)
+        filters = _filters({}, default={'type': 'deadband'})
+
+        rows = [_row(0, {'v': 1}, 'a'), _row(0, {'v': 1}, 'b'), _row(1, {'v': 1}, 'a'),
+                _row(1, {'v': 1}, 'c'), _row(2, {'v': 1}, 'a'), _row(2, {'v': 1}, 'b')]
+
+        assert [row['asset_code'] for row in filters.apply(rows)] == ['a', 'b', 'c', 'b']
+        assert filters.stats()['assets'] == 2
+
+    def test_state_is_kept_when_readings_are_not_buffered(self):
+        filters = _filters({'pump1': {'type': 'deadband', 'deviation': 1},
+                            'pump2': {'type': 'swinging_door', 'deviation': 0.1}},
+                           default={'type': 'deadband'})
+        rows = [_row(0, {'v': 1}), _row(0, {'v': 1}, 'pump2'), _row(1, {'v': 1}, 'pump2')]
+        assert _stored(filters, rows) == [0, 0]
+
+        with pytest.raises(RecordTooLarge):
+            with filters.applying([_row(2, {'v': 5}), _row(2, {'v': 9}, 'pump2'),
+                                   _row(2, {'v': 1}, 'pump3')]) as stored:
+                assert len(stored) == 3
+                raise RecordTooLarge()
+
+        stats = filters.stats()
+        assert (stats['received'], stats['stored'], stats['held_stored'], stats['assets']) == (3, 2, 0, 2)
+        # Compared with the stored 1, not with the 5 that was not buffered
+        assert _stored(filters, [_row(3, {'v': 1.5})]) == []
+        # The reading held at 1 second is still held
+        assert _stored(filters, [_row(3, {'v': 9}, 'pump2')]) == [1]
+
+    def test_reduction(self):
+        assert compression.reduction({'received': 4, 'stored': 1}) == 0.75
+        assert compression.reduction({}) == 0.0
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+import datetime
+
+import pytest
+
+from foglamp.device_api.dedup import ReadKeyIndex
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__   = "Apache 2.0"
+__version__   = "${VERSION}"
+
+_KEY = 'f1e2d3c4-b5a6-4978-8f6e-5d4c3b2a1f0e'
+
+
+class TestReadKeyIndex:
+    def test_contains_added_key(self):
+        index = ReadKeyIndex()
+        assert not index.contains(_KEY)
+        index.add(_KEY)
+        assert index.contains(_KEY)
+        assert index.contains(_KEY.upper())
+        assert index.stats() == {'hits': 2, 'misses': 1, 'size': 1}
+
+    def test_keys_expire(self, mocker):
+        now = mocker.patch('time.monotonic', return_value=1000.0)
+        index = ReadKeyIndex(window=10)
+        index.add('a')
+        now.return_value = 1005.0
+        index.add('b')
+        assert index.contains('a')
+
+        now.return_value = 1011.0
+        assert not index.contains('a')
+        assert index.contains('b')
+
+        index.add('c')
+        assert index.stats()['size'] == 2
+
+    def test_oldest_keys_are_evicted(self):
+        index = ReadKeyIndex(size=2)
+        for key in ('a', 'b', 'c'):
+            index.add(key)
+        assert not index.contains('a')
+        assert index.contains('b')
+        assert index.contains('c')
+
+    @pytest.mark.asyncio
+    async def test_start_loads_recent_keys(self, mocker):
+        async def get(key, defaults):
+            return dict(defaults, dedup_window=60)
+
+        utc_now = datetime.datetime.now(datetime.timezone.utc)
+
+        async def recent_read_keys(limit):
+            return [('new', utc_now - datetime.timedelta(seconds=1)),
+                    ('old', utc_now - datetime.timedelta(seconds=120))]
+
+        mocker.patch('foglamp.storage.configuration.get', new=get)
+        mocker.patch('foglamp.storage.readings.recent_read_keys', new=recent_read_keys)
+
+        index = ReadKeyIndex()
+        await index.start()
+        assert index.window == 60
+        assert index.contains('new')
+        assert not index.contains('old')
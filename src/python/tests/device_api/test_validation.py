@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+import datetime
+
+import pytest
+
+from foglamp.device_api import validation
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__   = "Apache 2.0"
+__version__   = "${VERSION}"
+
+_UTC = datetime.timezone.utc
+
+
+class TestSensorValuesSchema:
+    __payloads = [
+        ({'asset': 'pump1', 'timestamp': '2017-01-01T00:00:00Z'}, None),
+        ({'asset': 'pump1', 'timestamp': '2017-01-01T00:00:00Z',
+          'key': '123e4567-e89b-12d3-a456-426655440000', 'sensor_values': {'velocity': 500}}, None),
+        ('hello world', 'payload must be object'),
+        ({'asset': 'pump1'}, 'timestamp is required'),
+        ({'asset': 1, 'timestamp': '2017-01-01T00:00:00Z'}, 'asset must be string'),
+        ({'asset': 'pump1', 'timestamp': '2017-01-01T00:00:00Z', 'sensor_values': []},
+         'sensor_values must be object'),
+        ({'asset': 'pump1', 'timestamp': '2017-01-01T00:00:00Z', 'readings': {}},
+         'readings is not allowed'),
+        ({'asset': 'p' * 51, 'timestamp': '2017-01-01T00:00:00Z'}, 'asset must be at most 50 characters'),
+        ({'asset': 'pump1', 'timestamp': '2017-01-01T00:00:00Z', 'key': 'abc'},
+         'key must match ^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$'),
+        ({'asset': 'pump1', 'timestamp': '2017-01-01T00:00:00Z',
+          'key': '123e4567-e89b-12d3-a456-426655440000\n'},
+         'key must match ^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$')
+    ]
+
+    @pytest.mark.parametrize("payload, error", __payloads)
+    def test_sensor_values(self, payload, error):
+        if error is None:
+            validation.sensor_values(payload)
+        else:
+            with pytest.raises(ValueError) as excinfo:
+                validation.sensor_values(payload)
+            assert str(excinfo.value) == error
+
+    def test_unsupported_keyword(self):
+        with pytest.raises(ValueError):
+            validation.compile_schema({'type': 'string', 'minLength': 1})
+
+    def test_pattern_and_max_length(self):
+        validate = validation.compile_schema({'type': 'string', 'pattern': '^a+$', 'maxLength': 3})
+        validate('aaa')
+        for value in ('aaaa', 'ab', 'aa\n'):
+            with pytest.raises(ValueError):
+                validate(value)
+
+    def test_number_excludes_bool(self):
+        validate = validation.compile_schema({'type': 'array', 'items': {'type': 'number'}})
+        validate([1, 2.5])
+        with pytest.raises(ValueError):
+            validate([True])
+
+
+class TestParseTimestamp:
+    __timestamps = [
+        ('2017-01-02T01:02:03Z', datetime.datetime(2017, 1, 2, 1, 2, 3, tzinfo=_UTC)),
+        ('2017-01-02T01:02:03.23232Z-05:00', datetime.datetime(2017, 1, 2, 6, 2, 3, 232320, tzinfo=_UTC)),
+        ('2017-01-02 01:02:03.123456789+0130', datetime.datetime(2017, 1, 1, 23, 32, 3, 123456, tzinfo=_UTC)),
+        ('2017-01-02T01:02', datetime.datetime(2017, 1, 2, 1, 2, tzinfo=_UTC)),
+        ('2016-12-31T23:59:60Z', datetime.datetime(2017, 1, 1, tzinfo=_UTC))
+    ]
+
+    @pytest.mark.parametrize("value, expected", __timestamps)
+    def test_parse(self, value, expected):
+        assert validation.parse_timestamp(value) == expected
+        # Again, from the cached prefix
+        assert validation.parse_timestamp(value) == expected
+
+    @pytest.mark.parametrize("value", [
+        None, '', 'hello world', '2017-02-30T00:00:00Z', '2017-01-02T01:02:03X',
+        '2017-01-02T01:02:99Z', '2017-01-02T01:02:03+25:00'])
+    def test_invalid(self, value):
+        with pytest.raises(ValueError):
+            validation.parse_timestamp(value)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+"""A fake aiopg.sa connection shared by the tests of the storage layer
+and of the modules built on it"""
+
+import pytest
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__   = "Apache 2.0"
+__version__   = "${VERSION}"
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def fetchall(self):
+        return self.rows
+
+    async def first(self):
+        return self.rows[0] if self.rows else None
+
+    async def scalar(self):
+        row = await self.first()
+        return None if row is None else row[0]
+
+
+class FakeTransaction:
+    """Counts the transactions begun, whether with ``async with`` or
+    ``await``, and records a rollback"""
+
+    def __init__(self, conn):
+        self._conn = conn
+        self.rolled_back = False
+
+    async def _begin(self):
+        self._conn.transactions += 1
+        return self
+
+    def __await__(self):
+        return self._begin().__await__()
+
+    async def __aenter__(self):
+        return await self._begin()
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def rollback(self):
+        self.rolled_back = True
+
+
+class FakeConnection:
+    """Records every statement with its parameters and answers it with
+    the rows returned by :meth:`answer`
+
+    By default the ``results`` are answered in order, one per statement,
+    and [] once there are none left. Set ``answer`` to a function of
+    (statement, params), or override it, to answer by statement instead.
+    """
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.statements = []
+        self.params = []
+        self.transactions = 0
+        self.transaction = FakeTransaction(self)
+        self.released = False
+
+    def answer(self, statement, params):
+        return self.results.pop(0) if self.results else []
+
+    def begin(self):
+        return self.transaction
+
+    async def execute(self, statement, *args, **params):
+        if args:
+            params = dict(args[0], **params)
+        self.statements.append(statement)
+        self.params.append(params)
+        return FakeResult(self.answer(statement, params))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.released = True
+
+
+@pytest.fixture
+def connection(mocker):
+    """A FakeConnection that pool.acquire() returns"""
+    conn = FakeConnection()
+    mocker.patch('foglamp.storage.pool.acquire', return_value=conn)
+    return conn
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+import datetime
+
+import pytest
+
+from foglamp.storage import configuration
+from foglamp.storage.configuration import ConfigurationCache
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__   = "Apache 2.0"
+__version__   = "${VERSION}"
+
+_T0 = datetime.datetime(2017, 1, 2, tzinfo=datetime.timezone.utc)
+
+
+class _Table:
+    """Stands in for foglamp.configuration"""
+
+    def __init__(self, rows):
+        self.rows = dict(rows)
+        self.selects = 0
+
+    def update(self, key, value):
+        self.rows[key] = (value, self.rows[key][1] + datetime.timedelta(seconds=1))
+
+    async def select(self, key=None):
+        self.selects += 1
+        return {k: row for k, row in self.rows.items() if key is None or k == key}
+
+    async def version(self):
+        return max(row[1] for row in self.rows.values()), len(self.rows)
+
+
+@pytest.fixture
+def table(mocker):
+    table = _Table({'INGST': ({'batch_size': 100}, _T0), 'PURGE': ({'age': 60}, _T0)})
+    mocker.patch.object(configuration, '_select', side_effect=table.select)
+    mocker.patch.object(configuration, '_version', side_effect=table.version)
+    return table
+
+
+class TestConfigurationCache:
+    @pytest.mark.asyncio
+    async def test_get_from_memory(self, table):
+        cache = ConfigurationCache()
+        await cache.load()
+        selects = table.selects
+
+        assert cache.get('INGST', {'batch_size': 250, 'max_latency': 0.5}) == {
+            'batch_size': 100, 'max_latency': 0.5}
+        assert cache.get('XXXXX', {'a': 1}) == {'a': 1}
+        assert cache.value('PURGE', 'age', 1.5) == 60.0
+        assert isinstance(cache.value('PURGE', 'age', 1.5), float)
+        assert table.selects == selects
+        assert cache.stats()['hits'] == 3
+        assert cache.stats()['misses'] == 1
+
+    @pytest.mark.asyncio
+    async def test_subscribers_get_changes(self, table):
+        cache = ConfigurationCache()
+        await cache.load()
+        values = []
+        cache.subscribe('INGST', values.append, {'max_latency': 0.5})
+
+        await cache.reload('INGST')
+        assert values == []
+
+        table.update('INGST', {'batch_size': 50})
+        await cache.reload('INGST')
+        assert values == [{'batch_size': 50, 'max_latency': 0.5}]
+
+        del table.rows['INGST']
+        await cache.reload('INGST')
+        assert values[-1] == {'max_latency': 0.5}
+
+    @pytest.mark.asyncio
+    async def test_poll_reloads_changed_rows(self, table):
+        cache = ConfigurationCache()
+        await cache.load()
+        values = []
+        cache.subscribe('PURGE', values.append)
+        cache.subscribe('INGST', lambda value: values.append('INGST'))
+
+        await cache._poll()
+        assert values == []
+
+        table.update('PURGE', {'age': 120})
+        await cache._poll()
+        assert values == [{'age': 120}]
+
+    @pytest.mark.asyncio
+    async def test_module_get(self, table, mocker):
+        cache = ConfigurationCache()
+        mocker.patch.object(configuration, 'cache', new=cache)
+
+        assert await configuration.get('PURGE', {'enabled': True}) == {'age': 60, 'enabled': True}
+        assert table.selects == 1
+
+        await cache.load()
+        selects = table.selects
+        assert await configuration.get('PURGE') == {'age': 60}
+        assert table.selects == selects
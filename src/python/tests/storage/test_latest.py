@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+import datetime
+
+import pytest
+
+from foglamp.storage.latest import LatestReadings
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__   = "Apache 2.0"
+__version__   = "${VERSION}"
+
+_T0 = datetime.datetime(2017, 1, 2, tzinfo=datetime.timezone.utc)
+_T1 = _T0 + datetime.timedelta(seconds=1)
+
+
+class TestLatestReadings:
+    def test_older_reading_is_ignored(self):
+        cache = LatestReadings()
+        cache.update('mouse', _T1, {'x': 2})
+        cache.update('mouse', _T0, {'x': 1})
+
+        assert cache.get('mouse') == (_T1, {'x': 2})
+        assert cache.stats() == {'updates': 2, 'stale': 1, 'assets': 1}
+
+    def test_get_many(self):
+        cache = LatestReadings()
+        cache.update_many([{'asset_code': 'a', 'user_ts': _T0, 'reading': {}},
+                           {'asset_code': 'b', 'user_ts': _T0, 'reading': {}}])
+
+        assert cache.get_many(['a', 'c']) == {'a': (_T0, {})}
+        assert set(cache.get_many()) == {'a', 'b'}
+
+    def test_changes_are_merged(self):
+        worker = LatestReadings()
+        main = LatestReadings()
+        main.update('mouse', _T1, {'x': 2})
+
+        worker.update('mouse', _T0, {'x': 1})
+        worker.update('pump1', _T0, {'rpm': 5})
+        main.merge(worker.changes())
+
+        assert main.get('mouse') == (_T1, {'x': 2})
+        assert main.get('pump1') == (_T0, {'rpm': 5})
+        assert worker.changes() == {}
+
+    @pytest.mark.asyncio
+    async def test_start_warms_the_cache(self, connection):
+        connection.results = [[('mouse', _T0, {'x': 1}), ('pump1', _T0, {'rpm': 5})]]
+        cache = LatestReadings()
+        cache.update('mouse', _T1, {'x': 2})
+        await cache.start()
+
+        assert cache.get('mouse') == (_T1, {'x': 2})
+        assert cache.get('pump1') == (_T0, {'rpm': 5})
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+import asyncio
+import datetime
+
+import pytest
+
+from foglamp.storage import partitions
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__   = "Apache 2.0"
+__version__   = "${VERSION}"
+
+
+def _ts(*args):
+    return datetime.datetime(*args, tzinfo=datetime.timezone.utc)
+
+
+def _answer(statement, params):
+    """There is one readings partition, no log partitions, and 5 is the
+    greatest id of every partition"""
+    if params.get('table') == 'readings':
+        return [('readings_p20170102_0000_20170103_0000',), ('readings_old',)]
+    if 'max(id)' in str(statement):
+        return [(5,)]
+    return []
+
+
+@pytest.fixture
+def conn(connection):
+    connection.answer = _answer
+    return connection
+
+
+def _statements(conn):
+    return [str(statement) for statement in conn.statements]
+
+
+class TestRanges:
+    @pytest.mark.parametrize('unit, ts, start, end', [
+        ('hour', _ts(2017, 1, 2, 13, 45), _ts(2017, 1, 2, 13), _ts(2017, 1, 2, 14)),
+        ('6-hour', _ts(2017, 1, 2, 13, 45), _ts(2017, 1, 2, 12), _ts(2017, 1, 2, 18)),
+        ('day', _ts(2017, 1, 2, 13, 45), _ts(2017, 1, 2), _ts(2017, 1, 3)),
+        ('week', _ts(2017, 1, 4, 13, 45), _ts(2017, 1, 2), _ts(2017, 1, 9)),
+        ('month', _ts(2017, 2, 14), _ts(2017, 2, 1), _ts(2017, 3, 1)),
+        ('month', _ts(2017, 12, 31, 23), _ts(2017, 12, 1), _ts(2018, 1, 1)),
+    ])
+    def test_partition_range(self, unit, ts, start, end):
+        assert partitions.partition_start(ts, unit) == start
+        assert partitions.partition_end(start, unit) == end
+
+    def test_name_round_trip(self):
+        name = partitions.partition_name('readings', _ts(2017, 1, 2), _ts(2017, 1, 2, 0, 30))
+
+        assert name == 'readings_p20170102_0000_20170102_0030'
+        assert partitions.parse_partition_name(name) == (_ts(2017, 1, 2), _ts(2017, 1, 2, 0, 30))
+        assert partitions.parse_partition_name('readings') is None
+
+
+class TestPlan:
+    def test_no_partitions(self):
+        ranges = partitions.plan([], _ts(2017, 1, 2, 13), 'day', 2)
+
+        assert ranges == [(_ts(2017, 1, 2), _ts(2017, 1, 3)),
+                          (_ts(2017, 1, 3), _ts(2017, 1, 4)),
+                          (_ts(2017, 1, 4), _ts(2017, 1, 5))]
+
+    def test_existing_partitions_are_kept(self):
+        existing = [(_ts(2017, 1, 2), _ts(2017, 1, 3)), (_ts(2017, 1, 3), _ts(2017, 1, 4))]
+
+        assert partitions.plan(existing, _ts(2017, 1, 2, 13), 'day', 2) == [
+            (_ts(2017, 1, 4), _ts(2017, 1, 5))]
+
+    def test_unit_change_starts_after_existing(self):
+        existing = [(_ts(2017, 1, 2), _ts(2017, 1, 3))]
+
+        ranges = partitions.plan(existing, _ts(2017, 1, 2, 13), 'week', 0)
+
+        assert ranges == [(_ts(2017, 1, 3), _ts(2017, 1, 9))]
+
+
+class TestMaintenanceDelay:
+    @pytest.mark.parametrize('unit, ahead, delay', [
+        ('day', 2, 3600), ('minute', 2, 60), ('minute', 0, 30), ('half-hour', 1, 900), ('month', 1, 3600)])
+    def test_runs_before_partitions_run_out(self, unit, ahead, delay):
+        assert partitions.maintenance_delay(3600, unit, ahead) == delay
+
+    @pytest.mark.asyncio
+    async def test_sub_hour_unit(self, mocker):
+        async def get(key, defaults):
+            return dict(defaults, unit='minute', ahead=2)
+
+        async def maintain(unit, ahead):
+            return []
+
+        async def sleep(seconds):
+            raise asyncio.CancelledError()
+
+        mocker.patch('foglamp.storage.configuration.get', side_effect=get)
+        mocker.patch.object(partitions, 'maintain', side_effect=maintain)
+        sleep = mocker.patch('asyncio.sleep', side_effect=sleep)
+
+        with pytest.raises(asyncio.CancelledError):
+            await partitions.PartitionMaintenance()._run()
+
+        sleep.assert_called_once_with(60)
+
+
+class TestTrigger:
+    def test_routes_to_partitions(self):
+        readings = partitions.TABLES[0]
+        function = partitions._trigger_function(readings, [
+            ('readings_p2', _ts(2017, 1, 3), _ts(2017, 1, 4)),
+            ('readings_p1', _ts(2017, 1, 2), _ts(2017, 1, 3))])
+
+        assert 'CREATE OR REPLACE FUNCTION foglamp.readings_partition_insert()' in function
+        assert ("IF NEW.user_ts >= '2017-01-03T00:00:00+00:00' AND NEW.user_ts < '2017-01-04T00:00:00+00:00'"
+                in function)
+        assert 'INSERT INTO foglamp.readings_p2 VALUES (NEW.*) ON CONFLICT (read_key) DO NOTHING;' in function
+        assert 'ELSIF NEW.user_ts' in function
+        assert function.index('ELSE\n        RETURN NEW;') < function.index('RETURN NULL;')
+
+    def test_without_partitions(self):
+        function = partitions._trigger_function(partitions.TABLES[1], [])
+
+        assert 'BEGIN\n    RETURN NEW;\nEND;' in function
+
+
+class TestMaintain:
+    @pytest.mark.asyncio
+    async def test_creates_missing_partitions(self, conn):
+        created = await partitions.maintain('day', 1, now=_ts(2017, 1, 2, 13))
+
+        assert created == ['readings_p20170103_0000_20170104_0000',
+                           'log_p20170102_0000_20170103_0000',
+                           'log_p20170103_0000_20170104_0000',
+                           'reading_values_p20170102_0000_20170103_0000',
+                           'reading_values_p20170103_0000_20170104_0000']
+        statements = _statements(conn)
+        assert 'pg_advisory_xact_lock' in statements[0]
+        assert ("CREATE TABLE foglamp.readings_p20170103_0000_20170104_0000"
+                " (CHECK (user_ts >= '2017-01-03T00:00:00+00:00' AND user_ts < '2017-01-04T00:00:00+00:00'))"
+                " INHERITS (foglamp.readings) TABLESPACE foglamp") in statements
+        assert ('CREATE UNIQUE INDEX readings_p20170103_0000_20170104_0000_ix1'
+                ' ON foglamp.readings_p20170103_0000_20170104_0000 USING btree (read_key)') in statements
+        triggers = [s for s in statements if s.startswith('CREATE OR REPLACE FUNCTION')]
+        assert len(triggers) == 3
+        assert 'foglamp.readings_p20170102_0000_20170103_0000' in triggers[0]
+        assert 'INSERT INTO foglamp.reading_values_p20170103_0000_20170104_0000 VALUES (NEW.*);' in triggers[2]
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('max_id, dropped', [(None, True), (5, True), (4, False)])
+    async def test_drop(self, conn, max_id, dropped):
+        names = await partitions.drop('readings', _ts(2017, 1, 3), max_id)
+        statements = _statements(conn)
+
+        if dropped:
+            assert names == ['readings_p20170102_0000_20170103_0000']
+            assert 'DROP TABLE foglamp.readings_p20170102_0000_20170103_0000' in statements
+            assert 'BEGIN\n    RETURN NEW;\nEND;' in statements[-1]
+        else:
+            assert names == []
+            assert not [s for s in statements if s.startswith('DROP')]
+
+    @pytest.mark.asyncio
+    async def test_partitions_ending_later_are_kept(self, conn):
+        assert await partitions.drop('readings', _ts(2017, 1, 2, 23)) == []
+
+    @pytest.mark.asyncio
+    async def test_unknown_unit(self):
+        with pytest.raises(ValueError):
+            await partitions.maintain('year', 1)
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+import asyncio
+from unittest.mock import MagicMock
+
+import pytest
+
+from foglamp.storage import pool
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__   = "Apache 2.0"
+__version__   = "${VERSION}"
+
+
+class MockEngine(MagicMock):
+    """Hands out MagicMock connections whose execute() is a coroutine"""
+    size = 2
+    freesize = 1
+    minsize = 1
+    maxsize = 2
+
+    async def acquire(self):
+        conn = MagicMock()
+        conn.execute_result = None
+
+        async def execute(*args, **kwargs):
+            if isinstance(conn.execute_result, Exception):
+                raise conn.execute_result
+            return conn.execute_result
+
+        conn.execute = execute
+        self.acquired.append(conn)
+        return conn
+
+    async def wait_closed(self):
+        pass
+
+
+async def _create_pool(mocker, **settings):
+    engine = MockEngine()
+    engine.acquired = []
+
+    async def create_engine(*args, **kwargs):
+        return engine
+
+    mocker.patch('aiopg.sa.create_engine', new=create_engine)
+    settings = dict(pool._DEFAULT_SETTINGS, **settings)
+    mocker.patch('foglamp.storage.pool._load_settings', return_value=settings)
+    await pool.create()
+    return engine
+
+
+class TestPool:
+    @pytest.mark.asyncio
+    async def test_acquire_without_create(self):
+        with pytest.raises(pool.PoolNotCreated):
+            async with pool.acquire():
+                pass
+
+    @pytest.mark.asyncio
+    async def test_create_is_idempotent(self, mocker):
+        engine = await _create_pool(mocker)
+        try:
+            assert await pool.create() is engine
+        finally:
+            await pool.close()
+
+    @pytest.mark.asyncio
+    async def test_acquire_releases(self, mocker):
+        engine = await _create_pool(mocker)
+        try:
+            async with pool.acquire() as conn:
+                assert conn is engine.acquired[0]
+            engine.release.assert_called_once_with(conn)
+        finally:
+            await pool.close()
+
+    @pytest.mark.asyncio
+    async def test_idle_connection_failing_health_check_is_discarded(self, mocker):
+        engine = await _create_pool(mocker, health_check_interval=0)
+        try:
+            async with pool.acquire() as conn:
+                pass
+            conn.execute_result = Exception('server closed the connection')
+
+            # The mock pool never reuses connections, so make the
+            # next acquire() return the broken one first
+            original_acquire = engine.acquire
+            calls = []
+
+            async def acquire():
+                calls.append(1)
+                if len(calls) == 1:
+                    return conn
+                return await original_acquire()
+
+            engine.acquire = acquire
+            failures = pool.stats()['health_check_failures']
+
+            async with pool.acquire() as healthy_conn:
+                assert healthy_conn is not conn
+
+            conn.connection.close.assert_called_once_with()
+            assert pool.stats()['health_check_failures'] == failures + 1
+        finally:
+            await pool.close()
+
+    @pytest.mark.asyncio
+    async def test_acquire_timeout(self, mocker):
+        engine = await _create_pool(mocker, acquire_timeout=0.01)
+        try:
+            async def acquire():
+                await asyncio.sleep(1)
+
+            engine.acquire = acquire
+            timeouts = pool.stats()['timeouts']
+
+            with pytest.raises(asyncio.TimeoutError):
+                async with pool.acquire():
+                    pass
+
+            assert pool.stats()['timeouts'] == timeouts + 1
+        finally:
+            await pool.close()
+
+    @pytest.mark.asyncio
+    async def test_stats(self, mocker):
+        assert pool.stats()['size'] == 0
+        await _create_pool(mocker)
+        try:
+            stats = pool.stats()
+            assert stats['size'] == 2
+            assert stats['used'] == 1
+            assert stats['max_size'] == 2
+        finally:
+            await pool.close()
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+import collections
+import datetime
+import re
+
+import pytest
+
+from foglamp.storage import purge
+from tests.storage.conftest import FakeConnection
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__   = "Apache 2.0"
+__version__   = "${VERSION}"
+
+_NOW = datetime.datetime(2017, 1, 5, tzinfo=datetime.timezone.utc)
+
+
+class _Connection(FakeConnection):
+    """Deletes ``expired`` rows of each table, in batches
+
+    ``streams`` are the (last_object, object_filter) of the active streams.
+    Readings of their asset codes have the ``unsent`` ids and ids up to
+    ``last_id`` are committed.
+    """
+
+    def __init__(self, expired, streams=(), unsent=(), last_id=None):
+        super().__init__()
+        self.expired = collections.defaultdict(int, expired)
+        self.streams = list(streams)
+        self.unsent = unsent
+        self.last_id = last_id
+        self.deletes = []
+        self.logs = []
+        self.updates = 0
+
+    def answer(self, statement, params):
+        text = str(statement)
+
+        if 'last_object' in text:
+            return self.streams
+
+        if 'asset_code = ANY' in text:
+            return [(min([id for id in self.unsent if id > params['after']], default=None),)]
+
+        if 'readings_id_seq' in text:
+            return [(self.last_id,)]
+
+        if 'pg_locks' in text:
+            return [(None,)]
+
+        if text.lstrip().startswith('WITH deleted'):
+            table = re.search(r'DELETE FROM foglamp\.(\w+)', text).group(1)
+            self.deletes.append((table, text, params))
+            count = min(self.expired[table], params['batch_size'])
+            self.expired[table] -= count
+            return [(count, params['after'] + count if count else None)]
+
+        if text.startswith('INSERT INTO foglamp.log'):
+            self.logs.append(statement.compile().params)
+        elif text.startswith('UPDATE foglamp.configuration'):
+            self.updates += 1
+        return []
+
+
+def _patch(mocker, conn, dropped=()):
+    mocker.patch('foglamp.storage.pool.acquire', return_value=conn)
+
+    async def drop(table, before, max_id=None):
+        return list(dropped) if table == 'readings' else []
+
+    return mocker.patch('foglamp.storage.partitions.drop', side_effect=drop)
+
+
+class TestPurge:
+    @pytest.mark.asyncio
+    async def test_deletes_in_batches(self, mocker):
+        conn = _Connection({'readings': 25, 'reading_values': 40, 'log': 3})
+        drop = _patch(mocker, conn, dropped=['readings_p20170101_0000_20170102_0000'])
+
+        report = await purge.Purge().run_once({'batch_size': 10, 'pause': 0, 'age': 86400},
+                                              {'retention': 172800}, now=_NOW)
+
+        assert report['readings'] == {
+            'before': '2017-01-04T00:00:00+00:00',
+            'partitions_dropped': ['readings_p20170101_0000_20170102_0000'],
+            'deleted': 25,
+            'complete': True}
+        assert report['reading_values']['deleted'] == 40
+        assert report['log']['deleted'] == 3
+        assert report['log']['before'] == '2017-01-03T00:00:00+00:00'
+        drop.assert_any_call('readings', _NOW - datetime.timedelta(days=1), None)
+        drop.assert_any_call('reading_values', _NOW - datetime.timedelta(days=1), None)
+
+        readings_deletes = [params for table, _, params in conn.deletes if table == 'readings']
+        assert [params['after'] for params in readings_deletes] == [0, 10, 20]
+        assert 'user_ts < :before' in conn.deletes[0][1]
+        assert 'max_id' not in conn.deletes[0][1]
+
+        assert conn.updates == 1
+        assert conn.logs[0]['code'] == 'PURGE'
+        assert conn.logs[0]['level'] == 0
+        assert conn.logs[0]['log'] == report
+
+    @pytest.mark.asyncio
+    async def test_unsent_readings_are_kept(self, mocker):
+        conn = _Connection({'readings': 0, 'log': 0}, streams=[(42, {}), (50, None)])
+        drop = _patch(mocker, conn)
+
+        report = await purge.Purge().run_once(now=_NOW)
+
+        drop.assert_any_call('readings', _NOW - datetime.timedelta(seconds=259200), 42)
+        drop.assert_any_call('reading_values', _NOW - datetime.timedelta(seconds=259200), None)
+        drop.assert_any_call('log', _NOW - datetime.timedelta(seconds=259200), None)
+        table, text, params = conn.deletes[0]
+        assert table == 'readings'
+        assert 'id <= :max_id' in text
+        assert params['max_id'] == 42
+        assert report['readings']['max_id'] == 42
+
+    @pytest.mark.asyncio
+    async def test_quiet_filtered_stream_does_not_hold_back_readings(self, mocker):
+        conn = _Connection({'readings': 0, 'log': 0}, streams=[(5, {'asset_codes': ['pump']}), (90, {})],
+                           last_id=100)
+        drop = _patch(mocker, conn)
+
+        report = await purge.Purge().run_once(now=_NOW)
+
+        drop.assert_any_call('readings', _NOW - datetime.timedelta(seconds=259200), 90)
+        assert report['readings']['max_id'] == 90
+
+    @pytest.mark.asyncio
+    async def test_filtered_stream_keeps_its_unsent_readings(self, mocker):
+        conn = _Connection({'readings': 0, 'log': 0}, streams=[(5, {'asset_codes': ['pump']})],
+                           unsent=[3, 60, 80], last_id=100)
+        _patch(mocker, conn)
+
+        report = await purge.Purge().run_once(now=_NOW)
+
+        assert report['readings']['max_id'] == 59
+
+    @pytest.mark.asyncio
+    async def test_budget_carries_over(self, mocker):
+        conn = _Connection({'readings': 25, 'log': 0})
+        _patch(mocker, conn)
+        task = purge.Purge()
+
+        report = await task.run_once({'batch_size': 10, 'budget': 0, 'retain_unsent': False}, now=_NOW)
+
+        assert report['readings']['deleted'] == 10
+        assert report['readings']['complete'] is False
+
+        report = await task.run_once({'batch_size': 10, 'budget': 0, 'retain_unsent': False}, now=_NOW)
+
+        assert report['readings']['deleted'] == 10
+        readings_deletes = [params for table, _, params in conn.deletes if table == 'readings']
+        assert readings_deletes[-1]['after'] == 10
+        assert task.stats()['readings_deleted'] == 20
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from foglamp.storage import reading_values
+from foglamp.storage.reading_values import PointPaths
+from foglamp.storage.readings import ReadingsBuffer
+from tests.storage.conftest import FakeConnection
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__   = "Apache 2.0"
+__version__   = "${VERSION}"
+
+
+class _Connection(FakeConnection):
+    """Stands in for foglamp.point_paths, readings_id_seq and
+    foglamp.readings, and records the other INSERTs. Readings whose
+    read_key is in ``stored_keys`` are skipped like retransmissions.
+    """
+
+    def __init__(self, stored_keys=()):
+        super().__init__()
+        self.paths = {}
+        self.inserted = {}
+        self.locks = 0
+        self.stored_keys = set(stored_keys)
+        self.last_id = 0
+
+    def answer(self, statement, params):
+        if isinstance(statement, str):
+            # The in-flight lock of foglamp.storage.readings
+            self.locks += 1
+            return []
+
+        if 'count' in params:
+            ids = [(self.last_id + i,) for i in range(1, params['count'] + 1)]
+            self.last_id += params['count']
+            return ids
+
+        table = statement.table.name if hasattr(statement, 'table') else None
+
+        if table == 'readings':
+            self.inserted.setdefault(table, []).extend(
+                row for row in statement.parameters if row['read_key'] not in self.stored_keys)
+        elif table == 'reading_values':
+            self.inserted.setdefault(table, []).extend(statement.parameters)
+        elif table == 'point_paths':
+            for row in statement.parameters:
+                self.paths.setdefault(row['path'], len(self.paths) + 1)
+        elif 'point_paths' in str(statement):
+            return [{'id': id, 'path': path} for path, id in self.paths.items()]
+        else:
+            return [{'id': row['id']} for row in self.inserted.get('readings', [])]
+
+        return []
+
+
+def _reading(asset_code, user_ts, reading, read_key=None):
+    return {'asset_code': asset_code, 'read_key': read_key, 'user_ts': user_ts, 'reading': reading}
+
+
+async def _write(conn, readings):
+    buffer = ReadingsBuffer()
+    buffer.flatten_values = True
+    await buffer._write(conn, readings)
+    return buffer
+
+
+class TestFlatten:
+    def test_numbers(self):
+        reading = {'velocity': 3, 'temperature': {'value': 21.5, 'unit': 'C'},
+                   'on': True, 'samples': [1, 2], 'none': None}
+
+        assert sorted(reading_values.flatten(reading)) == [('temperature.value', 21.5), ('velocity', 3.0)]
+
+    def test_limits(self, mocker):
+        mocker.patch.object(reading_values, 'MAX_VALUES', 2)
+        mocker.patch.object(reading_values, 'MAX_DEPTH', 2)
+
+        assert reading_values.flatten({'a': {'b': {'c': 1}}}) == []
+        assert reading_values.flatten({'huge': 10 ** 400, 'long' * 100: 1}) == []
+        assert len(reading_values.flatten({'a': 1, 'b': 2, 'c': 3})) == 2
+        assert reading_values.flatten('text') == []
+
+
+class TestPointPaths:
+    @pytest.mark.asyncio
+    async def test_paths_are_interned_once(self):
+        conn = _Connection()
+        paths = PointPaths()
+
+        ids = await paths.ids(conn, ['x', 'y', 'x'])
+        assert ids['x'] != ids['y']
+
+        conn.paths.clear()
+        assert (await paths.ids(conn, ['x']))['x'] == ids['x']
+        assert paths.stats() == {'interned': 2, 'skipped': 0, 'cached': 2}
+
+    @pytest.mark.asyncio
+    async def test_max_paths(self, mocker):
+        mocker.patch.object(reading_values, 'MAX_PATHS', 1)
+        paths = PointPaths()
+
+        ids = await paths.ids(_Connection(), ['x', 'y'])
+
+        assert len(ids) == 1
+        assert paths.stats()['skipped'] == 1
+
+    def test_insert_keeps_every_value(self):
+        statement = reading_values.insert_statement([
+            {'reading_id': 1, 'asset_code': 'a', 'point_path_id': 1, 'user_ts': '2017-01-01T00:00:00Z',
+             'value': 1.0}])
+        sql = str(statement.compile(dialect=postgresql.dialect()))
+
+        assert 'ON CONFLICT' not in sql
+
+
+class TestReadingsBuffer:
+    @pytest.mark.asyncio
+    async def test_values_are_written_with_readings(self, mocker):
+        conn = _Connection()
+        mocker.patch.object(reading_values, 'point_paths', new=PointPaths())
+
+        buffer = await _write(conn, [
+            _reading('mouse', '2017-01-01T00:00:00Z', {'x': 1, 'button': 'down'}),
+            _reading('sensor', '2017-01-01T00:00:01Z', {'temperature': {'value': 21.5}})])
+
+        assert conn.transactions == 1
+        assert conn.locks == 1
+        assert [row['id'] for row in conn.inserted['readings']] == [1, 2]
+        assert [(row['reading_id'], row['asset_code'], row['value'])
+                for row in conn.inserted['reading_values']] == [(1, 'mouse', 1.0), (2, 'sensor', 21.5)]
+        assert conn.inserted['reading_values'][1]['point_path_id'] == conn.paths['temperature.value']
+        assert buffer.stats()['values'] == 2
+
+    @pytest.mark.asyncio
+    async def test_readings_with_the_same_user_ts_keep_their_values(self, mocker):
+        conn = _Connection()
+        mocker.patch.object(reading_values, 'point_paths', new=PointPaths())
+
+        await _write(conn, [_reading('pump1', '2017-01-01T00:00:00Z', {'rpm': 1}),
+                            _reading('pump1', '2017-01-01T00:00:00Z', {'rpm': 2})])
+
+        assert [(row['reading_id'], row['value']) for row in conn.inserted['reading_values']] == [
+            (1, 1.0), (2, 2.0)]
+
+    @pytest.mark.asyncio
+    async def test_retransmitted_readings_have_no_values(self, mocker):
+        conn = _Connection(stored_keys=['key1'])
+        mocker.patch.object(reading_values, 'point_paths', new=PointPaths())
+
+        buffer = await _write(conn, [_reading('pump1', '2017-01-01T00:00:00Z', {'rpm': 1}, 'key1'),
+                                     _reading('pump1', '2017-01-01T00:00:01Z', {'rpm': 2}, 'key2')])
+
+        assert [(row['reading_id'], row['value']) for row in conn.inserted['reading_values']] == [(2, 2.0)]
+        assert buffer.stats()['values'] == 1
+
+    @pytest.mark.asyncio
+    async def test_values_are_optional(self):
+        conn = _Connection()
+        buffer = ReadingsBuffer()
+
+        await buffer._write(conn, [_reading('mouse', '2017-01-01T00:00:00Z', {'x': 1})])
+
+        assert list(conn.inserted) == ['readings']
+        assert conn.locks == 1
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+import asyncio
+
+import psycopg2
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from foglamp.storage.readings import ReadingsBuffer
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__   = "Apache 2.0"
+__version__   = "${VERSION}"
+
+
+class _Transaction(object):
+    async def __aenter__(self):
+        pass
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+class MockConnection(object):
+    """Records the rows of every INSERT. Raises self.error (if set)
+    or psycopg2.DataError for rows whose asset_code is 'bad'.
+    """
+    def __init__(self):
+        self.inserted = []
+        self.error = None
+        self.locks = 0
+
+    def begin(self):
+        return _Transaction()
+
+    async def execute(self, statement):
+        if self.error is not None:
+            raise self.error
+        if isinstance(statement, str):
+            self.locks += 1
+            return
+        rows = statement.parameters
+        if any(row['asset_code'] == 'bad' for row in rows):
+            raise psycopg2.DataError()
+        self.inserted.append([row['asset_code'] for row in rows])
+
+
+class AcquireContextManager(object):
+    def __init__(self, conn):
+        self._conn = conn
+
+    async def __aenter__(self):
+        return self._conn
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+async def _start_buffer(mocker, batch_size, max_latency, spool_directory=None):
+    conn = MockConnection()
+    mocker.patch('foglamp.env.config', new={
+        'spool': {'enabled': spool_directory is not None, 'directory': spool_directory}})
+    mocker.patch('foglamp.storage.pool.acquire', new=lambda: AcquireContextManager(conn))
+
+    async def get(key, defaults):
+        return dict(defaults, batch_size=batch_size, max_latency=max_latency)
+
+    mocker.patch('foglamp.storage.configuration.get', new=get)
+
+    buffer = ReadingsBuffer()
+    await buffer.start()
+    return buffer, conn
+
+
+class TestReadingsBuffer:
+    @pytest.mark.asyncio
+    async def test_flush_when_batch_is_full(self, mocker):
+        buffer, conn = await _start_buffer(mocker, batch_size=3, max_latency=60)
+        try:
+            for i in range(7):
+                buffer.add('asset%s' % i, '2017-01-01T00:00:00Z', {})
+            await asyncio.sleep(0.01)
+            assert conn.inserted == [['asset0', 'asset1', 'asset2'],
+                                     ['asset3', 'asset4', 'asset5']]
+            assert buffer.stats()['pending'] == 1
+        finally:
+            await buffer.stop()
+
+        assert conn.inserted[-1] == ['asset6']
+
+    @pytest.mark.asyncio
+    async def test_flush_after_max_latency(self, mocker):
+        buffer, conn = await _start_buffer(mocker, batch_size=100, max_latency=0.05)
+        try:
+            buffer.add('asset', '2017-01-01T00:00:00Z', {})
+            await asyncio.sleep(0.01)
+            assert conn.inserted == []
+            await asyncio.sleep(0.1)
+            assert conn.inserted == [['asset']]
+        finally:
+            await buffer.stop()
+
+    @pytest.mark.asyncio
+    async def test_bad_row_does_not_fail_batch(self, mocker):
+        buffer, conn = await _start_buffer(mocker, batch_size=3, max_latency=60)
+        try:
+            for asset in ('a', 'bad', 'b'):
+                buffer.add(asset, '2017-01-01T00:00:00Z', {})
+            await asyncio.sleep(0.01)
+            assert conn.inserted == [['a'], ['b']]
+            assert buffer.stats()['rejected'] == 1
+        finally:
+            await buffer.stop()
+
+    @pytest.mark.asyncio
+    async def test_batch_is_retried(self, mocker):
+        mocker.patch('foglamp.storage.readings._RETRY_SECONDS', new=0.01)
+        buffer, conn = await _start_buffer(mocker, batch_size=2, max_latency=60)
+        conn.error = psycopg2.OperationalError()
+        try:
+            buffer.add('a', '2017-01-01T00:00:00Z', {})
+            buffer.add('b', '2017-01-01T00:00:00Z', {})
+            await asyncio.sleep(0.01)
+            assert buffer.stats()['flush_failures'] >= 1
+            assert buffer.stats()['pending'] == 2
+
+            conn.error = None
+            await asyncio.sleep(0.05)
+            assert conn.inserted == [['a', 'b']]
+        finally:
+            await buffer.stop()
+
+    @pytest.mark.asyncio
+    async def test_spooled_readings_are_written_after_restart(self, mocker, tmpdir):
+        buffer, conn = await _start_buffer(mocker, batch_size=10, max_latency=60,
+                                           spool_directory=str(tmpdir))
+        conn.error = psycopg2.OperationalError()
+        buffer.add('a', '2017-01-01T00:00:00Z', {})
+        await buffer.stop()
+        assert conn.inserted == []
+
+        buffer, conn = await _start_buffer(mocker, batch_size=10, max_latency=60,
+                                           spool_directory=str(tmpdir))
+        assert buffer.stats()['pending'] == 1
+        buffer.add('b', '2017-01-01T00:00:00Z', {})
+        await buffer.stop()
+        assert conn.inserted == [['a', 'b']]
+
+    def test_insert_skips_duplicate_keys(self):
+        statement = ReadingsBuffer._insert_statement(
+            [{'asset_code': 'a', 'read_key': None, 'user_ts': None, 'reading': {}}])
+        sql = str(statement.compile(dialect=postgresql.dialect()))
+        assert 'ON CONFLICT (read_key) DO NOTHING' in sql
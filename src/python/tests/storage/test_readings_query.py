@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+import datetime
+
+import pytest
+
+from foglamp.storage import readings_query
+from foglamp.storage.readings_query import ReadingsQuery
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__   = "Apache 2.0"
+__version__   = "${VERSION}"
+
+_T0 = datetime.datetime(2017, 1, 2, tzinfo=datetime.timezone.utc)
+
+
+def _row(id, seconds):
+    return {'id': id, 'user_ts': _T0 + datetime.timedelta(seconds=seconds)}
+
+
+class TestReadingsQuery:
+    def test_statement_uses_keyset(self):
+        query = ReadingsQuery('mouse', start=_T0, after=(_T0, 5), limit=10)
+        sql = str(query.statement())
+
+        assert '(foglamp.readings.user_ts, foglamp.readings.id) >' in sql
+        assert 'ORDER BY foglamp.readings.user_ts, foglamp.readings.id' in sql
+        assert 'OFFSET' not in sql
+
+    @pytest.mark.asyncio
+    async def test_rows_are_fetched_in_batches(self, connection):
+        cursor = [_row(1, 0), _row(2, 1), _row(3, 2)]
+
+        def answer(statement, params):
+            # The DECLAREd cursor returns its rows two at a time
+            if not statement.startswith('FETCH'):
+                return []
+            rows = cursor[:2]
+            del cursor[:2]
+            return rows
+
+        connection.answer = answer
+
+        batches = []
+        async with ReadingsQuery('mouse', fetch_size=2) as query:
+            async for rows in query:
+                batches.append([row['id'] for row in rows])
+
+        assert batches == [[1, 2], [3]]
+        assert query.count == 3
+        assert query.last_key == (_T0 + datetime.timedelta(seconds=2), 3)
+        assert connection.statements[0].startswith('DECLARE foglamp_readings_query NO SCROLL CURSOR FOR SELECT')
+        assert connection.transaction.rolled_back
+        assert connection.released
+
+
+def _summary(seconds, first, low, high, last):
+    """A bucket summary whose points are ``seconds`` apart"""
+    ts = [_T0 + datetime.timedelta(seconds=seconds + offset) for offset in range(4)]
+    values = [first, low, high, last]
+    return {'start': ts[0], 'rows': 4, 'values': {'x': {
+        'count': 4, 'min': low, 'max': high, 'avg': sum(values) / 4,
+        'avg_ts': ts[0] + datetime.timedelta(seconds=1.5),
+        'first': (ts[0], first), 'min_point': (ts[1], low), 'max_point': (ts[2], high),
+        'last': (ts[3], last)}}}
+
+
+class TestSummarize:
+    @pytest.mark.asyncio
+    async def test_rows_become_buckets(self, connection):
+        t = _T0.timestamp()
+        row = {'bucket': 2, 'row_count': 5, 'count_0': 4, 'min_0': 1.0, 'max_0': 9.0, 'avg_0': 5.0,
+               'avg_t_0': t + 2, 'first_0': [t, 2.0], 'last_0': [t + 4, 8.0],
+               'min_point_0': [1.0, t + 1], 'max_point_0': [9.0, t + 3], 'count_1': 0}
+
+        connection.results = [[row]]
+
+        buckets = await readings_query.summarize('sensor', _T0, _T0 + datetime.timedelta(minutes=1),
+                                                 10, ['temperature.value', 'humidity'])
+
+        sql, params = str(connection.statements[0]), connection.params[0]
+        assert params['path_0'] == ['temperature', 'value']
+        assert 'v1' in sql
+
+        assert buckets == [{
+            'start': _T0 + datetime.timedelta(seconds=20),
+            'rows': 5,
+            'values': {'temperature.value': {
+                'count': 4, 'min': 1.0, 'max': 9.0, 'avg': 5.0,
+                'avg_ts': _T0 + datetime.timedelta(seconds=2),
+                'first': (_T0, 2.0), 'last': (_T0 + datetime.timedelta(seconds=4), 8.0),
+                'min_point': (_T0 + datetime.timedelta(seconds=1), 1.0),
+                'max_point': (_T0 + datetime.timedelta(seconds=3), 9.0)}}
+        }]
+
+    @pytest.mark.asyncio
+    async def test_too_many_buckets(self):
+        with pytest.raises(ValueError):
+            await readings_query.summarize('sensor', _T0, _T0 + datetime.timedelta(days=1), 1, ['x'])
+        with pytest.raises(ValueError):
+            await readings_query.summarize('sensor', _T0, _T0, 0, ['x'])
+
+
+class TestLttb:
+    def test_picks_the_peak(self):
+        buckets = [_summary(0, 0, 0, 0, 0), _summary(10, 0, -1, 10, 0), _summary(20, 0, 0, 0, 0)]
+        points = readings_query.lttb(buckets, 'x')
+
+        assert [value for _, value in points] == [0, 10, 0]
+        assert points[0] == buckets[0]['values']['x']['first']
+        assert points[-1] == buckets[-1]['values']['x']['last']
+
+    def test_few_buckets(self):
+        buckets = [_summary(0, 1, 0, 3, 2)]
+        assert [value for _, value in readings_query.lttb(buckets, 'x')] == [1, 2]
+        assert readings_query.lttb(buckets, 'y') == []
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+import os
+
+import pytest
+
+from foglamp.storage import spool
+from foglamp.storage.spool import Spool, RecordTooLarge
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__   = "Apache 2.0"
+__version__   = "${VERSION}"
+
+
+def _row(i):
+    return {'asset_code': 'asset', 'read_key': None,
+            'user_ts': '2017-01-01T00:00:00Z', 'reading': {'i': i}}
+
+
+def _segment_files(directory):
+    return sorted(name for name in os.listdir(str(directory)) if name.endswith('.seg'))
+
+
+class TestSpool:
+    def test_peek_and_consume_in_order(self, tmpdir):
+        s = Spool(str(tmpdir), fsync='never')
+        s.extend([_row(i) for i in range(5)])
+        assert len(s) == 5
+
+        assert [r['reading']['i'] for r in s.peek(3)] == [0, 1, 2]
+        s.consume(2)
+        assert len(s) == 3
+        assert [r['reading']['i'] for r in s.peek(10)] == [2, 3, 4]
+        s.close()
+
+    def test_survives_reopen(self, tmpdir):
+        s = Spool(str(tmpdir), fsync='always')
+        for i in range(4):
+            s.append(_row(i))
+        s.peek(1)
+        s.consume(1)
+        s.close()
+
+        s = Spool(str(tmpdir), fsync='always')
+        assert len(s) == 3
+        assert [r['reading']['i'] for r in s.peek(10)] == [1, 2, 3]
+        s.append(_row(4))
+        assert [r['reading']['i'] for r in s.peek(10)] == [1, 2, 3, 4]
+        s.close()
+
+    def test_torn_record_is_ignored(self, tmpdir):
+        s = Spool(str(tmpdir), fsync='always')
+        s.append(_row(0))
+        s.append(_row(1))
+        s.close()
+
+        # Corrupt the last record's data as a crash in the middle of a write would
+        path = os.path.join(str(tmpdir), _segment_files(tmpdir)[0])
+        with open(path, 'r+b') as f:
+            data = f.read()
+            end = data.index(b'\0' * 16)
+            f.seek(end - 2)
+            f.write(b'\xff\xff')
+
+        s = Spool(str(tmpdir), fsync='always')
+        assert [r['reading']['i'] for r in s.peek(10)] == [0]
+        s.close()
+
+    def test_segments_roll_over_and_are_deleted(self, tmpdir):
+        s = Spool(str(tmpdir), segment_size=256, fsync='never')
+        s.extend([_row(i) for i in range(20)])
+        assert len(_segment_files(tmpdir)) > 1
+
+        rows = s.peek(20)
+        assert [r['reading']['i'] for r in rows] == list(range(20))
+        s.consume(20)
+        assert len(s) == 0
+        assert len(_segment_files(tmpdir)) == 1
+        assert s.peek(10) == []
+
+        s.append(_row(20))
+        assert [r['reading']['i'] for r in s.peek(10)] == [20]
+        s.close()
+
+    def test_record_too_large(self, tmpdir):
+        s = Spool(str(tmpdir), segment_size=64, fsync='never')
+        with pytest.raises(RecordTooLarge):
+            s.extend([_row(0), {'reading': 'x' * 100}])
+        assert len(s) == 0
+        s.close()
+
+    def test_create_disabled(self):
+        assert spool.create(None) is None
+        assert spool.create({'enabled': False}) is None
+
+    def test_invalid_fsync_policy(self, tmpdir):
+        with pytest.raises(ValueError):
+            Spool(str(tmpdir), fsync='sometimes')
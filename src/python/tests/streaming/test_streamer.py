@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+import asyncio
+import datetime
+import json
+
+import pytest
+from aiohttp import web
+from aiohttp import test_utils
+
+from foglamp.streaming import streamer
+from tests.storage.conftest import FakeConnection
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__   = "Apache 2.0"
+__version__   = "${VERSION}"
+
+_T0 = datetime.datetime(2017, 1, 2, tzinfo=datetime.timezone.utc)
+
+_READINGS = [{'id': id, 'asset_code': 'sensor' if id % 2 else 'mouse', 'read_key': None,
+              'user_ts': _T0, 'ts': _T0, 'reading': {'x': id}} for id in range(1, 8)]
+
+
+class _Destination:
+    """A local HTTP server standing in for a destination"""
+
+    def __init__(self, loop, failures=0):
+        self.requests = []
+        self.failures = failures
+        app = web.Application(loop=loop)
+        app.router.add_route('POST', '/ingress', self._handle)
+        self.server = test_utils.TestServer(app, loop=loop)
+
+    async def _handle(self, request):
+        # aiohttp undoes the Content-Encoding
+        body = await request.read()
+        if self.failures:
+            self.failures -= 1
+            return web.Response(status=503)
+        self.requests.append((request.headers, body))
+        return web.Response(status=204)
+
+
+def _stream_row(url, last_object=0, object_filter=None):
+    return {
+        'id': 1, 'destination_id': 1, 'properties': {}, 'object_stream': {},
+        'object_filter': object_filter or {}, 'last_object': last_object,
+        'destination_type': streamer.DESTINATION_OMF,
+        'destination_properties': {'url': url, 'producer_token': 'token'},
+        'destination_window': ['always']
+    }
+
+
+@pytest.fixture
+def destination(event_loop):
+    destination = _Destination(event_loop)
+    event_loop.run_until_complete(destination.server.start_server(loop=event_loop))
+    yield destination
+    event_loop.run_until_complete(destination.server.close())
+
+
+@pytest.fixture
+def checkpoints(mocker):
+    checkpoints = []
+
+    async def fetch(after, asset_codes, batch_size):
+        return [row for row in _READINGS
+                if row['id'] > after and (not asset_codes or row['asset_code'] in asset_codes)][:batch_size], \
+            _READINGS[-1]['id']
+
+    async def save_checkpoint(stream_id, last_object):
+        checkpoints.append(last_object)
+
+    async def get(key, defaults):
+        return dict(defaults, batch_size=2, poll_interval=0.01, retry=0.01)
+
+    mocker.patch.object(streamer, '_fetch', side_effect=fetch)
+    mocker.patch.object(streamer, '_save_checkpoint', side_effect=save_checkpoint)
+    mocker.patch('foglamp.storage.configuration.get', side_effect=get)
+    return checkpoints
+
+
+async def _stream(mocker, row, checkpoints, last_object):
+    async def active_streams():
+        return [row]
+
+    mocker.patch.object(streamer, '_active_streams', side_effect=active_streams)
+    service = streamer.Streamer()
+    await service.reload()
+
+    for _ in range(200):
+        if checkpoints and checkpoints[-1] == last_object:
+            break
+        await asyncio.sleep(0.01)
+
+    await service.stop()
+    return service
+
+
+def _connection(last_id, in_flight):
+    """Answers the sequence and pg_locks queries, then the readings query"""
+    return FakeConnection([(last_id,)], [(in_flight,)], [])
+
+
+class TestFetch:
+    @pytest.mark.asyncio
+    async def test_ids_being_written_are_not_read(self, mocker):
+        conn = _connection(100, 40)
+        mocker.patch('foglamp.storage.pool.acquire', return_value=conn)
+
+        await streamer._fetch(10, None, 5000)
+        assert conn.params[-1]['last_id'] == 40
+
+    @pytest.mark.asyncio
+    async def test_without_inserts_every_id_is_read(self, mocker):
+        conn = _connection(100, None)
+        mocker.patch('foglamp.storage.pool.acquire', return_value=conn)
+
+        await streamer._fetch(10, ['mouse'], 5000)
+        assert conn.params[-1]['last_id'] == 100
+
+    @pytest.mark.asyncio
+    async def test_nothing_committed_after(self, mocker):
+        conn = _connection(100, 40)
+        mocker.patch('foglamp.storage.pool.acquire', return_value=conn)
+
+        assert await streamer._fetch(40, None, 5000) == ([], 40)
+        assert len(conn.params) == 2
+
+    @pytest.mark.asyncio
+    async def test_returns_the_last_id_read(self, mocker):
+        conn = _connection(100, None)
+        mocker.patch('foglamp.storage.pool.acquire', return_value=conn)
+
+        assert await streamer._fetch(10, ['mouse'], 5000) == ([], 100)
+
+
+class TestWindow:
+    def test_always(self):
+        assert streamer.parse_window(['always']) is None
+        assert streamer.in_window(streamer.parse_window([]), datetime.time(3))
+
+    @pytest.mark.parametrize('time, expected', [
+        (datetime.time(8), True), (datetime.time(17), False),
+        (datetime.time(23), True), (datetime.time(1), True), (datetime.time(3), False)])
+    def test_ranges(self, time, expected):
+        ranges = streamer.parse_window(['08:00-17:00', '22:00-02:00'])
+        assert streamer.in_window(ranges, time) is expected
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            streamer.parse_window(['8 to 5'])
+
+
+class TestStreamer:
+    @pytest.mark.asyncio
+    async def test_sends_batches_and_checkpoints(self, mocker, destination, checkpoints):
+        url = str(destination.server.make_url('/ingress'))
+
+        service = await _stream(mocker, _stream_row(url, last_object=1), checkpoints, 7)
+
+        assert checkpoints[-1] == 7
+        assert checkpoints == sorted(checkpoints)
+        sent = [json.loads(body.decode('utf-8')) for _, body in destination.requests]
+        assert sorted([[value['reading']['x'] for container in batch for value in container['values']]
+                       for batch in sent]) == [[2, 3], [4, 5], [6, 7]]
+        assert [container['containerid'] for container in sent[0]] == ['mouse', 'sensor']
+        headers = destination.requests[0][0]
+        assert headers['producertoken'] == 'token'
+        assert headers['Content-Encoding'] == 'gzip'
+        assert service.stats()['readings'] == 6
+
+    @pytest.mark.asyncio
+    async def test_failed_batch_is_resent(self, mocker, destination, checkpoints):
+        destination.failures = 1
+        url = str(destination.server.make_url('/ingress'))
+
+        service = await _stream(mocker, _stream_row(url, object_filter={'asset_codes': ['sensor']}),
+                                checkpoints, 7)
+
+        ids = [value['reading']['x'] for _, body in destination.requests
+               for container in json.loads(body.decode('utf-8')) for value in container['values']]
+        assert sorted(set(ids)) == [1, 3, 5, 7]
+        assert ids.count(1) == 1
+        assert checkpoints[-1] == 7
+        assert service.stats()['failures'] >= 1
+
+    @pytest.mark.asyncio
+    async def test_other_assets_advance_a_filtered_stream(self, mocker, destination, checkpoints):
+        url = str(destination.server.make_url('/ingress'))
+
+        service = await _stream(mocker, _stream_row(url, object_filter={'asset_codes': ['pump']}),
+                                checkpoints, 7)
+
+        assert checkpoints == [7]
+        assert destination.requests == []
+        assert service.stats()['readings'] == 0
+
+    @pytest.mark.asyncio
+    async def test_short_batch_advances_to_the_last_id(self, mocker, destination, checkpoints):
+        url = str(destination.server.make_url('/ingress'))
+
+        await _stream(mocker, _stream_row(url, last_object=5, object_filter={'asset_codes': ['mouse']}),
+                      checkpoints, 7)
+
+        assert checkpoints == [7]
+        assert len(destination.requests) == 1
+
+    @pytest.mark.asyncio
+    async def test_invalid_stream_does_not_stop_others(self, mocker, checkpoints):
+        invalid = dict(_stream_row('http://omf/ingress'), object_stream={'fields': {'t': 5}})
+        valid = dict(_stream_row('http://omf/ingress'), id=2)
+
+        async def active_streams():
+            return [invalid, valid]
+
+        mocker.patch.object(streamer, '_active_streams', side_effect=active_streams)
+        service = streamer.Streamer()
+        await service.reload()
+
+        assert list(service._streams) == [2]
+        await service.stop()
+
+    def test_elasticsearch_body(self):
+        destination = streamer._Destination(
+            2, streamer.DESTINATION_ELASTICSEARCH, {'url': 'http://es/_bulk', 'compression': 'none'},
+            [], 4)
+
+        body = destination.encode(_READINGS[:1], lambda row: {'x': row['reading']['x']})
+
+        assert body.decode('utf-8').splitlines() == [
+            '{"index": {"_index": "foglamp", "_type": "reading", "_id": 1}}', '{"x": 1}']
+        assert 'Content-Encoding' not in destination.headers
+
+    def test_destination_without_url(self):
+        with pytest.raises(ValueError):
+            streamer._Destination(1, streamer.DESTINATION_OMF, {}, [], 4)
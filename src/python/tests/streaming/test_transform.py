@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+import datetime
+import uuid
+
+import pytest
+
+from foglamp.streaming.transform import compile_transform
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__   = "Apache 2.0"
+__version__   = "${VERSION}"
+
+_ROW = {
+    'id': 7,
+    'asset_code': 'sensor',
+    'read_key': uuid.UUID(int=7),
+    'user_ts': datetime.datetime(2017, 1, 2, tzinfo=datetime.timezone.utc),
+    'ts': datetime.datetime(2017, 1, 2, tzinfo=datetime.timezone.utc),
+    'reading': {'temperature': {'value': 20.5}, 'humidity': 40}
+}
+
+
+class TestTransform:
+    def test_default_fields(self):
+        assert compile_transform({})(_ROW) == {
+            'asset_code': 'sensor',
+            'read_key': '00000000-0000-0000-0000-000000000007',
+            'user_ts': '2017-01-02T00:00:00+00:00',
+            'reading': {'temperature': {'value': 20.5}, 'humidity': 40}
+        }
+
+    def test_fields_and_static(self):
+        transform = compile_transform({
+            'fields': {'Time': 'user_ts', 'temperature': 'reading.temperature.value',
+                       'pressure': 'reading.pressure', 'deep': 'reading.humidity.value'},
+            'static': {'source': 'gateway-1'}
+        })
+
+        assert transform(_ROW) == {'source': 'gateway-1', 'Time': '2017-01-02T00:00:00+00:00',
+                                   'temperature': 20.5}
+
+    def test_unknown_column(self):
+        with pytest.raises(ValueError):
+            compile_transform({'fields': {'x': 'temperature.value'}})
+
+    @pytest.mark.parametrize('object_stream', [{'fields': {'t': 5}}, {'fields': {'t': None}}, ['user_ts']])
+    def test_invalid_object_stream(self, object_stream):
+        with pytest.raises(ValueError):
+            compile_transform(object_stream)
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+import asyncio
+import sys
+import time
+
+import pytest
+
+from foglamp import event_loop
+from foglamp.event_loop import LagMonitor
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__   = "Apache 2.0"
+__version__   = "${VERSION}"
+
+
+class TestInstallPolicy:
+    def test_unknown_policy(self):
+        with pytest.raises(ValueError):
+            event_loop.install_policy('tornado')
+
+    def test_uvloop_not_installed(self, mocker):
+        mocker.patch.dict(sys.modules, {'uvloop': None})
+        set_policy = mocker.patch('asyncio.set_event_loop_policy')
+        assert event_loop.install_policy('uvloop') == 'asyncio'
+        set_policy.assert_called_once_with(None)
+
+    def test_policy_from_settings(self, mocker):
+        mocker.patch('foglamp.env.config', new={'loop': {'policy': 'asyncio'}})
+        mocker.patch('asyncio.set_event_loop_policy')
+        assert event_loop.install_policy() == 'asyncio'
+
+
+class TestLagMonitor:
+    @pytest.mark.asyncio
+    async def test_lag_is_sampled(self):
+        monitor = LagMonitor()
+        monitor.start(interval=0.01, threshold=1)
+        try:
+            await asyncio.sleep(0.05)
+        finally:
+            monitor.stop()
+
+        stats = monitor.stats()
+        assert stats['samples'] >= 2
+        assert 0 <= stats['p50'] <= stats['p99'] <= stats['max']
+        assert stats['slow_callbacks'] == 0
+
+    @pytest.mark.asyncio
+    async def test_slow_callback_is_reported(self, mocker):
+        warning = mocker.patch('foglamp.event_loop._logger.warning')
+        monitor = LagMonitor()
+        monitor.start(interval=0.01, threshold=0.05)
+        try:
+            await asyncio.sleep(0.02)
+            time.sleep(0.2)
+            await asyncio.sleep(0.02)
+        finally:
+            monitor.stop()
+
+        assert monitor.stats()['slow_callbacks'] == 1
+        assert monitor.stats()['max'] >= 0.15
+        assert 'test_slow_callback_is_reported' in warning.call_args[0][2]
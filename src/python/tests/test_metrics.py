@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+import pytest
+
+from foglamp import metrics
+from foglamp.metrics import Registry
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__   = "Apache 2.0"
+__version__   = "${VERSION}"
+
+
+class TestRegistry:
+    def test_prometheus(self):
+        registry = Registry()
+        requests = registry.counter('requests', 'Requests', ('code',))
+        requests.labels('2.03').inc()
+        requests.labels('2.03').inc(2)
+        registry.gauge('pending', 'Pending "readings"\nnow').set(5)
+        registry.histogram('seconds', 'Latency', buckets=(0.1, 1)).observe(0.5)
+
+        assert metrics.to_prometheus(registry.snapshot()) == '\n'.join([
+            '# HELP requests Requests',
+            '# TYPE requests counter',
+            'requests_total{code="2.03"} 3',
+            '# HELP pending Pending "readings"\\nnow',
+            '# TYPE pending gauge',
+            'pending 5',
+            '# HELP seconds Latency',
+            '# TYPE seconds histogram',
+            'seconds_bucket{le="0.1"} 0',
+            'seconds_bucket{le="1"} 1',
+            'seconds_bucket{le="+Inf"} 1',
+            'seconds_count 1',
+            'seconds_sum 0.5',
+            ''])
+
+    def test_stats(self):
+        registry = Registry()
+        registry.stats('buffer', lambda: {'added': 3, 'pending': 1, 'full': True, 'devices': {}},
+                       counters=('added',))
+
+        assert metrics.to_json(registry.snapshot()) == {
+            'buffer_added': {'type': 'counter', 'help': '',
+                             'samples': [{'name': 'buffer_added_total', 'labels': {}, 'value': 3}]},
+            'buffer_full': {'type': 'gauge', 'help': '',
+                            'samples': [{'name': 'buffer_full', 'labels': {}, 'value': 1}]},
+            'buffer_pending': {'type': 'gauge', 'help': '',
+                               'samples': [{'name': 'buffer_pending', 'labels': {}, 'value': 1}]}}
+
+    def test_duplicate_name(self):
+        registry = Registry()
+        registry.counter('requests', 'Requests')
+        with pytest.raises(ValueError):
+            registry.gauge('requests', 'Requests')
+
+    def test_wrong_label_count(self):
+        registry = Registry()
+        with pytest.raises(ValueError):
+            registry.counter('requests', 'Requests', ('resource', 'code')).labels('a')
+
+    def test_worker_label_and_merge(self):
+        registry = Registry()
+        registry.counter('requests', 'Requests').inc()
+        families = metrics.merge(registry.snapshot(),
+                                 metrics.add_label(registry.snapshot(), 'worker', '0'))
+        assert families[0]['samples'] == [['requests_total', {}, 1],
+                                          ['requests_total', {'worker': '0'}, 1]]
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+import threading
+import time
+
+import pytest
+
+from foglamp.profiling import CpuProfiler, MemoryProfiler, ProfilerError
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__   = "Apache 2.0"
+__version__   = "${VERSION}"
+
+
+def _busy(seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        pass
+
+
+@pytest.fixture
+def idle_thread():
+    stopped = threading.Event()
+    thread = threading.Thread(target=stopped.wait, name='idle')
+    thread.start()
+    yield thread
+    stopped.set()
+    thread.join()
+
+
+class TestCpuProfiler:
+    def test_collapsed_stacks(self, idle_thread):
+        profiler = CpuProfiler()
+        profiler.start(interval=0.001)
+        assert profiler.running
+        _busy(0.05)
+        profiler.stop()
+
+        assert not profiler.running
+        assert profiler.stats()['samples'] > 0
+        lines = profiler.report().splitlines()
+        assert all(line.startswith('MainThread;') for line in lines)
+        stack, count = lines[0].rsplit(' ', 1)
+        assert 'test_profiling.py:_busy' in stack
+        assert int(count) > 0
+
+    def test_all_threads(self, idle_thread):
+        profiler = CpuProfiler()
+        profiler.start(interval=0.001, threads='all')
+        _busy(0.05)
+        profiler.stop()
+
+        assert any(line.startswith('idle;') for line in profiler.report().splitlines())
+
+    def test_unknown_threads(self):
+        with pytest.raises(ValueError):
+            CpuProfiler().start(threads='some')
+
+    def test_stops_after_seconds(self):
+        profiler = CpuProfiler()
+        profiler.start(seconds=0.01, interval=0.001)
+        time.sleep(0.05)
+        assert not profiler.running
+
+    def test_start_twice(self):
+        profiler = CpuProfiler()
+        profiler.start()
+        try:
+            with pytest.raises(ProfilerError):
+                profiler.start()
+        finally:
+            profiler.stop()
+
+    def test_stop_before_start(self):
+        with pytest.raises(ProfilerError):
+            CpuProfiler().stop()
+
+
+class TestMemoryProfiler:
+    def test_snapshots(self):
+        profiler = MemoryProfiler()
+        profiler.start()
+        try:
+            first = profiler.snapshot()
+            assert not first['compared']
+
+            retained = [bytearray(1024) for _ in range(1000)]
+            second = profiler.snapshot(limit=5)
+            assert second['compared']
+            assert len(second['top']) <= 5
+            assert second['top'][0]['size_diff'] >= 1024 * 1000
+            assert 'test_profiling.py' in second['top'][0]['traceback'][0]
+            del retained
+        finally:
+            profiler.stop()
+
+        assert not profiler.running
+
+    def test_snapshot_before_start(self):
+        with pytest.raises(ProfilerError):
+            MemoryProfiler().snapshot()
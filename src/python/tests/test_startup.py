@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+# FOGLAMP_BEGIN
+# See: http://foglamp.readthedocs.io/
+# FOGLAMP_END
+
+import json
+import os
+import subprocess
+import sys
+
+import foglamp
+from foglamp.startup import StartupProfile
+
+__copyright__ = "Copyright (c) 2017 OSIsoft, LLC"
+__license__   = "Apache 2.0"
+__version__   = "${VERSION}"
+
+_BUDGET_SECONDS = float(os.environ.get('FOGLAMP_STARTUP_BUDGET', '1.0'))
+"""Most seconds importing foglamp.controller and loading foglamp-env.yaml
+may take. Slow machines can raise it."""
+
+_DEFERRED_MODULES = ('aiocoap', 'aiohttp', 'aiopg', 'jwt', 'pkg_resources', 'psycopg2', 'sqlalchemy')
+"""Imported by the subsystems, when they start"""
+
+_STARTUP = """
+import json, sys, time
+started = time.perf_counter()
+import foglamp.controller
+import foglamp.env as env
+env.load_config()
+print(json.dumps({'seconds': time.perf_counter() - started, 'modules': sorted(sys.modules)}))
+"""
+
+
+class TestStartupProfile:
+    def test_phases(self):
+        profile = StartupProfile()
+
+        with profile.phase('configuration'):
+            pass
+
+        assert [name for name, _ in profile.phases()] == ['configuration']
+        assert 'configuration' in profile.report()
+
+    def test_imports(self):
+        profile = StartupProfile()
+        sys.modules.pop('wave', None)
+
+        profile.install()
+        try:
+            exec('import wave')
+        finally:
+            profile.uninstall()
+
+        imports = {name: (self_seconds, seconds) for name, self_seconds, seconds in profile.imports()}
+        assert 'wave' in imports
+        assert 0 <= imports['wave'][0] <= imports['wave'][1]
+        assert 'wave' in profile.report()
+
+
+class TestStartupBudget:
+    def test_startup_is_fast(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(foglamp.__file__)))
+        output = subprocess.check_output([sys.executable, '-c', _STARTUP], cwd=root)
+        result = json.loads(output.decode('utf-8').splitlines()[-1])
+
+        assert result['seconds'] < _BUDGET_SECONDS
+        assert not [name for name in _DEFERRED_MODULES if name in result['modules']]
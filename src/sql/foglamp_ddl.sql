@@ -171,6 +171,9 @@ CREATE SEQUENCE foglamp.links_id_seq
 ALTER SEQUENCE foglamp.links_id_seq OWNER TO foglamp;
 
 
+-- CACHE 1: a transaction inserting readings draws greater ids than the
+-- last_value it locks (see foglamp/storage/readings.py), which cached
+-- values would not be
 CREATE SEQUENCE foglamp.readings_id_seq
     INCREMENT 1
     START 1
@@ -180,6 +183,24 @@ CREATE SEQUENCE foglamp.readings_id_seq
 ALTER SEQUENCE foglamp.readings_id_seq OWNER TO foglamp;
 
 
+CREATE SEQUENCE foglamp.reading_values_id_seq
+    INCREMENT 1
+    START 1
+    MINVALUE 1
+    MAXVALUE 9223372036854775807
+    CACHE 1;
+ALTER SEQUENCE foglamp.reading_values_id_seq OWNER TO foglamp;
+
+
+CREATE SEQUENCE foglamp.point_paths_id_seq
+    INCREMENT 1
+    START 1
+    MINVALUE 1
+    MAXVALUE 2147483647
+    CACHE 1;
+ALTER SEQUENCE foglamp.point_paths_id_seq OWNER TO foglamp;
+
+
 CREATE SEQUENCE foglamp.resources_id_seq
     INCREMENT 1
     START 1
@@ -264,6 +285,24 @@ CREATE INDEX log_ix1
     ON foglamp.log USING btree (code, ts, level)
     TABLESPACE foglamp;
 
+-- Moves rows into the partition for their ts. Replaced whenever
+-- partitions are created (see foglamp/storage/partitions.py); until then
+-- rows stay in foglamp.log.
+CREATE FUNCTION foglamp.log_partition_insert()
+  RETURNS trigger
+  LANGUAGE plpgsql
+AS $$
+BEGIN
+    RETURN NEW;
+END;
+$$;
+
+ALTER FUNCTION foglamp.log_partition_insert() OWNER TO foglamp;
+
+CREATE TRIGGER log_partition
+    BEFORE INSERT ON foglamp.log
+    FOR EACH ROW EXECUTE PROCEDURE foglamp.log_partition_insert();
+
 
 -- Asset status
 CREATE TABLE foglamp.asset_status (
@@ -503,6 +542,92 @@ CREATE INDEX readings_ix1
     ON foglamp.readings USING btree (read_key)
     TABLESPACE foglamp;
 
+-- Keyset pagination of an asset's readings (see foglamp/storage/readings_query.py)
+CREATE INDEX readings_ix2
+    ON foglamp.readings USING btree (asset_code, user_ts, id)
+    TABLESPACE foglamp;
+
+-- Moves rows into the partition for their user_ts. Replaced whenever
+-- partitions are created (see foglamp/storage/partitions.py); until then
+-- rows stay in foglamp.readings.
+CREATE FUNCTION foglamp.readings_partition_insert()
+  RETURNS trigger
+  LANGUAGE plpgsql
+AS $$
+BEGIN
+    RETURN NEW;
+END;
+$$;
+
+ALTER FUNCTION foglamp.readings_partition_insert() OWNER TO foglamp;
+
+CREATE TRIGGER readings_partition
+    BEFORE INSERT ON foglamp.readings
+    FOR EACH ROW EXECUTE PROCEDURE foglamp.readings_partition_insert();
+
+
+-- Point paths table
+-- The paths of the numeric values found in readings, for example
+-- 'temperature.value'. Interned so that foglamp.reading_values stores an id.
+CREATE TABLE foglamp.point_paths (
+       id   integer                     NOT NULL DEFAULT nextval('foglamp.point_paths_id_seq'::regclass),   -- Sequence ID
+       path character varying(255)      NOT NULL COLLATE pg_catalog."default",                              -- Keys from the top of the reading to the value, joined by '.'
+       ts   timestamp(6) with time zone NOT NULL DEFAULT now(),                                             -- When the path was first seen
+       CONSTRAINT point_paths_pkey PRIMARY KEY (id)
+            USING INDEX TABLESPACE foglamp,
+       CONSTRAINT point_paths_path UNIQUE (path)
+            USING INDEX TABLESPACE foglamp )
+  WITH ( OIDS = FALSE ) TABLESPACE foglamp;
+
+ALTER TABLE foglamp.point_paths OWNER to foglamp;
+COMMENT ON TABLE foglamp.point_paths IS
+'Paths of numeric values in readings.';
+
+
+-- Reading values table
+-- The numeric values of readings, one row per value, written alongside
+-- foglamp.readings when the 'flatten_values' setting of INGST is on
+-- (see foglamp/storage/reading_values.py).
+CREATE TABLE foglamp.reading_values (
+    id            bigint                      NOT NULL DEFAULT nextval('foglamp.reading_values_id_seq'::regclass),
+    reading_id    bigint                      NOT NULL,      -- foglamp.readings.id of the reading
+    asset_code    character varying(50)       NOT NULL,      -- The asset_code of the reading
+    point_path_id integer                     NOT NULL,      -- foglamp.point_paths.id of the value's path
+    user_ts       timestamp(6) with time zone NOT NULL,      -- The user_ts of the reading
+    value         double precision            NOT NULL,
+    CONSTRAINT reading_values_pkey PRIMARY KEY (id)
+         USING INDEX TABLESPACE foglamp
+  )
+  WITH ( OIDS = FALSE )
+  TABLESPACE foglamp;
+
+ALTER TABLE foglamp.reading_values OWNER to foglamp;
+COMMENT ON TABLE foglamp.reading_values IS
+'Numeric values of readings.';
+
+-- Range scans of one value of an asset. Readings of an asset may share
+-- a user_ts, so this is not unique; retransmitted readings are dropped
+-- by the readings insert before their values are written.
+CREATE INDEX reading_values_ix1
+    ON foglamp.reading_values USING btree (asset_code, point_path_id, user_ts)
+    TABLESPACE foglamp;
+
+-- See foglamp.readings_partition_insert()
+CREATE FUNCTION foglamp.reading_values_partition_insert()
+  RETURNS trigger
+  LANGUAGE plpgsql
+AS $$
+BEGIN
+    RETURN NEW;
+END;
+$$;
+
+ALTER FUNCTION foglamp.reading_values_partition_insert() OWNER TO foglamp;
+
+CREATE TRIGGER reading_values_partition
+    BEFORE INSERT ON foglamp.reading_values
+    FOR EACH ROW EXECUTE PROCEDURE foglamp.reading_values_partition_insert();
+
 
 -- Destinations table
 CREATE TABLE foglamp.destinations (
@@ -816,3 +941,94 @@ CREATE INDEX fki_user_asset_permissions_fk2
     ON foglamp.user_asset_permissions USING btree (asset_id)
     TABLESPACE foglamp;
 
+
+
+-- Notifies the admin API processes of changes to users and permissions
+-- (see foglamp/admin_api/model.py). The payload is the id of the user
+-- that changed, or empty when a role's permissions changed.
+CREATE FUNCTION foglamp.notify_users_changed()
+  RETURNS trigger
+  LANGUAGE plpgsql
+AS $$
+DECLARE
+    row RECORD;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        row := OLD;
+    ELSE
+        row := NEW;
+    END IF;
+
+    IF TG_TABLE_NAME = 'users' THEN
+        PERFORM pg_notify('foglamp_users', row.id::text);
+    ELSIF TG_TABLE_NAME = 'user_resource_permissions' THEN
+        PERFORM pg_notify('foglamp_users', row.user_id::text);
+    ELSE
+        PERFORM pg_notify('foglamp_users', '');
+    END IF;
+
+    RETURN NULL;
+END;
+$$;
+
+ALTER FUNCTION foglamp.notify_users_changed() OWNER TO foglamp;
+
+CREATE TRIGGER users_notify
+    AFTER INSERT OR UPDATE OR DELETE ON foglamp.users
+    FOR EACH ROW EXECUTE PROCEDURE foglamp.notify_users_changed();
+
+CREATE TRIGGER user_resource_permissions_notify
+    AFTER INSERT OR UPDATE OR DELETE ON foglamp.user_resource_permissions
+    FOR EACH ROW EXECUTE PROCEDURE foglamp.notify_users_changed();
+
+CREATE TRIGGER role_resource_permission_notify
+    AFTER INSERT OR UPDATE OR DELETE ON foglamp.role_resource_permission
+    FOR EACH ROW EXECUTE PROCEDURE foglamp.notify_users_changed();
+
+
+-- Keeps the previous value of a configuration row in
+-- foglamp.configuration_changes and moves its ts to the time of the change.
+CREATE FUNCTION foglamp.configuration_history()
+  RETURNS trigger
+  LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF NEW.value IS DISTINCT FROM OLD.value THEN
+        INSERT INTO foglamp.configuration_changes ( key, configuration_ts, configuration_value )
+             VALUES ( OLD.key, OLD.ts, OLD.value )
+        ON CONFLICT DO NOTHING;
+        NEW.ts := now();
+    END IF;
+
+    RETURN NEW;
+END;
+$$;
+
+ALTER FUNCTION foglamp.configuration_history() OWNER TO foglamp;
+
+CREATE TRIGGER configuration_history
+    BEFORE UPDATE ON foglamp.configuration
+    FOR EACH ROW EXECUTE PROCEDURE foglamp.configuration_history();
+
+-- Notifies every FogLAMP process of configuration changes (see
+-- foglamp/storage/configuration.py). The payload is the key that changed.
+CREATE FUNCTION foglamp.notify_configuration_changed()
+  RETURNS trigger
+  LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('foglamp_configuration', OLD.key);
+    ELSE
+        PERFORM pg_notify('foglamp_configuration', NEW.key);
+    END IF;
+
+    RETURN NULL;
+END;
+$$;
+
+ALTER FUNCTION foglamp.notify_configuration_changed() OWNER TO foglamp;
+
+CREATE TRIGGER configuration_notify
+    AFTER INSERT OR UPDATE OR DELETE ON foglamp.configuration
+    FOR EACH ROW EXECUTE PROCEDURE foglamp.notify_configuration_changed();
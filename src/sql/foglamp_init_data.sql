@@ -41,28 +41,74 @@ INSERT INTO foglamp.log_codes ( code, description )
 -- Configuration parameters
 DELETE FROM foglamp.configuration;
 
--- CLEAN: The cleaning process is on by default
---        age     : Age of the data to be retained
---        enabled : When true, purging is enabled and data can be removed
+-- PURGE: The cleaning process is on by default
+--        age           : Age in seconds of the readings to be retained
+--        enabled       : When true, purging is enabled and data can be removed
+--        interval      : seconds between purges
+--        batch_size    : maximum number of rows deleted by one statement
+--        budget        : seconds a purge may spend deleting rows; the rest is left for the next purge
+--        pause         : seconds between two deletes, leaving I/O to ingest
+--        retain_unsent : when true, readings not yet sent by an active stream are retained
 INSERT INTO foglamp.configuration ( key, value )
-     VALUES ( 'PURGE', '{ "age" : 259200, "enabled" : true }' );
-
--- LOGPR: Log Partitioning
---        unit: unit used for partitioning. Valid values are minute, half-hour, hour, 6-hour, half-day, day, week, fortnight, month. Default is day
+     VALUES ( 'PURGE', '{ "age" : 259200, "enabled" : true, "interval" : 3600,
+                          "batch_size" : 1000, "budget" : 60, "pause" : 0.05,
+                          "retain_unsent" : true }' );
+
+-- LOGPR: Log Partitioning of foglamp.readings and foglamp.log
+--        unit    : unit used for partitioning. Valid values are minute, half-hour, hour, 6-hour, half-day, day, week, fortnight, month. Default is day
+--        ahead   : number of partitions created beyond the current one
+--        interval: seconds between checks for partitions to create
 INSERT INTO foglamp.configuration ( key, value )
-     VALUES ( 'LOGPR', '{ "unit" : "day" }' );
+     VALUES ( 'LOGPR', '{ "unit" : "day", "ahead" : 2, "interval" : 3600 }' );
 
 -- STRMN: Streaming
---        status      : the process is on or off, it is on by default
---        time window : the time window when the process is active, always active by default (it means every second)
+--        status          : the process is on or off, it is on by default
+--        window          : the time window when the process is active, always active by default (it means every second)
+--                          Otherwise a list of "HH:MM-HH:MM" ranges in local time
+--        batch_size      : maximum number of readings sent in one request
+--        max_in_flight   : maximum number of requests a stream or a destination has waiting for an answer
+--        poll_interval   : seconds between checks for new readings once all have been sent
+--        timeout         : seconds a destination has to answer a request
+--        retry           : seconds to wait before sending again after a failed request
+--        reload_interval : seconds between checks for changes to streams and destinations
+INSERT INTO foglamp.configuration ( key, value )
+     VALUES ( 'STRMN', '{ "status" : "on", "window" : [ "always" ],
+                          "batch_size" : 5000, "max_in_flight" : 4, "poll_interval" : 1,
+                          "timeout" : 60, "retry" : 5, "reload_interval" : 60 }' );
+
+-- INGST: Ingest
+--        batch_size     : maximum number of readings written to foglamp.readings in one INSERT
+--        max_latency    : maximum time in seconds a reading waits in memory before it is written
+--        high_watermark : readings are refused (5.03) once this many are waiting to be written...
+--        low_watermark  : ...until no more than this many are waiting
+--        device_rate    : readings per second a single device may send, 0 means unlimited
+--        device_burst   : readings a device may send at once after being idle
+--        busy_max_age   : seconds a device is asked to wait when readings are refused
+--        dedup_window   : seconds a read_key is remembered to drop retransmitted readings
+--        dedup_size     : maximum number of read_keys remembered
+--        flatten_values : when true, the numeric values of readings are also written to foglamp.reading_values
+INSERT INTO foglamp.configuration ( key, value )
+     VALUES ( 'INGST', '{ "batch_size" : 250, "max_latency" : 0.5,
+                          "high_watermark" : 100000, "low_watermark" : 75000,
+                          "device_rate" : 500, "device_burst" : 1000, "busy_max_age" : 5,
+                          "dedup_window" : 600, "dedup_size" : 100000,
+                          "flatten_values" : false }' );
+
+-- CMPRS: Compression of readings at ingest
+--        default : filter of the assets not in assets. Filters are objects with
+--                  type         : none, deadband or swinging_door
+--                  deviation    : change of a value, in its unit, that is stored
+--                  percent      : deadband only, change in percent of the last stored value that is stored
+--                  max_interval : seconds after which a reading is stored even if unchanged, 0 means never
+--        assets  : asset code -> filter, with an optional "points" object of point path (such as temperature.value) -> filter
 INSERT INTO foglamp.configuration ( key, value )
-     VALUES ( 'STRMN', '{ "status" : "day", "window" : [ "always" ] }' );
+     VALUES ( 'CMPRS', '{ "default" : { "type" : "none" }, "assets" : { } }' );
 
 -- SYPRG: System Purge
---        retention : data retention in seconds. Default is 3 days (259200 seconds)
+--        retention : retention in seconds of foglamp.log. Default is 3 days (259200 seconds)
 --        last purge: ts of the last purge call
 INSERT INTO foglamp.configuration ( key, value )
-     VALUES ( 'SYPRG', to_jsonb( '{ "retention" : 259200, "last purge" : "' || now() || '" }' ) );
+     VALUES ( 'SYPRG', jsonb_build_object( 'retention', 259200, 'last purge', now() ) );
 
 
 -- DELETE data for roles, resources and permissions